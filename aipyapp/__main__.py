@@ -59,6 +59,16 @@ def parse_args():
     agent_parser = subparsers.add_parser('agent', help='Agent mode - HTTP API server for n8n integration')
     agent_parser.add_argument('--port', type=int, default=8848, help="Port for agent mode HTTP server (default: 8848)")
     agent_parser.add_argument('--host', default='127.0.0.1', help="Host for agent mode HTTP server (default: 127.0.0.1)")
+
+    # bench 子命令 - 使用本地假 LLM 服务测量任务执行开销
+    bench_parser = subparsers.add_parser('bench', help='Benchmark mode - run tasks against a local stub LLM server')
+    bench_parser.add_argument('-n', '--tasks', type=int, default=10, help="Number of tasks to run (default: 10)")
+    bench_parser.add_argument('--ttft', type=float, default=0, help="Stub server time to first token in milliseconds")
+    bench_parser.add_argument('--tps', type=float, default=0, help="Stub server output tokens per second, 0 for unlimited")
+    bench_parser.add_argument('--script', default=None, help="JSON file with the scripted stub responses")
+    bench_parser.add_argument('--instruction', default=None, help="Instruction for each task")
+    bench_parser.add_argument('--no-display', dest='display', action='store_false', help="Run tasks without a display plugin")
+    bench_parser.add_argument('--output', default=None, help="Save results to a JSON file")
     
     return parser.parse_args()
 
@@ -139,9 +149,20 @@ def init_settings(conf, args):
     # 处理 agent 模式的特殊参数
     if command == 'agent':
         settings['agent'] = {'port': args.port, 'host': args.host}
+    elif command == 'bench':
+        settings['bench'] = {
+            'tasks': args.tasks,
+            'ttft': args.ttft,
+            'tps': args.tps,
+            'script': args.script,
+            'instruction': args.instruction,
+            'display': args.display,
+            'output': args.output,
+        }
 
     #TODO: remove these lines
-    if conf.check_config(gui=True) == 'TrustToken':
+    # bench 模式使用本地假 LLM 服务，不需要配置 LLM
+    if command != 'bench' and conf.check_config(gui=True) == 'TrustToken':
         from .config import LLMConfig
         llm_config = LLMConfig(CONFIG_DIR / "config")
         if llm_config.need_config():
@@ -165,6 +186,8 @@ def get_aipy_main(args, settings):
         ensure_pkg('fastapi')
         ensure_pkg('uvicorn')
         from .cli.cli_agent import main as aipy_main
+    elif command == 'bench':
+        from .cli.cli_bench import main as aipy_main
     elif command == 'python':
         from .cli.cli_python import main as aipy_main
     elif command == 'ipython':
@@ -5,7 +5,6 @@ import uuid
 import time
 import asyncio
 from typing import Dict, Any, Optional
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from loguru import logger
@@ -13,6 +12,9 @@ from loguru import logger
 from .taskmgr import TaskManager
 from .task import Task
 
+# 默认同时执行的任务数，可以用 max_concurrent_tasks 配置
+MAX_CONCURRENT_TASKS = 4
+
 class AgentTask:
     """Agent任务封装"""
     
@@ -49,8 +51,10 @@ class AgentTaskManager(TaskManager):
         
         # Agent特有属性
         self.agent_tasks: Dict[str, AgentTask] = {}
-        self.executor = ThreadPoolExecutor(max_workers=4)  # 支持并发
         self.log = logger.bind(src='agent_taskmgr')
+        # 限制同时执行的任务数，超出的任务等待空闲名额
+        self.max_concurrent_tasks = settings.get('max_concurrent_tasks') or MAX_CONCURRENT_TASKS
+        self._slots = asyncio.Semaphore(self.max_concurrent_tasks)
         
     async def submit_task(self, instruction: str, metadata: Dict[str, Any] = None) -> str:
         """提交新任务"""
@@ -96,16 +100,14 @@ class AgentTaskManager(TaskManager):
             raise ValueError(f"Task {task_id} is not in pending status")
         
         agent_task.status = 'running'
-        agent_task.started_at = datetime.now()
         
         try:
-            # 在线程池中执行任务
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(
-                self.executor,
-                self._run_task_sync,
-                agent_task
-            )
+            async with self._slots:
+                if agent_task.status == 'cancelled':
+                    # 等待名额时被取消
+                    return agent_task.to_dict()
+                agent_task.started_at = datetime.now()
+                await self._run_task(agent_task)
             
             agent_task.status = 'completed'
             agent_task.completed_at = datetime.now()
@@ -118,14 +120,14 @@ class AgentTaskManager(TaskManager):
             
         return agent_task.to_dict()
     
-    def _run_task_sync(self, agent_task: AgentTask):
-        """同步执行任务（在线程池中运行）"""
+    async def _run_task(self, agent_task: AgentTask):
+        """执行任务：LLM 请求在事件循环中异步等待，只有代码执行等同步操作占用线程"""
         try:
             # 执行任务
-            agent_task.task.run(agent_task.instruction)
+            await agent_task.task.arun(agent_task.instruction)
             
             # 确保任务完成
-            agent_task.task.done()
+            await asyncio.to_thread(agent_task.task.done)
             
         except Exception as e:
             # 捕获异常并记录到display中
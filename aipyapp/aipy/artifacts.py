@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+大型工具输出的落盘存储
+
+超过阈值的工具输出（代码执行的 stdout/stderr、MCP 结果、子任务结果）保存到任务目录下的 artifacts 子目录，
+上下文中只保留开头和结尾的摘录以及 artifact ID，LLM 需要时通过 Artifact 工具分页读取或搜索完整内容。
+"""
+
+import re
+import hashlib
+from pathlib import Path
+from typing import List, Tuple
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+ARTIFACT_DIR = "artifacts"
+SPILL_NOTE = (
+    "\n... [{omitted} chars omitted. Full output ({size} chars, {lines} lines) saved as artifact "
+    "\"{id}\" ({path}). Use the Artifact tool to read or search it.] ...\n"
+)
+
+
+class ArtifactConfig(BaseModel):
+    """工具输出落盘配置"""
+    enable: bool = Field(True, description="是否把大型工具输出保存为 artifact")
+    threshold: int = Field(16 * 1024, gt=0, description="超过多少字符时保存为 artifact")
+    excerpt: int = Field(2000, ge=0, description="上下文中保留的开头和结尾各多少字符")
+
+
+class ArtifactError(Exception):
+    pass
+
+
+class ArtifactStore:
+    """任务的 artifact 目录，文件名为内容哈希，同样的输出只保存一份"""
+
+    def __init__(self, path: Path, config: ArtifactConfig | dict | None = None):
+        if isinstance(config, ArtifactConfig):
+            self.config = config
+        else:
+            self.config = ArtifactConfig(**(config or {}))
+        self.path = Path(path)
+        self.log = logger.bind(src='artifacts')
+
+    def should_spill(self, text: str | None) -> bool:
+        return bool(self.config.enable and text and len(text) > self.config.threshold)
+
+    def _file(self, id: str) -> Path:
+        if not re.fullmatch(r'[0-9a-f]{12}', id or ''):
+            raise ArtifactError(f'Invalid artifact id: {id}')
+        return self.path / f"{id}.txt"
+
+    def save(self, text: str) -> str:
+        """保存内容，返回 artifact ID"""
+        id = hashlib.sha1(text.encode('utf-8', errors='replace')).hexdigest()[:12]
+        file = self._file(id)
+        if not file.exists():
+            self.path.mkdir(parents=True, exist_ok=True)
+            file.write_text(text, encoding='utf-8', errors='replace')
+            self.log.info('Saved artifact', id=id, size=len(text))
+        return id
+
+    def spill(self, text: str) -> str:
+        """保存超过阈值的内容，返回带有 artifact ID 的摘录；未超过阈值时原样返回"""
+        if not self.should_spill(text):
+            return text
+        id = self.save(text)
+        n = self.config.excerpt
+        head, tail = text[:n], text[-n:] if n else ''
+        note = SPILL_NOTE.format(
+            omitted=len(text) - len(head) - len(tail),
+            size=len(text),
+            lines=text.count('\n') + 1,
+            id=id,
+            path=f"{ARTIFACT_DIR}/{id}.txt",
+        )
+        return head + note + tail
+
+    def _lines(self, id: str) -> List[str]:
+        file = self._file(id)
+        if not file.exists():
+            raise ArtifactError(f'Artifact not found: {id}')
+        return file.read_text(encoding='utf-8', errors='replace').splitlines()
+
+    def read(self, id: str, offset: int = 0, limit: int = 100) -> Tuple[List[Tuple[int, str]], int]:
+        """读取从 offset 行开始（0 起始）的 limit 行，返回 [(行号, 内容)] 和总行数"""
+        lines = self._lines(id)
+        selected = lines[offset:offset + limit]
+        return list(enumerate(selected, start=offset + 1)), len(lines)
+
+    def grep(self, id: str, pattern: str, offset: int = 0, limit: int = 100) -> Tuple[List[Tuple[int, str]], int]:
+        """按正则表达式搜索，返回第 offset 个匹配开始的 limit 个匹配行 [(行号, 内容)] 和匹配总数"""
+        try:
+            regex = re.compile(pattern)
+        except re.error as e:
+            raise ArtifactError(f'Invalid pattern: {e}') from e
+        matches = [(i, line) for i, line in enumerate(self._lines(id), start=1) if regex.search(line)]
+        return matches[offset:offset + limit], len(matches)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+图片附件存储
+
+本地图片按文件内容哈希保存到 CONFIG_DIR 下的 attachments 目录（可选缩小到模型建议的尺寸），
+消息中只保存 "attachment:<文件名>" 形式的引用，发送请求时才生成 data URL。
+同一张图片在所有任务中只保存一份，task.json 和消息 ID 的哈希计算都不再包含 base64 数据。
+"""
+
+import io
+import hashlib
+import mimetypes
+import threading
+from base64 import b64encode
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from .config import CONFIG_DIR
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+ATTACHMENTS_DIR = CONFIG_DIR / "attachments"
+ATTACHMENT_SCHEME = "attachment:"
+
+# 不缩小时可以原样发送的格式
+PASSTHROUGH_FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+
+
+class AttachmentError(Exception):
+    pass
+
+
+class AttachmentConfig(BaseModel):
+    """图片附件配置"""
+    enable: bool = Field(False, description="是否使用附件存储，关闭时图片直接以 data URL 保存在消息中")
+    path: Optional[str] = Field(None, description="附件目录")
+    max_size: int = Field(1568, ge=0, description="图片长边的最大像素数，0 表示不缩小")
+    quality: int = Field(85, ge=1, le=100, description="重新编码 JPEG/WEBP 图片的质量")
+    cache_size: int = Field(8, ge=0, description="内存中缓存的 data URL 个数，0 表示不缓存")
+
+
+class AttachmentStore:
+    """按内容哈希保存图片附件"""
+
+    def __init__(self, config: AttachmentConfig | dict | None = None):
+        if isinstance(config, AttachmentConfig):
+            self.config = config
+        else:
+            self.config = AttachmentConfig(**(config or {}))
+        self.path = Path(self.config.path or ATTACHMENTS_DIR).expanduser()
+        self.log = logger.bind(src='attachments')
+        self._lock = threading.Lock()
+        # 附件名（内容哈希）-> data URL，最近使用的排在最后
+        self._cache: OrderedDict[str, str] = OrderedDict()
+
+    @staticmethod
+    def is_ref(url: str) -> bool:
+        return url.startswith(ATTACHMENT_SCHEME)
+
+    def _file(self, name: str) -> Path:
+        if not name or '/' in name or '\\' in name or name.startswith('.'):
+            raise AttachmentError(f'Invalid attachment: {name}')
+        return self.path / name[:2] / name
+
+    def _downscale(self, data: bytes, max_size: int) -> tuple[bytes, str] | None:
+        """缩小图片或转换为通用格式，返回 (数据, 扩展名)；不需要处理时返回 None"""
+        if Image is None:
+            return None
+        with Image.open(io.BytesIO(data)) as img:
+            fmt = img.format
+            resize = bool(max_size) and max(img.size) > max_size
+            if not resize and fmt in PASSTHROUGH_FORMATS:
+                return None
+            if resize:
+                img.thumbnail((max_size, max_size))
+            buf = io.BytesIO()
+            if fmt in ('JPEG', 'WEBP'):
+                img.convert('RGB').save(buf, format=fmt, quality=self.config.quality)
+                return buf.getvalue(), '.jpg' if fmt == 'JPEG' else '.webp'
+            if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                img = img.convert('RGBA')
+            img.save(buf, format='PNG', optimize=True)
+            return buf.getvalue(), '.png'
+
+    def add_image(self, path: Union[str, Path], max_size: int | None = None) -> str:
+        """保存本地图片，返回附件引用"""
+        path = Path(path)
+        data = path.read_bytes()
+        if max_size is None:
+            max_size = self.config.max_size
+        digest = hashlib.sha1(data).hexdigest()[:20]
+        ext = path.suffix.lower() or '.bin'
+
+        with self._lock:
+            # 已经保存过同一张图片（同样的尺寸限制）时直接返回
+            existing = list((self.path / digest[:2]).glob(f"{digest}_{max_size}.*"))
+            if existing:
+                return ATTACHMENT_SCHEME + existing[0].name
+
+            try:
+                processed = self._downscale(data, max_size)
+            except Exception as e:
+                self.log.warning('Failed to process image, using original', path=str(path), error=str(e))
+                processed = None
+            if processed:
+                data, ext = processed
+
+            name = f"{digest}_{max_size}{ext}"
+            file = self._file(name)
+            file.parent.mkdir(parents=True, exist_ok=True)
+            file.write_bytes(data)
+        self.log.info('Saved attachment', name=name, source=str(path), size=len(data))
+        return ATTACHMENT_SCHEME + name
+
+    def resolve(self, url: str) -> str:
+        """把附件引用转换为 data URL，其它 URL 原样返回"""
+        if not self.is_ref(url):
+            return url
+        name = url[len(ATTACHMENT_SCHEME):]
+        with self._lock:
+            data_url = self._cache.get(name)
+            if data_url is not None:
+                self._cache.move_to_end(name)
+                return data_url
+
+        file = self._file(name)
+        try:
+            data = file.read_bytes()
+        except OSError as e:
+            raise AttachmentError(f'Attachment not found: {name}') from e
+        mime = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        data_url = f"data:{mime};base64,{b64encode(data).decode('ascii')}"
+
+        if self.config.cache_size:
+            with self._lock:
+                self._cache[name] = data_url
+                while len(self._cache) > self.config.cache_size:
+                    self._cache.popitem(last=False)
+        return data_url
+
+    @staticmethod
+    def has_refs(content: Any) -> bool:
+        """消息内容中是否有附件引用"""
+        return isinstance(content, list) and any(
+            item.get('type') == 'image_url' and AttachmentStore.is_ref(item['image_url']['url']) for item in content
+        )
+
+    def inline(self, content: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """返回把附件引用替换为 data URL 的消息内容，附件文件丢失时替换为一段说明文字"""
+        items = []
+        for item in content:
+            if item.get('type') == 'image_url' and self.is_ref(item['image_url']['url']):
+                url = item['image_url']['url']
+                try:
+                    item = {'type': 'image_url', 'image_url': {'url': self.resolve(url)}}
+                except Exception:
+                    item = {'type': 'text', 'text': f'[Image attachment not found: {url}]'}
+            items.append(item)
+        return items
+
+
+def create_attachment_store(config: AttachmentConfig | dict | None) -> Optional[AttachmentStore]:
+    """根据配置创建附件存储，未启用时返回 None"""
+    if not isinstance(config, AttachmentConfig):
+        config = AttachmentConfig(**(config or {}))
+    return AttachmentStore(config) if config.enable else None
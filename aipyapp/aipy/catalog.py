@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+持久化的任务目录
+
+所有任务（包括子任务）的摘要保存在 CONFIG_DIR 下的 SQLite 数据库中，
+在 task_started、step_completed 和 task_completed 事件时更新：
+ID、父任务、任务目录、第一条指令、标题、LLM、token 用量、耗时、Step 数和状态。
+
+第一条指令和最后一个 Step 的回复建有全文索引（FTS5 trigram，可以搜索中文子串），
+/task list、resume 路径补齐和 Agent API 直接查询数据库，不再扫描工作目录和解析 task.json。
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import sqlite3
+import threading
+import weakref
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from .config import CONFIG_DIR
+
+if TYPE_CHECKING:
+    from .task import Task
+
+TASK_CATALOG_FILE = CONFIG_DIR / "tasks.db"
+
+# trigram 分词器要求查询至少 3 个字符，更短的查询使用 LIKE
+_TRIGRAM_MIN = 3
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    parent_id TEXT,
+    path TEXT,
+    file TEXT,
+    instruction TEXT,
+    title TEXT,
+    client TEXT,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    elapsed REAL NOT NULL DEFAULT 0,
+    steps INTEGER NOT NULL DEFAULT 0,
+    status TEXT,
+    start_time REAL,
+    update_time REAL,
+    response TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_update_time ON tasks (update_time);
+CREATE INDEX IF NOT EXISTS tasks_parent_time ON tasks (parent_id, update_time);
+CREATE INDEX IF NOT EXISTS tasks_path ON tasks (path);
+'''
+
+# 外部内容的全文索引，由触发器与 tasks 表保持同步
+_FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+    instruction, response, content='tasks', content_rowid='rowid', tokenize='{tokenize}'
+);
+CREATE TRIGGER IF NOT EXISTS tasks_ai AFTER INSERT ON tasks BEGIN
+    INSERT INTO tasks_fts (rowid, instruction, response) VALUES (new.rowid, new.instruction, new.response);
+END;
+CREATE TRIGGER IF NOT EXISTS tasks_ad AFTER DELETE ON tasks BEGIN
+    INSERT INTO tasks_fts (tasks_fts, rowid, instruction, response) VALUES ('delete', old.rowid, old.instruction, old.response);
+END;
+CREATE TRIGGER IF NOT EXISTS tasks_au AFTER UPDATE OF instruction, response ON tasks BEGIN
+    INSERT INTO tasks_fts (tasks_fts, rowid, instruction, response) VALUES ('delete', old.rowid, old.instruction, old.response);
+    INSERT INTO tasks_fts (rowid, instruction, response) VALUES (new.rowid, new.instruction, new.response);
+END;
+'''
+
+_COLUMNS = ('id, parent_id, path, file, instruction, title, client, input_tokens, output_tokens, total_tokens, '
+            'elapsed, steps, status, start_time, update_time')
+
+
+class TaskCatalogConfig(BaseModel):
+    """任务目录配置"""
+    enable: bool = Field(True, description="是否把任务摘要记录到任务目录数据库")
+    path: Optional[str] = Field(None, description="数据库文件路径")
+
+
+def _message_text(response: Any) -> Optional[str]:
+    """回复消息的文本内容"""
+    message = getattr(response, 'message', None)
+    content = getattr(message, 'content', None)
+    return content if isinstance(content, str) else None
+
+
+class TaskCatalog:
+    """基于 SQLite 的任务目录"""
+
+    def __init__(self, path: Union[str, Path, None] = None):
+        self.path = Path(path or TASK_CATALOG_FILE).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.log = logger.bind(src='catalog')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        self.tokenize = self._init_fts()
+        self._conn.commit()
+
+    def _init_fts(self) -> Optional[str]:
+        """创建全文索引，返回使用的分词器；SQLite 不支持 FTS5 时返回 None，搜索退回 LIKE"""
+        row = self._conn.execute("SELECT sql FROM sqlite_master WHERE name = 'tasks_fts'").fetchone()
+        if row is not None:
+            return 'trigram' if 'trigram' in row['sql'] else 'unicode61'
+        for tokenize in ('trigram', 'unicode61'):
+            try:
+                self._conn.executescript(_FTS_SCHEMA.format(tokenize=tokenize))
+            except sqlite3.OperationalError as e:
+                self.log.debug('FTS5 tokenizer not available', tokenize=tokenize, error=str(e))
+                continue
+            # 已有的记录（例如从旧版本升级）加入索引
+            self._conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+            return tokenize
+        self.log.warning('FTS5 not available, full-text search falls back to LIKE')
+        return None
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+        return cursor
+
+    def _query(self, sql: str, params=()) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+    def task_started(self, task_id: str, *, path: str, file: str, instruction: str, title: str | None = None,
+                     client: str | None = None, parent_id: str | None = None, start_time: float | None = None):
+        """任务开始：创建记录，已有记录（例如同一 ID 重新开始）时重置状态"""
+        now = time.time()
+        self._execute('''
+            INSERT INTO tasks (id, parent_id, path, file, instruction, title, client, status, start_time, update_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'running', ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                parent_id = excluded.parent_id, path = excluded.path, file = excluded.file,
+                instruction = excluded.instruction, title = excluded.title, client = excluded.client,
+                status = 'running', update_time = excluded.update_time
+        ''', (task_id, parent_id, path, file, instruction, title, client, start_time or now, now))
+
+    def step_completed(self, task_id: str, summary: Dict[str, Any], response: str | None = None, **task):
+        """Step 结束：累加 token 用量、耗时和 Step 数，记录最后的回复。
+
+        task 是 task_started 的参数，用于补建开始记录之前（例如从文件恢复的旧任务）没有记录的任务。
+        """
+        with self._lock:
+            if task:
+                self._conn.execute('INSERT OR IGNORE INTO tasks (id, parent_id, path, file, instruction, title, client, start_time) '
+                                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                   (task_id, task.get('parent_id'), task.get('path'), task.get('file'),
+                                    task.get('instruction'), task.get('title'), task.get('client'), task.get('start_time')))
+            self._conn.execute('''
+                UPDATE tasks SET
+                    input_tokens = input_tokens + ?, output_tokens = output_tokens + ?, total_tokens = total_tokens + ?,
+                    elapsed = elapsed + ?, steps = steps + 1, response = COALESCE(?, response),
+                    client = COALESCE(?, client), status = 'running', update_time = ?
+                WHERE id = ?
+            ''', (summary.get('input_tokens', 0), summary.get('output_tokens', 0), summary.get('total_tokens', 0),
+                  summary.get('elapsed_time', 0), response, task.get('client'), time.time(), task_id))
+            self._conn.commit()
+
+    def task_completed(self, task_id: str, path: str | None = None):
+        """任务结束：更新状态和重命名后的目录，子任务目录随之移动"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT path FROM tasks WHERE id = ?', (task_id,)).fetchone()
+            if path and row is not None and row['path'] and row['path'] != path:
+                old = row['path']
+                self._conn.execute('''
+                    UPDATE tasks SET path = ? || substr(path, ?) WHERE substr(path, 1, ?) = ?
+                ''', (path, len(old) + 1, len(old) + 1, old + os.sep))
+            self._conn.execute("UPDATE tasks SET path = COALESCE(?, path), status = 'completed', update_time = ? WHERE id = ?",
+                               (path, now, task_id))
+            self._conn.commit()
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query(f'SELECT {_COLUMNS} FROM tasks WHERE id = ?', (task_id,))
+        return rows[0] if rows else None
+
+    def list(self, limit: int = 20, offset: int = 0, parent_id: str | None = None, roots: bool = True) -> List[Dict[str, Any]]:
+        """按更新时间倒序列出任务，默认只列出根任务"""
+        where, params = self._where(parent_id, roots)
+        return self._query(f'SELECT {_COLUMNS} FROM tasks {where} ORDER BY update_time DESC LIMIT ? OFFSET ?',
+                           (*params, limit, offset))
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, roots: bool = True) -> List[Dict[str, Any]]:
+        """在指令和回复中搜索，结果按更新时间倒序"""
+        query = query.strip()
+        if not query:
+            return self.list(limit, offset, roots=roots)
+        where, params = self._where(None, roots)
+        if self.tokenize and (self.tokenize != 'trigram' or len(query) >= _TRIGRAM_MIN):
+            phrase = '"' + query.replace('"', '""') + '"'
+            where = f"{where} {'AND' if where else 'WHERE'} rowid IN (SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH ?)"
+            params = (*params, phrase)
+        else:
+            pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            where = f"{where} {'AND' if where else 'WHERE'} (instruction LIKE ? ESCAPE '\\' OR response LIKE ? ESCAPE '\\')"
+            params = (*params, pattern, pattern)
+        return self._query(f'SELECT {_COLUMNS} FROM tasks {where} ORDER BY update_time DESC LIMIT ? OFFSET ?',
+                           (*params, limit, offset))
+
+    def find_path(self, prefix: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """目录以 prefix 开头的根任务"""
+        # 用范围查询代替 LIKE，可以使用 path 索引
+        return self._query(f"SELECT {_COLUMNS} FROM tasks WHERE path >= ? AND path < ? AND parent_id IS NULL "
+                           "ORDER BY update_time DESC LIMIT ?", (prefix, prefix + '\U0010ffff', limit))
+
+    @staticmethod
+    def _where(parent_id: str | None, roots: bool):
+        if parent_id:
+            return 'WHERE parent_id = ?', (parent_id,)
+        if roots:
+            return 'WHERE parent_id IS NULL', ()
+        return '', ()
+
+    def delete(self, task_id: str) -> bool:
+        return self._execute('DELETE FROM tasks WHERE id = ?', (task_id,)).rowcount > 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TaskRecorder:
+    """任务事件监听器，把任务的开始、Step 结束和任务结束记录到任务目录"""
+
+    def __init__(self, catalog: TaskCatalog, task: Task):
+        self.catalog = catalog
+        self._task = weakref.ref(task)
+        self.log = logger.bind(src='catalog')
+
+    def get_handlers(self):
+        return {
+            'task_started': self.on_task_started,
+            'step_completed': self.on_step_completed,
+            'task_completed': self.on_task_completed,
+        }
+
+    def _task_info(self, task: Task) -> Dict[str, Any]:
+        from .journal import TASK_FILE
+        from .taskfile import TASK_BIN_FILE
+        return {
+            'path': str(task.cwd),
+            'file': TASK_BIN_FILE if task.file_config.format == 'binary' else TASK_FILE,
+            'client': task.client.name,
+            'parent_id': task.parent.task_id if task.parent else None,
+        }
+
+    def on_task_started(self, event):
+        task = self._task()
+        if task is None:
+            return
+        self.catalog.task_started(event.task_id, instruction=event.instruction, title=event.title,
+                                  start_time=event.timestamp, **self._task_info(task))
+
+    def on_step_completed(self, event):
+        task = self._task()
+        if task is None:
+            return
+        info = self._task_info(task)
+        info.update(instruction=task.instruction, title=task.steps[0].data.title if task.steps else None,
+                    start_time=task.start_time)
+        self.catalog.step_completed(task.task_id, event.summary, _message_text(event.response), **info)
+
+    def on_task_completed(self, event):
+        self.catalog.task_completed(event.task_id, event.path)
+
+
+def create_task_catalog(config: TaskCatalogConfig | dict | None) -> Optional[TaskCatalog]:
+    """根据配置创建任务目录，未启用或创建失败时返回 None"""
+    if not isinstance(config, TaskCatalogConfig):
+        config = TaskCatalogConfig(**(config or {}))
+    if not config.enable:
+        return None
+    try:
+        return TaskCatalog(config.path)
+    except Exception as e:
+        logger.bind(src='catalog').warning('Failed to open task catalog', path=config.path, error=str(e))
+        return None
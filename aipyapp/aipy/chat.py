@@ -1,13 +1,17 @@
 import hashlib
 import base64
 from collections import Counter
-from typing import Optional, List, Union, Dict
+from typing import TYPE_CHECKING, Any, Callable, Optional, List, Union, Dict, Set, Tuple
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, model_serializer
 
 from ..llm import MessageRole, AIMessage, UserMessage, SystemMessage, ErrorMessage, ToolMessage
 from .types import InstanceTrackerMixin
 
+if TYPE_CHECKING:
+    from .msgstore import MessageStore
+    from .attachments import AttachmentStore
+
 class ChatMessage(InstanceTrackerMixin, BaseModel):
     id: str
     message: Union[AIMessage, UserMessage, SystemMessage, ErrorMessage, ToolMessage] = Field(exclude=True, default=None)
@@ -48,12 +52,102 @@ class ChatMessage(InstanceTrackerMixin, BaseModel):
     
 class MessageStorage(BaseModel):
     messages: Dict[str, Union[AIMessage, UserMessage, SystemMessage, ErrorMessage, ToolMessage]] = Field(default_factory=dict)
+    # 保存在共享消息存储（MessageStore）中的消息 ID
+    shared: List[str] = Field(default_factory=list)
+
+    # 消息 ID -> (消息对象, 发送给 LLM 的字典)，消息对象被替换时缓存失效
+    _wire: Dict[str, Tuple[Any, Dict[str, Any]]] = PrivateAttr(default_factory=dict)
+    _store: Optional['MessageStore'] = PrivateAttr(default=None)
+    # 还没有从共享存储读取的消息 ID
+    _pending: Set[str] = PrivateAttr(default_factory=set)
+    # 还没有写入共享存储的消息 ID，由 persist() 写入
+    _unshared: List[str] = PrivateAttr(default_factory=list)
+    _shared_ids: Set[str] = PrivateAttr(default_factory=set)
+    # 按顺序记录 store() 新增的消息 ID，从共享存储或任务文件读取的消息不在其中（任务日志使用）
+    _added: List[str] = PrivateAttr(default_factory=list)
+    _attachments: Optional['AttachmentStore'] = PrivateAttr(default=None)
+    # 还没有解码的消息 ID 及解码函数（二进制任务文件按需读取消息内容）
+    _deferred: Set[str] = PrivateAttr(default_factory=set)
+    _loader: Optional[Callable[[], Dict[str, Any]]] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context):
+        self._shared_ids = set(self.shared)
+        self._pending = self._shared_ids - self.messages.keys()
+        store = __context.get('message_store') if __context else None
+        if store is not None:
+            self.attach(store)
 
     def __len__(self):
-        return len(self.messages)
+        return len(self.messages) + len(self._pending) + len(self._deferred)
 
     def __contains__(self, id: str) -> bool:
-        return id in self.messages
+        return id in self.messages or id in self._pending or id in self._deferred
+
+    def defer(self, ids: List[str], loader: Callable[[], Dict[str, Any]]):
+        """消息内容延迟解码：第一次访问其中任一消息时调用 loader 解码全部消息"""
+        self._deferred = set(ids) - self.messages.keys()
+        self._loader = loader
+
+    def load_deferred(self):
+        """解码所有延迟读取的消息"""
+        loader, self._loader = self._loader, None
+        if loader is None:
+            return
+        for id, msg in loader().items():
+            if id not in self.messages:
+                self.messages[id] = msg
+                self._track(id, msg)
+        self._deferred.clear()
+
+    def attach(self, store: 'MessageStore'):
+        """使用共享消息存储，之后 persist() 把消息内容写入共享存储，加载时按需读取"""
+        self._store = store
+        self._unshared = [id for id, msg in self.messages.items()
+                          if id not in self._shared_ids and msg.role != MessageRole.ASSISTANT]
+
+    @property
+    def added(self) -> List[str]:
+        return self._added
+
+    def is_shared(self, id: str) -> bool:
+        """消息内容是否已经写入共享存储"""
+        return id in self._shared_ids
+
+    def _track(self, id: str, message):
+        """记录需要写入共享存储的新消息"""
+        # AI 消息的 usage 等字段不参与 ID 计算，不放入共享存储
+        if self._store is not None and message.role != MessageRole.ASSISTANT:
+            self._unshared.append(id)
+
+    def persist(self) -> int:
+        """把新消息写入共享存储并记入 shared，保存任务之前调用，返回写入的条数"""
+        if self._store is None or not self._unshared:
+            return 0
+        unshared, self._unshared = self._unshared, []
+        count = self._store.put_many({id: self.messages[id] for id in unshared})
+        self.shared.extend(unshared)
+        self._shared_ids.update(unshared)
+        return count
+
+    def use_attachments(self, attachments: 'AttachmentStore'):
+        """发送请求时把消息中的附件引用转换为 data URL"""
+        self._attachments = attachments
+
+    @model_serializer(mode='wrap')
+    def _serialize(self, handler, info):
+        self.load_deferred()
+        if self._store is None:
+            data = handler(self)
+            if not data.get('shared'):
+                data.pop('shared', None)
+            return data
+
+        # shared 中的消息内容已由 persist() 写入共享存储，只保存 ID
+        shared = self._shared_ids
+        return {
+            'messages': {id: msg.model_dump(mode=info.mode) for id, msg in self.messages.items() if id not in shared},
+            'shared': self.shared,
+        }
     
     def _compute_id(self, message: Union[AIMessage, UserMessage, SystemMessage, ErrorMessage, ToolMessage]) -> str:
         """Compute short hash of message role + content using Base64-encoded 8-byte SHA-1"""
@@ -69,10 +163,55 @@ class MessageStorage(BaseModel):
             message = self.messages[id]
         except KeyError:
             self.messages[id] = message
+            self._added.append(id)
+            if id in self._pending:
+                self._pending.discard(id)
+            else:
+                self._track(id, message)
         return ChatMessage(id=id, message=message)
 
     def get(self, id: str) -> Optional[Union[AIMessage, UserMessage, SystemMessage, ErrorMessage, ToolMessage]]:
-        return self.messages.get(id)
+        message = self.messages.get(id)
+        if message is None and id in self._deferred:
+            self.load_deferred()
+            message = self.messages.get(id)
+        if message is None and id in self._pending and self._store is not None:
+            self.load_pending()
+            message = self.messages.get(id)
+        return message
+
+    def load_pending(self):
+        """一次读取所有还没有从共享存储读取的消息"""
+        if not self._pending or self._store is None:
+            return
+        loaded = self._store.get_many(self._pending)
+        self.messages.update(loaded)
+        self._pending.difference_update(loaded)
+
+    def to_wire(self, message: ChatMessage) -> Dict[str, Any]:
+        """
+        返回消息发送给 LLM 的字典格式，按消息 ID 缓存
+
+        每轮请求直接引用缓存的字典，不再重新构造历史消息，调用方不能修改返回值
+        """
+        msg = message.message
+        if msg is None:
+            return {}
+        entry = self._wire.get(message.id)
+        if entry is None or entry[0] is not msg:
+            data = msg.dict()
+            attachments = self._attachments
+            if attachments is not None and attachments.has_refs(data.get('content')):
+                # 附件的 data URL 不随消息缓存，由附件存储按内容哈希做 LRU 缓存
+                data['content'] = attachments.inline(data['content'])
+                return data
+            entry = (msg, data)
+            self._wire[message.id] = entry
+        return entry[1]
+
+    def invalidate(self, id: str):
+        """原地修改消息后调用，使缓存的字典失效"""
+        self._wire.pop(id, None)
 
 class ChatMessages(BaseModel):
     messages: list[ChatMessage] = Field(default_factory=list)
@@ -2,55 +2,145 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import annotations
+import json
+import time
+import queue
+import asyncio
+import threading
 from typing import TYPE_CHECKING, List
 from loguru import logger
 
 from .. import __version__
-from ..llm import ModelCapability, AIMessage
+from ..llm import ModelCapability, AIMessage, ErrorMessage, RequestCancelled
+from ..llm.routing import RequestRace
 from .chat import ChatMessage
+from .context import create_token_estimator
 
 if TYPE_CHECKING:
     from .task import Task
 
 class LineReceiver(list):
+    """按行组装流式数据
+
+    未完成的行以片段列表保存，只在新数据中查找换行符，超长单行的组装是线性时间。
+    """
     def __init__(self):
         super().__init__()
-        self.buffer = ""
+        self._fragments: List[str] = []
+
+    @property
+    def buffer(self) -> str:
+        return ''.join(self._fragments)
 
     @property
     def content(self):
         return '\n'.join(self)
     
     def feed(self, data: str):
-        self.buffer += data
-        new_lines = []
+        pos = data.find('\n')
+        if pos < 0:
+            if data:
+                self._fragments.append(data)
+            return []
 
-        while '\n' in self.buffer:
-            line, self.buffer = self.buffer.split('\n', 1)
+        new_lines = []
+        start = 0
+        while pos >= 0:
+            if self._fragments:
+                self._fragments.append(data[start:pos])
+                line = ''.join(self._fragments)
+                self._fragments = []
+            else:
+                line = data[start:pos]
             if line:
                 self.append(line)
                 new_lines.append(line)
+            start = pos + 1
+            pos = data.find('\n', start)
 
+        if start < len(data):
+            self._fragments.append(data[start:])
         return new_lines
     
     def empty(self):
-        return not self and not self.buffer
+        return not self and not self._fragments
     
     def done(self):
         buffer = self.buffer
         if buffer:
             self.append(buffer)
-            self.buffer = ""
+            self._fragments = []
         return buffer
 
 class StreamProcessor:
-    """流式数据处理器，负责处理 LLM 流式响应并发送事件"""
+    """流式数据处理器，负责处理 LLM 流式响应并发送事件
+
+    对冲请求时多个 StreamProcessor 共享一个 RequestRace，只有收到首个 token 并认领成功的一方发送事件，
+    落后的一方抛出 RequestCancelled 终止请求；同步请求时客户端通过 cancelled/on_cancel/wait_cancelled
+    在重试前和等待响应时提前结束落后的请求。
+
+    完整的行先缓存起来，距离上次发送超过 COALESCE_INTERVAL 秒或累计超过 COALESCE_LINES 行时
+    合并成一个 stream 事件发送，事件数量与响应的行数和时长成正比，而不是与数据块数量成正比。
+    """
+    COALESCE_INTERVAL = 0.05
+    COALESCE_LINES = 64
     
-    def __init__(self, task, name):
+    def __init__(self, task, name, race: RequestRace | None = None):
         self.task = task
         self.name = name
+        self.race = race
         self.lr = LineReceiver()
         self.lr_reason = LineReceiver()
+        self.start_time = time.time()
+        self.first_token_time = None
+        self._pending = []
+        self._lines: List[str] = []
+        self._lines_reason = False
+        self._last_flush = 0.0
+
+    def _emit(self, event, **kwargs):
+        if self.race is None or self.race.winner == self.name:
+            self.task.emit(event, **kwargs)
+        else:
+            self._pending.append((event, kwargs))
+
+    def _queue_lines(self, lines: List[str], reason: bool):
+        if self._lines and self._lines_reason != reason:
+            self._flush_lines()
+        self._lines.extend(lines)
+        self._lines_reason = reason
+        if (len(self._lines) >= self.COALESCE_LINES or
+                time.monotonic() - self._last_flush >= self.COALESCE_INTERVAL):
+            self._flush_lines()
+
+    def _flush_lines(self):
+        self._last_flush = time.monotonic()
+        if self._lines:
+            lines, self._lines = self._lines, []
+            self._emit('stream', llm=self.name, lines=lines, reason=self._lines_reason)
+
+    @property
+    def cancelled(self) -> bool:
+        """对冲请求中已经输掉竞争"""
+        return self.race is not None and self.race.lost(self.name)
+
+    def on_cancel(self, callback):
+        """输掉竞争时调用 callback 关闭响应，落后的一方不用等到首个 token 才结束"""
+        if self.race is not None:
+            self.race.on_cancel(self.name, callback)
+
+    def wait_cancelled(self, timeout: float) -> bool:
+        """重试前等待 timeout 秒，输掉竞争时提前返回 True"""
+        if self.race is None:
+            time.sleep(timeout)
+            return False
+        return self.race.wait(self.name, timeout)
+
+    def flush(self):
+        """胜出后发送认领前缓存的事件"""
+        pending, self._pending = self._pending, []
+        for event, kwargs in pending:
+            self.task.emit(event, **kwargs)
 
     @property
     def content(self):
@@ -62,25 +152,33 @@ class StreamProcessor:
     
     def __enter__(self):
         """支持上下文管理器协议"""
-        self.task.emit('stream_started', llm=self.name)
+        self._emit('stream_started', llm=self.name)
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
         """支持上下文管理器协议"""
         if self.lr.buffer:
-            self.process_chunk('\n')        
-        self.task.emit('stream_completed', llm=self.name)
+            self.process_chunk('\n')
+        self._flush_lines()
+        self._emit('stream_completed', llm=self.name)
     
     def process_chunk(self, content, *, reason=False):
         """处理流式数据块并发送事件"""
         if not content: 
             return
 
+        if self.first_token_time is None:
+            self.first_token_time = time.time() - self.start_time
+            if self.race is not None:
+                if not self.race.claim(self.name):
+                    raise RequestCancelled(f"Request to {self.name} lost the race to {self.race.winner}")
+                self.flush()
+
         # 处理思考内容的结束
         if not reason and self.lr.empty() and not self.lr_reason.empty():
             line = self.lr_reason.done()
             if line:
-                self.task.emit('stream', llm=self.name, lines=[line, "\n\n----\n\n"], reason=True)
+                self._queue_lines([line, "\n\n----\n\n"], reason=True)
 
         # 处理当前数据块
         lr = self.lr_reason if reason else self.lr
@@ -91,7 +189,13 @@ class StreamProcessor:
         # 过滤掉特殊注释行
         lines2 = [line for line in lines if not (line.startswith('<!-- Block-') or line.startswith('<!-- ToolCall:'))]
         if lines2:
-            self.task.emit('stream', llm=self.name, lines=lines2, reason=reason)
+            self._queue_lines(lines2, reason)
+
+class QuietStreamProcessor(StreamProcessor):
+    """不发送事件的流式处理器，用于后台请求（如预先生成上下文摘要）"""
+
+    def _emit(self, event, **kwargs):
+        pass
 
 class Client:
     def __init__(self, task: 'Task'):
@@ -104,6 +208,11 @@ class Client:
         self.context_manager = task.context_manager
         self.storage = task.message_storage
         self.log = logger.bind(src='Client', name=self.current.name)
+        # 最近一次请求实际使用的客户端
+        self.served_by = None
+        # 计算预算时的工具列表（工具名称），变化后重新计算
+        self._tools_key = ()
+        self._update_estimator()
 
     @property
     def name(self):
@@ -114,8 +223,35 @@ class Client:
         if client and client.usable():
             self.current = client
             self.log = logger.bind(src='client', name=self.current.name)
+            self._update_estimator()
             return True
         return False
+
+    def get_model_info(self):
+        model = self.current.model
+        if not model:
+            return None
+        return self.manager.get_model_info(model.rsplit('/', 1)[-1])
+
+    def _update_estimator(self):
+        """按当前模型选择Token估算器并计算上下文预算"""
+        model_info = self.get_model_info()
+        self.context_manager.set_estimator(create_token_estimator(model_info))
+        self._update_budget(model_info, self._get_tools())
+
+    def _update_budget(self, model_info, tools: list):
+        """上下文预算 = 模型上下文长度 - 输出上限 - 工具定义"""
+        self._tools_key = tuple(tool['function']['name'] for tool in tools)
+        reserved = self.current.config.max_tokens or 0
+        if tools:
+            text = json.dumps(tools, ensure_ascii=False)
+            reserved += self.context_manager.count_tokens(text, f"tools:{hash(text)}")
+        self.context_manager.set_budget(model_info.context_length if model_info else None, reserved)
+
+    def _get_tools(self) -> list:
+        if self.supports_function_calling() and self.task.mcp:
+            return self.task.mcp.get_openai_tools() or []
+        return []
     
     def has_capability(self, message: ChatMessage) -> bool:
         # 判断 content 需要什么能力
@@ -158,9 +294,14 @@ class Client:
 
         return ModelCapability.FUNCTION_CALLING in model_info.capabilities
 
-    def __call__(self, user_message: ChatMessage | List[ChatMessage]) -> ChatMessage:
-        client = self.current
-        stream_processor = StreamProcessor(self.task, client.name)
+    def _prepare_request(self, user_message: ChatMessage | List[ChatMessage]) -> tuple[list, dict]:
+        kwargs = {}
+        tools = self._get_tools()
+        if tools:
+            kwargs['tools'] = tools
+        # MCP 工具列表变化后重新计算预算，再按预算压缩上下文
+        if tuple(tool['function']['name'] for tool in tools) != self._tools_key:
+            self._update_budget(self.get_model_info(), tools)
 
         messages = self.context_manager.get_messages()
         if isinstance(user_message, list):
@@ -168,18 +309,154 @@ class Client:
         else:
             messages.append(user_message)
 
-        kwargs = {}
-        if self.supports_function_calling() and self.task.mcp:
-            tools = self.task.mcp.get_openai_tools()
-            if tools:
-                kwargs['tools'] = tools
-
-        msg = client(
-            [msg.dict() for msg in messages],
-            stream_processor=stream_processor,
-            extra_headers=self.extra_headers,
-            **kwargs
-        )
+        to_wire = self.task.message_storage.to_wire
+        return [to_wire(msg) for msg in messages], kwargs
+
+    def __call__(self, user_message: ChatMessage | List[ChatMessage]) -> ChatMessage:
+        messages, kwargs = self._prepare_request(user_message)
+        kwargs['extra_headers'] = self.extra_headers
+
+        route = self.manager.plan(self.current, role=getattr(self.task.role, 'name', None))
+        delay = self.manager.router.hedge_delay
+        while True:
+            if delay and len(route) > 1:
+                client, msg, tried = self._hedged_call(route[0], route[1], messages, kwargs, delay)
+            else:
+                client, msg, tried = self._call(route[0], messages, kwargs)
+            route = [c for c in route if c not in tried]
+            if not self._fallback(client, msg, route):
+                break
+
+        self.served_by = client.name
+        return self._handle_response(user_message, msg)
+
+    async def acall(self, user_message: ChatMessage | List[ChatMessage]) -> ChatMessage:
+        """__call__ 的异步版本"""
+        messages, kwargs = self._prepare_request(user_message)
+        kwargs['extra_headers'] = self.extra_headers
+
+        route = self.manager.plan(self.current, role=getattr(self.task.role, 'name', None))
+        delay = self.manager.router.hedge_delay
+        while True:
+            if delay and len(route) > 1:
+                client, msg, tried = await self._ahedged_call(route[0], route[1], messages, kwargs, delay)
+            else:
+                client, msg, tried = await self._acall(route[0], messages, kwargs)
+            route = [c for c in route if c not in tried]
+            if not self._fallback(client, msg, route):
+                break
+
+        self.served_by = client.name
+        return self._handle_response(user_message, msg)
+
+    def _fallback(self, client, msg, route) -> bool:
+        """请求失败且还有备用客户端时返回 True"""
+        if not isinstance(msg, ErrorMessage) or not route:
+            return False
+        self.log.warning('LLM request failed, falling back', failed=client.name, next=route[0].name, error=msg.content)
+        return True
+
+    def _record(self, client, sp: StreamProcessor, msg, race: RequestRace | None = None):
+        """记录请求统计，对冲请求中被取消的一方不计入"""
+        if race is not None and race.claimed and race.winner != client.name:
+            return
+        latency = time.time() - sp.start_time
+        self.manager.router.record(client.name, latency, ttft=sp.first_token_time, error=isinstance(msg, ErrorMessage))
+
+    def _call(self, client, messages, kwargs):
+        sp = StreamProcessor(self.task, client.name)
+        msg = client(messages, stream_processor=sp, **kwargs)
+        self._record(client, sp, msg)
+        return client, msg, [client]
+
+    async def _acall(self, client, messages, kwargs):
+        sp = StreamProcessor(self.task, client.name)
+        msg = await client.acall(messages, stream_processor=sp, **kwargs)
+        self._record(client, sp, msg)
+        return client, msg, [client]
+
+    def _settle(self, race: RequestRace, outcome, failed: list) -> bool:
+        """处理一个对冲请求的结果，返回是否已得到最终结果"""
+        client, sp, msg = outcome
+        self._record(client, sp, msg, race)
+        if not isinstance(msg, ErrorMessage) and race.claim(client.name):
+            sp.flush()
+            return True
+        failed.append((client, msg))
+        return False
+
+    def _hedged_result(self, race: RequestRace, failed: list, outcome=None):
+        if outcome:
+            client, _, msg = outcome
+        else:
+            # 优先返回胜出者的错误
+            client, msg = next(((c, m) for c, m in failed if c.name == race.winner), failed[0])
+        return client, msg, [c for c, _ in failed] + ([client] if outcome else [])
+
+    def _hedged_call(self, primary, secondary, messages, kwargs, delay: float):
+        """首个 token 在 delay 秒内未到达时向 secondary 发送对冲请求，使用先返回的结果"""
+        race = RequestRace()
+        results = queue.Queue()
+
+        def run(client):
+            sp = StreamProcessor(self.task, client.name, race=race)
+            try:
+                msg = client(messages, stream_processor=sp, **kwargs)
+            except Exception as e:
+                msg = ErrorMessage(content=str(e))
+            results.put((client, sp, msg))
+
+        threading.Thread(target=run, args=(primary,), daemon=True).start()
+        pending = 1
+        try:
+            outcome = results.get(timeout=delay)
+        except queue.Empty:
+            outcome = None
+            if not race.claimed:
+                self.log.info('Hedging LLM request', primary=primary.name, secondary=secondary.name)
+                threading.Thread(target=run, args=(secondary,), daemon=True).start()
+                pending += 1
+
+        failed = []
+        while pending:
+            outcome = outcome or results.get()
+            pending -= 1
+            if self._settle(race, outcome, failed):
+                return self._hedged_result(race, failed, outcome)
+            outcome = None
+        return self._hedged_result(race, failed)
+
+    async def _ahedged_call(self, primary, secondary, messages, kwargs, delay: float):
+        """_hedged_call 的异步版本，胜出后取消另一方"""
+        race = RequestRace()
+
+        async def run(client):
+            sp = StreamProcessor(self.task, client.name, race=race)
+            msg = await client.acall(messages, stream_processor=sp, **kwargs)
+            return client, sp, msg
+
+        tasks = {asyncio.create_task(run(primary))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and not race.claimed:
+                self.log.info('Hedging LLM request', primary=primary.name, secondary=secondary.name)
+                tasks.add(asyncio.create_task(run(secondary)))
+
+            failed = []
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    outcome = task.result()
+                    if self._settle(race, outcome, failed):
+                        return self._hedged_result(race, failed, outcome)
+            return self._hedged_result(race, failed)
+        finally:
+            # 等待被取消的请求结束，释放连接和熔断器的试探名额
+            for other in tasks:
+                other.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _handle_response(self, user_message: ChatMessage | List[ChatMessage], msg) -> ChatMessage:
         msg = self.storage.store(msg)
         if isinstance(msg.message, AIMessage):
             if isinstance(user_message, list):
@@ -46,6 +46,7 @@ def init_config_dir():
 CONFIG_DIR = init_config_dir()
 PLUGINS_DIR = CONFIG_DIR / "plugins"
 ROLES_DIR = CONFIG_DIR / "roles"
+REPLAY_DIR = CONFIG_DIR / "replay"
 
 def get_config_file_path(config_dir=None, file_name=CONFIG_FILE_NAME, create=True):
     """
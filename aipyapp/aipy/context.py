@@ -2,17 +2,19 @@
 # -*- coding: utf-8 -*-
 
 import time
+import threading
 from abc import ABC, abstractmethod
-from collections import Counter
+from collections import Counter, OrderedDict
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional, Union, Tuple
+from typing import List, Dict, Any, Optional, Union, Tuple, Iterable, Set
 from enum import Enum
 
 from loguru import logger
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
-from ..llm import MessageRole, UserMessage
+from ..llm import MessageRole, UserMessage, SystemMessage
 from .chat import ChatMessage, MessageStorage
+from .retrieval import HistoryRetriever, RETRIEVED_TAG, message_text
 
 class ContextStrategy(str, Enum):
     """上下文管理策略"""
@@ -20,6 +22,8 @@ class ContextStrategy(str, Enum):
     IMPORTANCE_FILTER = "importance_filter"  # 重要性过滤
     SUMMARY_COMPRESSION = "summary_compression"  # 摘要压缩
     HYBRID = "hybrid"                      # 混合策略
+    KNAPSACK = "knapsack"                  # 按 token 预算选择价值最高的对话轮
+    RETRIEVAL = "retrieval"                # 保留最近的对话轮，检索相关的历史内容
 
 class ITokenEstimator(ABC):
     """Token估算器接口"""
@@ -30,24 +34,130 @@ class ITokenEstimator(ABC):
         pass
 
 
+# 图片按固定 token 数估算
+IMAGE_TOKENS = 1000
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD = 4
+
+def _message_parts(message: ChatMessage) -> Tuple[str, int]:
+    """提取消息中需要计算 token 的文本，以及图片等非文本内容的数量"""
+    content = message.content
+    texts = []
+    images = 0
+    if isinstance(content, str):
+        texts.append(content)
+    elif isinstance(content, list):
+        for item in content:
+            if isinstance(item, dict):
+                item_type, text = item.get('type'), item.get('text', '')
+            else:
+                item_type, text = getattr(item, 'type', None), getattr(item, 'text', '')
+            if item_type == 'text':
+                texts.append(text or '')
+            else:
+                images += 1
+
+    tool_calls = getattr(message.message, 'tool_calls', None) if message.message is not None else None
+    for tc in tool_calls or []:
+        function = getattr(tc, 'function', None) or (tc.get('function') if isinstance(tc, dict) else None)
+        if isinstance(function, dict):
+            texts.extend([function.get('name') or '', function.get('arguments') or ''])
+        elif function is not None:
+            texts.extend([function.name or '', function.arguments or ''])
+    return '\n'.join(texts), images
+
 class DefaultTokenEstimator(ITokenEstimator):
-    """默认Token估算器实现"""
+    """默认Token估算器实现：ASCII 约 4 个字符一个 token，其它字符（如中日韩文字）约一个字符一个 token"""
     
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        non_ascii = len(text.encode('utf-8')) - len(text)
+        # UTF-8 中非 ASCII 字符占 2~4 字节，这里按 3 字节折算成字符数
+        wide = non_ascii // 2
+        return (len(text) - wide) // 4 + wide
+
     def estimate(self, message: ChatMessage) -> int:
-        content = message.content
-        if isinstance(content, str):
-            return len(content) // 4
-        elif isinstance(content, list):
-            total_length = 0
-            for item in content:
-                if item.get('type') == 'text':
-                    total_length += len(item.get('text', ''))
-            return total_length // 4
-        return 0
+        text, images = _message_parts(message)
+        return self.count_text(text) + images * IMAGE_TOKENS + MESSAGE_OVERHEAD
+
+# 编码名 -> tiktoken 编码，加载失败时为 None，所有任务共享，每个编码只加载（或失败）一次
+_ENCODINGS: Dict[str, Any] = {}
+_ENCODINGS_LOCK = threading.Lock()
+
+def _load_encoding(name: str):
+    with _ENCODINGS_LOCK:
+        if name not in _ENCODINGS:
+            try:
+                import tiktoken
+                _ENCODINGS[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                # 未安装 tiktoken，或离线环境下无法加载编码文件
+                _ENCODINGS[name] = None
+                logger.bind(src='token_estimator').warning('BPE tokenizer unavailable, using heuristic estimator', encoding=name, error=str(e))
+        return _ENCODINGS[name]
+
+class BPETokenEstimator(DefaultTokenEstimator):
+    """基于 tiktoken BPE 编码的Token估算器，tiktoken 不可用时回退到默认估算"""
+
+    def __init__(self, encoding: str = 'cl100k_base'):
+        self.encoding_name = encoding
+        self._encoding = None
+        self._loaded = False
+
+    def _get_encoding(self):
+        if not self._loaded:
+            self._encoding = _load_encoding(self.encoding_name)
+            self._loaded = True
+        return self._encoding
+
+    def count_text(self, text: str) -> int:
+        encoding = self._get_encoding()
+        if encoding is None:
+            return super().count_text(text)
+        if not text:
+            return 0
+        return len(encoding.encode(text, disallowed_special=()))
+
+# CachedTokenEstimator 最多缓存的消息数
+TOKEN_CACHE_SIZE = 10000
+
+class CachedTokenEstimator(ITokenEstimator):
+    """按 ChatMessage.id 缓存估算结果，消息 ID 是内容的哈希，所以缓存不会过期，超过 max_size 时淘汰最久未用的"""
+
+    def __init__(self, estimator: ITokenEstimator, max_size: int = TOKEN_CACHE_SIZE):
+        self.estimator = estimator
+        self.max_size = max_size
+        # 消息 ID -> token 数，最近使用的排在最后
+        self._cache: OrderedDict[str, int] = OrderedDict()
+
+    def estimate(self, message: ChatMessage) -> int:
+        tokens = self._cache.get(message.id)
+        if tokens is not None:
+            self._cache.move_to_end(message.id)
+            return tokens
+        tokens = self.estimator.estimate(message)
+        self._cache[message.id] = tokens
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return tokens
+
+# 各模型厂商默认使用的 BPE 编码，其它厂商的私有 tokenizer 用 cl100k_base 近似
+DEFAULT_ENCODINGS = {
+    'OpenAI': 'o200k_base',
+}
+
+def create_token_estimator(model_info=None) -> ITokenEstimator:
+    """根据 models.yaml 中的模型信息创建Token估算器，可以用 tokenizer 字段指定编码"""
+    encoding = None
+    if model_info is not None:
+        encoding = (model_info.extra or {}).get('tokenizer') or DEFAULT_ENCODINGS.get(model_info.company)
+    return CachedTokenEstimator(BPETokenEstimator(encoding or 'cl100k_base'))
 
 class ContextConfig(BaseModel):
     """上下文管理配置"""
-    max_tokens: int = Field(default=100000, description="最大token数")
+    max_tokens: int = Field(default=100000, description="最大token数，auto_budget 开启且模型上下文长度已知时由模型计算")
+    auto_budget: bool = Field(default=True, description="按当前模型的上下文长度减去输出和工具定义预留的 token 数计算 max_tokens")
     max_rounds: int = Field(default=10, description="最大对话轮数")
     auto_compress: bool = Field(default=True, description="是否自动压缩")
     strategy: ContextStrategy = Field(default=ContextStrategy.HYBRID, description="压缩策略")
@@ -56,6 +166,9 @@ class ContextConfig(BaseModel):
     summary_max_length: int = Field(default=200, gt=0, description="摘要最大长度")
     preserve_system: bool = Field(default=True, description="是否保留系统消息")
     preserve_recent: int = Field(default=3, gt=0, description="保留最近几轮对话")
+    summary_threshold: float = Field(default=0.0, ge=0.0, le=1.0, description="token数超过 max_tokens 的该比例时在后台预先生成摘要，0 表示不启用")
+    summary_llm: Optional[str] = Field(default=None, description="生成摘要使用的LLM名称，默认使用任务当前的LLM")
+    retrieval_top_k: int = Field(default=5, ge=0, description="retrieval 策略检索的历史内容条数")
 
     def set_strategy(self, strategy: str) -> bool:
         try:
@@ -72,6 +185,9 @@ class ContextConfig(BaseModel):
 
 class IContextStrategy(ABC):
     """上下文压缩策略接口"""
+    # 任务历史检索器，由 MessageCompressor 设置
+    retriever: Optional[HistoryRetriever] = None
+
     def __init__(self, message_store: MessageStorage, config: ContextConfig, 
                  estimator: ITokenEstimator):
         self.message_store = message_store
@@ -99,14 +215,14 @@ class SlidingWindowStrategy(IContextStrategy):
         system_messages = [msg for msg in context_data.messages if msg.role == MessageRole.SYSTEM]
         for msg in system_messages:
             preserved_messages.append(msg)
-            preserved_tokens += self.estimator.estimate(msg)
+            preserved_tokens += context_data.tokens_of(msg, self.estimator)
         
         # 保留最近的对话
         recent_messages = [msg for msg in context_data.messages if msg.role != MessageRole.SYSTEM]
         max_recent = self.config.preserve_recent * 2
         
         for msg in recent_messages[-max_recent:]:
-            msg_tokens = self.estimator.estimate(msg)
+            msg_tokens = context_data.tokens_of(msg, self.estimator)
             if preserved_tokens + msg_tokens <= self.config.max_tokens:
                 preserved_messages.append(msg)
                 preserved_tokens += msg_tokens
@@ -114,7 +230,7 @@ class SlidingWindowStrategy(IContextStrategy):
                 break
         
         # 更新上下文数据
-        context_data.messages = preserved_messages
+        context_data.replace(preserved_messages, self.estimator)
         context_data.total_tokens = preserved_tokens
         
         self.log.info(f"Sliding window compression: {original_count} -> {len(preserved_messages)} messages, {preserved_tokens} tokens")
@@ -133,27 +249,28 @@ class ImportanceFilterStrategy(IContextStrategy):
         scored_messages = []
         for i, msg in enumerate(messages):
             score = self._calculate_importance_score(msg, i, len(messages))
-            scored_messages.append((score, msg))
+            scored_messages.append((score, i, msg))
         
         # 按重要性排序
         scored_messages.sort(key=lambda x: x[0], reverse=True)
         
-        preserved_messages = []
+        preserved = []
         preserved_tokens = 0
         
-        for score, msg in scored_messages:
-            msg_tokens = self.estimator.estimate(msg)
+        for score, i, msg in scored_messages:
+            msg_tokens = context_data.tokens_of(msg, self.estimator)
             if preserved_tokens + msg_tokens <= self.config.max_tokens:
-                preserved_messages.append(msg)
+                preserved.append((i, msg))
                 preserved_tokens += msg_tokens
             else:
                 break
         
         # 按原始顺序重新排序
-        preserved_messages.sort(key=lambda x: messages.index(x))
+        preserved.sort(key=lambda x: x[0])
+        preserved_messages = [msg for _, msg in preserved]
         
         # 更新上下文数据
-        context_data.messages = preserved_messages
+        context_data.replace(preserved_messages, self.estimator)
         context_data.total_tokens = preserved_tokens
         
         self.log.info(f"Importance filter compression: {original_count} -> {len(preserved_messages)} messages, {preserved_tokens} tokens")
@@ -198,7 +315,7 @@ class SummaryCompressionStrategy(IContextStrategy):
         system_messages = [msg for msg in context_data.messages if msg.role == MessageRole.SYSTEM]
         for msg in system_messages:
             preserved_messages.append(msg)
-            preserved_tokens += self.estimator.estimate(msg)
+            preserved_tokens += context_data.tokens_of(msg, self.estimator)
         
         # 保留最近的对话
         recent_messages: List[ChatMessage] = [msg for msg in context_data.messages if msg.role != MessageRole.SYSTEM]
@@ -212,12 +329,13 @@ class SummaryCompressionStrategy(IContextStrategy):
             summary_content = self._create_summary(old_messages)
             summary_msg = UserMessage(content=f"对话历史摘要：{summary_content}")
             
-            preserved_messages.append(self.message_store.store(summary_msg))
-            preserved_tokens += self.estimator.estimate(summary_msg.content)
+            summary_chat = self.message_store.store(summary_msg)
+            preserved_messages.append(summary_chat)
+            preserved_tokens += context_data.tokens_of(summary_chat, self.estimator)
         
         # 添加新消息
         for msg in recent_messages[-max_recent:]:
-            msg_tokens = self.estimator.estimate(msg)
+            msg_tokens = context_data.tokens_of(msg, self.estimator)
             if preserved_tokens + msg_tokens <= self.config.max_tokens:
                 preserved_messages.append(msg)
                 preserved_tokens += msg_tokens
@@ -225,7 +343,7 @@ class SummaryCompressionStrategy(IContextStrategy):
                 break
         
         # 更新上下文数据
-        context_data.messages = preserved_messages
+        context_data.replace(preserved_messages, self.estimator)
         context_data.total_tokens = preserved_tokens
         
         self.log.info(f"Summary compression: {original_count} -> {len(preserved_messages)} messages, {preserved_tokens} tokens")
@@ -292,6 +410,188 @@ class ContextStrategyFactory:
             raise TypeError("Strategy class must implement IContextStrategy interface")
         cls._strategies[strategy_type] = strategy_class
 
+def group_rounds(messages: List[ChatMessage]) -> List[List[ChatMessage]]:
+    """按 Round 分组：每个 assistant 消息开始新的一组，系统消息单独成组"""
+    groups: List[List[ChatMessage]] = []
+    current: List[ChatMessage] | None = None
+    for msg in messages:
+        role = msg.role
+        if role == MessageRole.SYSTEM:
+            groups.append([msg])
+            current = None
+        elif role == MessageRole.ASSISTANT or current is None:
+            current = [msg]
+            groups.append(current)
+        else:
+            current.append(msg)
+    return groups
+
+class KnapsackStrategy(IContextStrategy):
+    """
+    背包压缩策略：在 token 预算内选择价值最高的消息组
+
+    - 一个 assistant 消息和其后的工具结果、反馈消息组成一组（即一个 Round），整组保留或删除，
+      不会出现没有结果的工具调用或没有调用的工具结果
+    - 系统消息、第一条用户消息（任务指令）和最后一组始终保留
+    - 其余消息组按价值/token 密度贪心选择，并与单个价值最高且放得下的组比较（1/2 近似），复杂度 O(n log n)
+    """
+
+    def compress(self, context_data: 'ContextData') -> None:
+        if context_data.total_tokens <= self.config.max_tokens:
+            return
+
+        messages = context_data.messages
+        original_count = len(messages)
+        groups = group_rounds(messages)
+        if len(groups) <= 1:
+            return
+
+        # 必须保留的消息组
+        required = {len(groups) - 1}
+        first_user_found = False
+        for i, group in enumerate(groups):
+            if group[0].role == MessageRole.SYSTEM:
+                required.add(i)
+            elif group[0].role == MessageRole.USER and not first_user_found:
+                required.add(i)
+                first_user_found = True
+
+        weights = [sum(context_data.tokens_of(msg, self.estimator) for msg in group) for group in groups]
+        budget = self.config.max_tokens - sum(weights[i] for i in required)
+
+        candidates = [i for i in range(len(groups)) if i not in required and 0 < weights[i] <= budget]
+        values = {i: self._group_value(groups[i], i, len(groups)) for i in candidates}
+
+        # 按价值密度贪心选择
+        selected = []
+        used = 0
+        for i in sorted(candidates, key=lambda i: values[i] / weights[i], reverse=True):
+            if used + weights[i] <= budget:
+                selected.append(i)
+                used += weights[i]
+
+        # 贪心结果不如单个价值最高的组时，改为只选这一组
+        if candidates:
+            best = max(candidates, key=lambda i: values[i])
+            if values[best] > sum(values[i] for i in selected):
+                selected = [best]
+
+        keep = sorted(required.union(selected))
+        preserved_messages = [msg for i in keep for msg in groups[i]]
+        preserved_tokens = sum(weights[i] for i in keep)
+
+        # 更新上下文数据
+        context_data.replace(preserved_messages, self.estimator)
+        context_data.total_tokens = preserved_tokens
+
+        self.log.info(f"Knapsack compression: {original_count} -> {len(preserved_messages)} messages, {preserved_tokens} tokens")
+
+    def _group_value(self, group: List[ChatMessage], index: int, total: int) -> float:
+        """消息组的价值：越新越重要，包含用户消息的组更重要"""
+        value = 1.0 + 2.0 * (index + 1) / total
+        if any(msg.role == MessageRole.USER for msg in group):
+            value += 0.5
+        return value
+
+ContextStrategyFactory.register_strategy(ContextStrategy.KNAPSACK, KnapsackStrategy)
+
+class RetrievalStrategy(IContextStrategy):
+    """
+    检索压缩策略：保留最近的对话轮，用检索到的相关历史内容代替被删除的消息
+
+    - 系统消息、第一条用户消息（任务指令）和最后一组始终保留，再从后往前保留最多 preserve_recent 组
+    - 以最近的用户消息和 LLM 回复为查询，从任务的所有历史消息和代码块版本中检索 retrieval_top_k 条
+      不在上下文中的内容，合并成一条用户消息放在任务指令之后
+    - 没有检索器时只保留最近的对话轮
+    """
+
+    def compress(self, context_data: 'ContextData') -> None:
+        if context_data.total_tokens <= self.config.max_tokens:
+            return
+
+        # 上次压缩插入的检索结果不再保留
+        messages = [msg for msg in context_data.messages if not self._is_retrieved(msg)]
+        original_count = len(context_data.messages)
+        groups = group_rounds(messages)
+        if len(groups) <= 1:
+            return
+
+        required = {len(groups) - 1}
+        head = set()
+        first_user_found = False
+        for i, group in enumerate(groups):
+            if group[0].role == MessageRole.SYSTEM:
+                head.add(i)
+            elif group[0].role == MessageRole.USER and not first_user_found:
+                head.add(i)
+                first_user_found = True
+        required |= head
+
+        weights = [sum(context_data.tokens_of(msg, self.estimator) for msg in group) for group in groups]
+        budget = self.config.max_tokens - sum(weights[i] for i in required)
+
+        # 从后往前保留最近的对话轮
+        recent = []
+        for i in range(len(groups) - 2, -1, -1):
+            if len(recent) >= self.config.preserve_recent - 1:
+                break
+            if i in required:
+                continue
+            if weights[i] > budget:
+                break
+            recent.append(i)
+            budget -= weights[i]
+
+        keep = sorted(required.union(recent))
+        kept_messages = [msg for i in keep for msg in groups[i]]
+        retrieved = self._retrieve(kept_messages, budget)
+
+        preserved_messages = []
+        inserted = False
+        for i in keep:
+            if retrieved and not inserted and i not in head:
+                preserved_messages.append(retrieved)
+                inserted = True
+            preserved_messages.extend(groups[i])
+
+        context_data.replace(preserved_messages, self.estimator)
+        context_data.total_tokens = context_data.estimated_tokens
+
+        self.log.info(f"Retrieval compression: {original_count} -> {len(preserved_messages)} messages, "
+                      f"{context_data.total_tokens} tokens, retrieved: {retrieved is not None}")
+
+    @staticmethod
+    def _is_retrieved(message: ChatMessage) -> bool:
+        return message.role == MessageRole.USER and message_text(message.content).startswith(RETRIEVED_TAG)
+
+    def _retrieve(self, kept_messages: List[ChatMessage], budget: int) -> Optional[ChatMessage]:
+        """检索相关的历史内容，返回放入上下文的消息；没有结果或超出预算时返回 None"""
+        retriever = self.retriever
+        if retriever is None or not self.config.retrieval_top_k or budget <= 0:
+            return None
+
+        # 查询：最近的用户消息和 LLM 回复
+        query = []
+        for msg in reversed(kept_messages):
+            if msg.role in (MessageRole.USER, MessageRole.ASSISTANT, MessageRole.TOOL):
+                query.append(message_text(msg.content))
+            if len(query) >= 2:
+                break
+        snippets = retriever.search('\n'.join(query), self.config.retrieval_top_k, {msg.id for msg in kept_messages})
+
+        # 结果按相关性排序，超出预算时去掉最不相关的
+        while snippets:
+            content = f"{RETRIEVED_TAG}\nRelevant earlier context of this task (retrieved, not in order):\n\n" + \
+                      '\n\n'.join(snippets) + "\n</retrieved_context>"
+            message = UserMessage(content=content)
+            # 先估算再存储，超出预算的候选消息不进入 MessageStorage
+            if self.estimator.estimate(ChatMessage(id=f"retrieved:{hash(content)}", message=message)) <= budget:
+                return self.message_store.store(message)
+            snippets.pop()
+        return None
+
+ContextStrategyFactory.register_strategy(ContextStrategy.RETRIEVAL, RetrievalStrategy)
+
 class MessageCompressor:
     """消息压缩器 - 重构为使用策略模式"""
     
@@ -299,9 +599,15 @@ class MessageCompressor:
                  estimator: ITokenEstimator = None):
         self.config = config
         self.message_store = message_store
-        self.estimator = estimator or DefaultTokenEstimator()
-        self.strategy = ContextStrategyFactory.create(config.strategy, message_store, config, self.estimator)
+        self.estimator = estimator or CachedTokenEstimator(DefaultTokenEstimator())
+        self.retriever: Optional[HistoryRetriever] = None
+        self.strategy = self._create_strategy(config.strategy)
         self.log = logger.bind(src='message_compressor')
+
+    def _create_strategy(self, strategy_type: ContextStrategy) -> IContextStrategy:
+        strategy = ContextStrategyFactory.create(strategy_type, self.message_store, self.config, self.estimator)
+        strategy.retriever = self.retriever
+        return strategy
     
     def compress_context(self, context_data: 'ContextData') -> None:
         """压缩上下文数据"""
@@ -309,15 +615,25 @@ class MessageCompressor:
     
     def update_strategy(self, new_strategy: ContextStrategy):
         """更新压缩策略"""
-        self.strategy = ContextStrategyFactory.create(new_strategy, self.message_store, self.config, self.estimator)
+        self.strategy = self._create_strategy(new_strategy)
         self.log.info(f"Strategy updated to: {new_strategy.value}")
     
     def update_config(self, new_config: ContextConfig):
         """更新配置并重新创建策略"""
         self.config = new_config
-        self.strategy = ContextStrategyFactory.create(new_config.strategy, self.message_store, new_config, self.estimator)
+        self.strategy = self._create_strategy(new_config.strategy)
         self.log.info(f"Config updated: {new_config.strategy.value}")
     
+    def update_estimator(self, estimator: ITokenEstimator):
+        """更新Token估算器并重新创建策略"""
+        self.estimator = estimator
+        self.strategy = self._create_strategy(self.config.strategy)
+
+    def set_retriever(self, retriever: HistoryRetriever):
+        """设置任务历史检索器（retrieval 策略使用）"""
+        self.retriever = retriever
+        self.strategy.retriever = retriever
+
     def estimate_message_tokens(self, message: ChatMessage) -> int:
         """估算消息token数（向后兼容，建议使用estimate_single_message_tokens）"""
         return self.estimator.estimate(message)
@@ -325,15 +641,127 @@ class MessageCompressor:
 class ContextData(BaseModel):
     messages: List[ChatMessage] = Field(default_factory=list)
     total_tokens: int = 0
+
+    # token 账本：消息 ID -> 估算的 token 数，以及所有消息的估算值之和（重复消息按出现次数累计）
+    # 增删消息时只更新涉及的消息，不重新估算整个上下文
+    _tokens: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _estimated_tokens: int = PrivateAttr(default=0)
+    _indexed: bool = PrivateAttr(default=False)
+    # 变化记录（任务日志使用）：[['+', [消息ID]] 或 ['-', [删除前的下标]]]，None 表示不记录
+    _changes: Optional[List[list]] = PrivateAttr(default=None)
+    # 按变化记录推算的消息数，与实际不符说明 messages 被直接修改过
+    _expected: int = PrivateAttr(default=0)
     
     def __len__(self):
         return len(self.messages)
+
+    def track_changes(self):
+        """从现在开始记录增删的消息，之前的记录被丢弃"""
+        self._changes = []
+        self._expected = len(self.messages)
+
+    def take_changes(self) -> Optional[List[list]]:
+        """
+        返回并清空变化记录
+
+        整体替换过消息列表或 messages 被直接修改、无法增量表示时返回 None
+        """
+        changes = self._changes
+        if changes is not None and self._expected != len(self.messages):
+            changes = None
+        self.track_changes()
+        return changes
+
+    @property
+    def estimated_tokens(self) -> int:
+        """所有消息估算的 token 数之和"""
+        return self._estimated_tokens
+
+    @property
+    def indexed(self) -> bool:
+        return self._indexed
+
+    def tokens_of(self, message: ChatMessage, estimator: ITokenEstimator) -> int:
+        """从账本读取消息的 token 数，不存在时估算并记录"""
+        tokens = self._tokens.get(message.id)
+        if tokens is None:
+            tokens = estimator.estimate(message)
+            self._tokens[message.id] = tokens
+        return tokens
+
+    def reindex(self, estimator: ITokenEstimator):
+        """重建账本，加载任务或更换估算器后调用"""
+        self._tokens = {}
+        self._estimated_tokens = sum(self.tokens_of(msg, estimator) for msg in self.messages)
+        self._indexed = True
+
+    def append(self, message: ChatMessage, estimator: ITokenEstimator) -> int:
+        """添加消息，返回消息估算的 token 数"""
+        tokens = self.tokens_of(message, estimator)
+        self.messages.append(message)
+        self._estimated_tokens += tokens
+        changes = self._changes
+        if changes is not None:
+            if changes and changes[-1][0] == '+':
+                changes[-1][1].append(message.id)
+            else:
+                changes.append(['+', [message.id]])
+            self._expected += 1
+        return tokens
+
+    def replace(self, messages: List[ChatMessage], estimator: ITokenEstimator):
+        """用新的消息列表替换上下文，账本只保留这些消息"""
+        tokens = {}
+        estimated = 0
+        for msg in messages:
+            value = tokens.get(msg.id)
+            if value is None:
+                value = tokens[msg.id] = self.tokens_of(msg, estimator)
+            estimated += value
+        self.messages = messages
+        self._tokens = tokens
+        self._estimated_tokens = estimated
+        # 整体替换无法增量记录，任务日志改为保存完整的上下文
+        self._changes = None
+
+    def remove(self, message_ids: Set[str], protected: Set[int] | None = None) -> Tuple[int, int]:
+        """
+        删除 ID 在 message_ids 中的消息，protected 中的下标除外
+
+        Returns:
+            Tuple[删除数量, 删除消息估算的 token 数]
+        """
+        protected = protected or set()
+        kept = []
+        kept_ids = set()
+        removed = []
+        tokens_saved = 0
+        for i, msg in enumerate(self.messages):
+            if msg.id in message_ids and i not in protected:
+                removed.append(i)
+                tokens_saved += self._tokens.get(msg.id, 0)
+            else:
+                kept.append(msg)
+                if msg.id in message_ids:
+                    kept_ids.add(msg.id)
+
+        deleted = len(removed)
+        if deleted:
+            self.messages[:] = kept
+            self._estimated_tokens -= tokens_saved
+            for msg_id in message_ids - kept_ids:
+                self._tokens.pop(msg_id, None)
+            if self._changes is not None:
+                self._changes.append(['-', removed])
+                self._expected -= deleted
+        return deleted, tokens_saved
     
 class ContextManager:
     """上下文管理器"""
     
     def __init__(self, message_store: MessageStorage, data: ContextData, 
-                 config: Union[dict, ContextConfig, None] = None):
+                 config: Union[dict, ContextConfig, None] = None,
+                 estimator: ITokenEstimator = None):
         if isinstance(config, dict):
             self.config = ContextConfig(**config)
         elif isinstance(config, ContextConfig):
@@ -342,11 +770,21 @@ class ContextManager:
             self.config = ContextConfig()
         
         self.message_store = message_store
-        self.compressor = MessageCompressor(message_store, self.config)
+        self.compressor = MessageCompressor(message_store, self.config, estimator)
         self.log = logger.bind(src='context_manager')
+
+        # 配置的 max_tokens，模型上下文长度未知时使用
+        self._default_max_tokens = self.config.max_tokens
+        # 当前模型的上下文长度和预留的 token 数（输出 + 工具定义）
+        self.context_length: Optional[int] = None
+        self.reserved_tokens = 0
         
         self.data = data
         self._last_compression_time = 0
+        # 后台摘要器（BackgroundSummarizer），由 Task 设置
+        self.summarizer = None
+        if not data.indexed:
+            data.reindex(self.compressor.estimator)
         
     @property
     def total_tokens(self):
@@ -358,7 +796,9 @@ class ContextManager:
     
     def add_chat(self, user_message: ChatMessage, llm_message: ChatMessage):
         """添加用户-LLM对话（推荐使用）"""
-        self.data.messages.extend([user_message, llm_message])
+        estimator = self.compressor.estimator
+        user_tokens = self.data.append(user_message, estimator)
+        llm_tokens = self.data.append(llm_message, estimator)
         
         # 尝试从LLM消息提取准确的总token数
         context_total = llm_message.total_tokens
@@ -367,14 +807,12 @@ class ContextManager:
             self.log.info(f"Updated context tokens from LLM usage: {self.data.total_tokens}")
         else:
             # 兜底：累加两条消息的估算
-            user_tokens = self.compressor.estimate_message_tokens(user_message)
-            llm_tokens = self.compressor.estimate_message_tokens(llm_message)
             self.data.total_tokens += user_tokens + llm_tokens
             self.log.info(f"Estimated tokens for new chat: +{user_tokens + llm_tokens}, total: {self.data.total_tokens}")
     
     def add_message(self, message: ChatMessage):
         """添加单独消息（系统消息、反馈消息等）"""
-        self.data.messages.append(message)
+        message_tokens = self.data.append(message, self.compressor.estimator)
         
         # 检查是否是包含总token数的Assistant消息
         context_total = message.total_tokens
@@ -383,7 +821,6 @@ class ContextManager:
             self.log.info(f"Updated context tokens from LLM usage: {self.data.total_tokens}")
         else:
             # 普通消息，累加估算的token
-            message_tokens = self.compressor.estimate_message_tokens(message)
             self.data.total_tokens += message_tokens
             self.log.info(f"Added single message: +{message_tokens} tokens, total: {self.data.total_tokens}, id: {message.id}")
     
@@ -400,11 +837,34 @@ class ContextManager:
                 (current_time - self._last_compression_time) > 300  # 5分钟强制压缩
             )
             
-            if should_compress:
+            if should_compress and not self._apply_summary():
                 self.compress()
         
         return self.messages.copy()
     
+    def _apply_summary(self) -> bool:
+        """超出 token 限制时用后台预先生成的摘要替换旧消息，返回是否替换"""
+        if not self.summarizer or self.total_tokens <= self.config.max_tokens:
+            return False
+        messages = self.summarizer.take(self.data.messages, self.message_store)
+        if not messages:
+            return False
+
+        original_count = len(self.data.messages)
+        original_tokens = self.total_tokens
+        self.rebuild(messages)
+        # 保留的 assistant 消息带有旧上下文的 usage，这里使用估算值
+        self.data.total_tokens = self.data.estimated_tokens
+        self._last_compression_time = time.time()
+        self.log.info(
+            f"Context replaced with prepared summary: {original_count}->{len(self.data.messages)} messages, "
+            f"{original_tokens}->{self.data.total_tokens} tokens"
+        )
+        if self.total_tokens > self.config.max_tokens:
+            # 替换后仍然超出限制时继续按策略压缩
+            self.compress()
+        return True
+
     def compress(self):
         """压缩消息"""
         if not self.data.messages:
@@ -438,37 +898,102 @@ class ContextManager:
             return
             
         if messages[0].role == MessageRole.SYSTEM:
-            if len(messages) > 3:
-                messages[2] = messages[-1]
-                del messages[3:]
+            kept = messages[:2] + messages[-1:] if len(messages) > 3 else messages[:]
         else:
-            messages[1] = messages[-1]
-            del messages[2:]
+            kept = messages[:1] + messages[-1:]
         
         self._last_compression_time = 0
-        self.data.total_tokens = sum(self.compressor.estimate_message_tokens(msg) for msg in messages)
+        self.data.replace(kept, self.compressor.estimator)
+        self.data.total_tokens = self.data.estimated_tokens
         self.log.info(f"Context cleaned: {len(self.data.messages)} messages, {self.data.total_tokens} tokens")
 
     def rebuild(self, messages: List[ChatMessage]):
         """重建消息缓存"""
-        self.data.messages.clear()
+        self.data.replace([], self.compressor.estimator)
         self.data.total_tokens = 0
         
         for message in messages:
             self.add_message(message)
     
+    def set_retriever(self, retriever: HistoryRetriever):
+        """设置任务历史检索器"""
+        self.compressor.set_retriever(retriever)
+
+    def set_estimator(self, estimator: ITokenEstimator):
+        """切换模型后更新Token估算器"""
+        self.compressor.update_estimator(estimator)
+        self.data.reindex(estimator)
+
     def update_config(self, config: ContextConfig):
         """更新配置"""
         self.config = config
+        if not config.auto_budget:
+            self._default_max_tokens = config.max_tokens
         self.compressor.update_config(config)
+        self._apply_budget()
         self.log.info(f"Context config updated: {config.strategy.value}")
+
+    def count_tokens(self, text: str, key: str) -> int:
+        """估算一段文本的 token 数，key 相同的文本使用缓存的结果"""
+        return self.compressor.estimator.estimate(ChatMessage(id=key, message=SystemMessage(content=text)))
+
+    def set_budget(self, context_length: Optional[int], reserved_tokens: int = 0):
+        """按模型的上下文长度设置 token 预算，切换模型或工具列表变化后调用"""
+        self.context_length = context_length
+        self.reserved_tokens = reserved_tokens
+        self._apply_budget()
+
+    def _apply_budget(self):
+        context_length = self.context_length
+        if self.config.auto_budget and context_length:
+            # 预留过多时（输出上限接近上下文长度的小模型）至少保留一半给输入
+            max_tokens = max(context_length - self.reserved_tokens, context_length // 2)
+        else:
+            max_tokens = self._default_max_tokens
+        if max_tokens != self.config.max_tokens:
+            self.log.info('Context budget updated', max_tokens=max_tokens,
+                          context_length=context_length, reserved=self.reserved_tokens)
+            self.config.max_tokens = max_tokens
     
-    def delete_messages_by_ids(self, message_ids: List[str]) -> Tuple[int, int]:
+    def _protected_indices(self) -> Set[int]:
+        """保护系统消息和第一条用户消息（通常是任务指令）"""
+        protected_indices = set()
+        first_user_found = False
+        for i, msg in enumerate(self.data.messages):
+            if msg.role == MessageRole.SYSTEM:
+                protected_indices.add(i)
+            elif msg.role == MessageRole.USER and not first_user_found:
+                protected_indices.add(i)
+                first_user_found = True
+        return protected_indices
+
+    def estimate_delete(self, message_ids: Iterable[str]) -> Tuple[int, int]:
+        """
+        估算按ID删除消息的效果，不修改上下文
+
+        Returns:
+            Tuple[将删除的数量, 将节省的token数]
+        """
+        message_ids = set(message_ids)
+        messages = self.data.messages
+        if not message_ids or len(messages) <= 2:
+            return 0, 0
+
+        protected = self._protected_indices()
+        estimator = self.compressor.estimator
+        count = tokens = 0
+        for i, msg in enumerate(messages):
+            if msg.id in message_ids and i not in protected:
+                count += 1
+                tokens += self.data.tokens_of(msg, estimator)
+        return count, tokens
+
+    def delete_messages_by_ids(self, message_ids: Iterable[str]) -> Tuple[int, int]:
         """
         按ID删除消息，带安全保护
         
         Args:
-            message_ids: 要删除的消息ID列表
+            message_ids: 要删除的消息ID集合
             
         Returns:
             Tuple[删除数量, 节省的token数]
@@ -480,40 +1005,38 @@ class ContextManager:
         if len(messages) <= 2:  # 至少保留系统消息和第一条用户消息
             return 0, 0
         
-        # 计算需要保护的消息索引
-        protected_indices = set()
-        
-        # 保护系统消息
-        for i, msg in enumerate(messages):
-            if msg.role == MessageRole.SYSTEM:
-                protected_indices.add(i)
-        
-        # 保护第一条用户消息（通常是任务指令）
-        first_user_found = False
-        for i, msg in enumerate(messages):
-            if msg.role == MessageRole.USER and not first_user_found:
-                protected_indices.add(i)
-                first_user_found = True
-                break
-        
-        # 收集要删除的消息
-        to_delete = []
-        tokens_saved = 0
-        
-        for i, msg in enumerate(messages):
-            if msg.id in message_ids and i not in protected_indices:
-                to_delete.append(i)
-                tokens_saved += self.compressor.estimate_message_tokens(msg)
-        
-        # 从后向前删除，避免索引变化
-        for i in sorted(to_delete, reverse=True):
-            del messages[i]
+        deleted_count, tokens_saved = self.data.remove(set(message_ids), self._protected_indices())
         
         # 更新token计数
-        self.data.total_tokens = sum(self.compressor.estimate_message_tokens(msg) for msg in messages)
+        self.data.total_tokens = self.data.estimated_tokens
         
-        deleted_count = len(to_delete)
         if deleted_count > 0:
             self.log.info(f"Deleted {deleted_count} messages by ID, saved {tokens_saved} tokens")
         
-        return deleted_count, tokens_saved
\ No newline at end of file
+        return deleted_count, tokens_saved
+
+    def replace_messages_by_ids(self, message_ids: Iterable[str], message: ChatMessage) -> Tuple[int, int]:
+        """
+        用一条消息替换按ID删除的消息，新消息放在第一条被删除消息的位置
+
+        Returns:
+            Tuple[删除数量, 节省的token数（已减去新消息的token数）]
+        """
+        message_ids = set(message_ids)
+        messages = self.data.messages
+        protected = self._protected_indices()
+        position = next((i for i, msg in enumerate(messages) if msg.id in message_ids and i not in protected), None)
+        if position is None or len(messages) <= 2:
+            return 0, 0
+
+        kept = [msg for i, msg in enumerate(messages) if i in protected or msg.id not in message_ids]
+        deleted_count = len(messages) - len(kept)
+        # position 之前没有被删除的消息
+        kept.insert(position, message)
+
+        tokens_before = self.data.estimated_tokens
+        self.data.replace(kept, self.compressor.estimator)
+        self.data.total_tokens = self.data.estimated_tokens
+        tokens_saved = tokens_before - self.data.estimated_tokens
+        self.log.info(f"Replaced {deleted_count} messages with {message.id}, saved {tokens_saved} tokens")
+        return deleted_count, tokens_saved
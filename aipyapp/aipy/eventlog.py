@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+分段的事件日志
+
+事件不再整体压缩后写入 task.json，而是追加到任务目录下的 events 子目录：
+
+    events/00000.ndjson.gz    每段最多 segment_events 个事件，每行一个事件（NDJSON）
+    events/index.ndjson       每个事件一行：段号、段内序号、所在 gzip 成员的偏移、时间戳和事件名
+
+每次保存只把新增的事件压缩成一个 gzip 成员追加到当前段，段满后开始新段。
+多个 gzip 成员连接起来仍是合法的 gzip 文件，回放和分析工具可以逐段流式读取，
+也可以按索引从指定时间或事件名开始读取，不需要把所有事件读入内存。
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import gzip
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from loguru import logger
+from pydantic import BaseModel, Field, TypeAdapter
+
+from .events import BaseEvent
+
+EVENT_DIR = "events"
+INDEX_FILE = "index.ndjson"
+
+_adapter: Optional[TypeAdapter] = None
+
+
+class EventLogConfig(BaseModel):
+    """事件日志配置"""
+    enable: bool = Field(True, description="是否把事件保存到分段的事件日志，关闭时事件压缩后写入 task.json")
+    segment_events: int = Field(1000, ge=1, description="每段的最大事件数")
+    level: int = Field(6, ge=1, le=9, description="gzip 压缩级别")
+
+
+def decode_event(data: Dict[str, Any]) -> BaseEvent:
+    global _adapter
+    if _adapter is None:
+        _adapter = TypeAdapter(BaseEvent.get_subclasses_union())
+    return _adapter.validate_python(data)
+
+
+class EventLog:
+    """任务目录中的分段事件日志"""
+
+    def __init__(self, path: Path, config: EventLogConfig | dict | None = None):
+        if isinstance(config, EventLogConfig):
+            self.config = config
+        else:
+            self.config = EventLogConfig(**(config or {}))
+        self.path = Path(path)
+        self.log = logger.bind(src='eventlog')
+        self._entries: List[Dict[str, Any]] = self._read_index()
+        self._recover()
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        return (Path(path) / INDEX_FILE).exists()
+
+    @property
+    def index_file(self) -> Path:
+        return self.path / INDEX_FILE
+
+    def segment_file(self, segment: int) -> Path:
+        return self.path / f"{segment:05d}.ndjson.gz"
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def entries(self) -> List[Dict[str, Any]]:
+        """索引：[{'seg', 'off', 'pos', 'ts', 'name'}]"""
+        return self._entries
+
+    def _read_index(self) -> List[Dict[str, Any]]:
+        entries = []
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return entries
+
+        for n, line in enumerate(lines):
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                if n == len(lines) - 1:
+                    self.log.warning('Ignore incomplete event index record', path=str(self.index_file))
+                    break
+                raise
+        # 最后一行不完整时重写索引，之后的追加不会接在半行后面
+        self._rewrite = bool(lines) and not lines[-1].endswith('\n')
+        return entries
+
+    def _recover(self):
+        """写入中断时，删除索引之外的事件，保证段内序号和索引一致"""
+        if not self.path.exists():
+            return
+
+        entries = self._entries
+        segment = entries[-1]['seg'] if entries else -1
+        for file in self.path.glob('*.ndjson.gz'):
+            if int(file.name.split('.')[0]) > segment:
+                file.unlink()
+        if not entries:
+            self.index_file.unlink(missing_ok=True)
+            return
+
+        # 最后一个 gzip 成员中的事件应该全部在索引中
+        last = entries[-1]
+        members = [e for e in entries if e['seg'] == last['seg'] and e['pos'] == last['pos']]
+        file = self.segment_file(last['seg'])
+        with open(file, 'rb') as f:
+            f.seek(last['pos'])
+            raw = f.read()
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            lines = decompressor.decompress(raw).splitlines()
+            complete = decompressor.eof
+        except zlib.error:
+            lines, complete = [], False
+
+        if complete and len(lines) == len(members):
+            end = last['pos'] + len(raw) - len(decompressor.unused_data)
+        else:
+            # 成员不完整或只有部分事件写入了索引：丢弃整个成员
+            end = last['pos']
+            self._entries = entries[:len(entries) - len(members)]
+            self._rewrite = True
+            self.log.warning('Dropped incomplete event segment member', path=str(file), events=len(members))
+        if self._rewrite:
+            self._write_index()
+        if file.stat().st_size > end:
+            with open(file, 'r+b') as f:
+                f.truncate(end)
+
+    def _write_index(self):
+        tmp = self.index_file.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(e, ensure_ascii=False) + '\n' for e in self._entries)
+        os.replace(tmp, self.index_file)
+
+    def append(self, events: List[BaseEvent], offset: int = 0) -> int:
+        """
+        把 events 中还没有保存的事件压缩后追加到日志，返回新增的事件数
+
+        events[0] 是任务的第 offset 个事件，可以只传入最后的部分事件
+        """
+        saved = len(self._entries)
+        if saved < offset:
+            raise ValueError(f'Event log has {saved} events, cannot append from {offset}')
+        new = events[saved - offset:]
+        if not new:
+            return 0
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        size = self.config.segment_events
+        # 从最后一个事件的位置继续，修改 segment_events 后已有的段不受影响
+        if self._entries:
+            last = self._entries[-1]
+            seg, off = last['seg'], last['off'] + 1
+        else:
+            seg, off = 0, 0
+        entries = []
+        start = 0
+        while start < len(new):
+            if off >= size:
+                seg, off = seg + 1, 0
+            batch = new[start:start + size - off]
+            lines = [json.dumps(e.model_dump(mode='json'), ensure_ascii=False, default=str) for e in batch]
+            member = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), compresslevel=self.config.level)
+            file = self.segment_file(seg)
+            with open(file, 'ab') as f:
+                pos = f.tell()
+                f.write(member)
+            for i, event in enumerate(batch):
+                entries.append({'seg': seg, 'off': off + i, 'pos': pos, 'ts': event.timestamp, 'name': event.name})
+            start += len(batch)
+            off += len(batch)
+
+        # 先写事件再写索引，索引中的事件都已经完整写入
+        with open(self.index_file, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in entries))
+        self._entries.extend(entries)
+        self.log.info('Events appended', events=len(new), total=len(self._entries))
+        return len(new)
+
+    def iter_raw(self, start: int = 0) -> Iterator[Dict[str, Any]]:
+        """从第 start 个事件开始逐个读取事件字典"""
+        entries = self._entries
+        if start >= len(entries):
+            return
+        first = entries[start]
+        segment = first['seg']
+        while segment <= entries[-1]['seg']:
+            # 每段只读取索引中的事件
+            count = sum(1 for e in entries if e['seg'] == segment)
+            with open(self.segment_file(segment), 'rb') as f:
+                skip = 0
+                if segment == first['seg']:
+                    f.seek(first['pos'])
+                    skip = first['off'] - next(e['off'] for e in entries if e['seg'] == segment and e['pos'] == first['pos'])
+                    count -= first['off'] - skip
+                with gzip.open(f, 'rt', encoding='utf-8') as lines:
+                    for n, line in enumerate(lines):
+                        if n >= count:
+                            break
+                        if n >= skip:
+                            yield json.loads(line)
+            segment += 1
+
+    def iter_events(self, names: Iterable[str] | None = None, since: float | None = None) -> Iterator[BaseEvent]:
+        """按顺序流式读取事件，可以只读取指定的事件名，或从指定时间开始"""
+        names = set(names) if names else None
+        start = 0
+        if since is not None:
+            start = next((i for i, e in enumerate(self._entries) if e['ts'] >= since), len(self._entries))
+        for data in self.iter_raw(start):
+            if names is None or data.get('name') in names:
+                yield decode_event(data)
+
+    def load(self) -> List[BaseEvent]:
+        """读取全部事件"""
+        return list(self.iter_events())
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+任务日志（write-ahead journal）
+
+每轮结束后只把新增的内容（消息、Round、代码块、事件等）作为记录追加到任务目录下的 task.journal，
+保存的开销与新增内容成正比，不再每个 Step 重写整个 task.json。
+task.json（或二进制格式的 task.bin）作为快照定期（日志记录数达到 snapshot_records）或在 Task.done 时重写，之后清空日志。
+
+加载时先读快照，再把快照之后（seq 大于快照的 journal_seq）的记录按顺序应用到快照的字典上，
+最后统一做一次模型校验。日志中最后一条不完整的记录（写入时崩溃）被忽略。
+"""
+
+from __future__ import annotations
+
+import os
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from .taskfile import TASK_BIN_FILE, TaskFileReader, write_task_file, read_task_dict, task_summary
+from .eventlog import EventLog, EVENT_DIR
+from .attachments import AttachmentStore
+
+if TYPE_CHECKING:
+    from .task import TaskData
+
+TASK_FILE = "task.json"
+JOURNAL_FILE = "task.journal"
+
+
+class JournalConfig(BaseModel):
+    """任务日志配置"""
+    enable: bool = Field(True, description="是否使用追加日志保存任务，关闭时每个 Step 重写 task.json")
+    snapshot_records: int = Field(500, ge=1, description="日志记录数达到该值时重写快照并清空日志")
+    fsync: bool = Field(False, description="每次追加后调用 fsync")
+
+
+class TaskJournal:
+    """把 TaskData 的增量追加到日志文件"""
+
+    def __init__(self, path: Path, data: TaskData, config: JournalConfig | dict | None = None, format: str = 'json'):
+        if isinstance(config, JournalConfig):
+            self.config = config
+        else:
+            self.config = JournalConfig(**(config or {}))
+        self.path = Path(path)
+        self.data = data
+        # 快照格式：json 或 binary
+        self.format = format
+        self.log = logger.bind(src='journal', id=data.id)
+        # 当前日志文件中的记录数
+        self.records = 0
+        # 加载的任务第一次保存时先写快照，之后日志只记录增量；不在这里访问延迟解码的字段
+        self._marked = False
+        if not data.is_deferred('steps') and not data.steps:
+            self._mark()
+
+    @property
+    def journal_file(self) -> Path:
+        return self.path / JOURNAL_FILE
+
+    @property
+    def snapshot_file(self) -> Path:
+        return self.path / (TASK_BIN_FILE if self.format == 'binary' else TASK_FILE)
+
+    def _mark(self):
+        """记录已经持久化的状态，之后只保存变化的部分"""
+        self._marked = True
+        data = self.data
+        storage = data.message_storage
+        self._messages = len(storage.added)
+        self._shared = len(storage.shared)
+        self._blocks = len(data.blocks.history)
+        # 事件保存在事件日志中时不写入任务日志
+        self._events = 0 if data.events_external else len(data.events)
+        self._steps = [self._step_key(step) for step in data.steps]
+        self._rounds = [len(step.rounds) for step in data.steps]
+        for step in data.steps:
+            step.take_deleted()
+        data.context.track_changes()
+        self._total_tokens = data.context.total_tokens
+
+    def _advance(self):
+        """追加日志之后更新保存位置，Step 和 Round 的保存位置由 _collect 更新"""
+        data = self.data
+        self._messages = len(data.message_storage.added)
+        self._shared = len(data.message_storage.shared)
+        self._blocks = len(data.blocks.history)
+        if not data.events_external:
+            self._events = len(data.events)
+        self._total_tokens = data.context.total_tokens
+
+    @staticmethod
+    def _step_key(step) -> tuple:
+        return (step.title, step.end_time, step.initial_instruction.id, tuple(sorted((step.extra_usage or {}).items())))
+
+    def _collect(self) -> Optional[List[Tuple[str, Any]]]:
+        """
+        收集变化的部分，返回 [(记录类型, 数据)]；结构性变化（删除 Step）无法增量记录时返回 None
+
+        消息、上下文和删除的 Round 由各自的修改方法记录，这里只读取上次保存之后的增量，
+        不扫描整个任务；只有最后保存的 Step 和新的 Step 可能被修改
+        """
+        data = self.data
+        steps = data.steps
+        if len(steps) < len(self._steps):
+            return None
+
+        records = []
+        if not self.journal_file.exists():
+            records.append(('task', {'id': data.id, 'version': data.version}))
+
+        storage = data.message_storage
+        if len(storage.shared) > self._shared:
+            records.append(('shared', storage.shared[self._shared:]))
+        # 已写入共享消息存储的消息只记录 ID
+        new = [id for id in storage.added[self._messages:] if not storage.is_shared(id)]
+        if new:
+            messages = storage.messages
+            records.append(('messages', {id: messages[id].model_dump(mode='json') for id in new}))
+
+        for i in range(max(len(self._steps) - 1, 0), len(steps)):
+            step = steps[i]
+            key = self._step_key(step)
+            if i >= len(self._steps) or key != self._steps[i]:
+                records.append(('step', {'index': i, 'data': step.model_dump(mode='json', exclude={'rounds'}, exclude_none=True)}))
+                self._steps[i:i + 1] = [key]
+            saved = self._rounds[i] if i < len(self._rounds) else 0
+            for j in range(saved, len(step.rounds)):
+                records.append(('round', {'step': i, 'index': j, 'data': step.rounds[j].model_dump(mode='json', exclude_none=True)}))
+            self._rounds[i:i + 1] = [len(step.rounds)]
+
+        for i, step in enumerate(steps):
+            deleted = step.take_deleted()
+            if deleted:
+                records.append(('deleted', {'step': i, 'rounds': deleted}))
+
+        history = data.blocks.history
+        for block in history[self._blocks:]:
+            # 序列化器把空的 deps 转为 None，去掉以保持与快照一致
+            value = block.model_dump(mode='json', exclude_none=True)
+            records.append(('block', {k: v for k, v in value.items() if v is not None}))
+
+        if not data.events_external and len(data.events) > self._events:
+            records.append(('events', [e.model_dump() for e in data.events[self._events:]]))
+
+        context = data.context
+        changes = context.take_changes()
+        if changes is None:
+            records.append(('context', context.model_dump(mode='json', exclude_none=True)))
+        elif changes or context.total_tokens != self._total_tokens:
+            records.append(('context_delta', {'ops': changes, 'total_tokens': context.total_tokens}))
+        return records
+
+    def append(self) -> int:
+        """追加变化的部分，返回写入的记录数；需要时改为重写快照"""
+        if not self._marked:
+            self.snapshot()
+            return 0
+        records = self._collect()
+        if records is None or self.records + len(records) > self.config.snapshot_records:
+            self.snapshot()
+            return 0
+        if not records:
+            return 0
+
+        seq = self.data.journal_seq
+        lines = []
+        for type, value in records:
+            seq += 1
+            lines.append(json.dumps({'seq': seq, 'type': type, 'data': value}, ensure_ascii=False, default=str))
+
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                if self.config.fsync:
+                    os.fsync(f.fileno())
+        except Exception:
+            # 增量已经从各个修改记录中取出，下次保存时重写快照
+            self._marked = False
+            raise
+
+        self.data.journal_seq = seq
+        self.records += len(records)
+        self._advance()
+        self.log.info('Journal appended', records=len(records), seq=seq)
+        return len(records)
+
+    def snapshot(self):
+        """重写快照并清空日志"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        snapshot_file = self.snapshot_file
+        if self.format == 'binary':
+            write_task_file(snapshot_file, self.data)
+        else:
+            tmp = snapshot_file.with_suffix('.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(self.data.model_dump_json(indent=2, exclude_none=True))
+            os.replace(tmp, snapshot_file)
+        # 切换格式后删除另一种格式的旧快照
+        for name in (TASK_FILE, TASK_BIN_FILE):
+            if name != snapshot_file.name:
+                (self.path / name).unlink(missing_ok=True)
+        # 快照包含 journal_seq，清空日志之前崩溃时加载会跳过已包含的记录
+        self.journal_file.unlink(missing_ok=True)
+        self.records = 0
+        self._mark()
+        self.log.info('Snapshot saved', path=str(self.snapshot_file), seq=self.data.journal_seq)
+
+
+def read_journal(path: Path) -> List[dict]:
+    """读取日志记录，忽略末尾不完整的记录"""
+    records = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return records
+
+    for n, line in enumerate(lines):
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            if n == len(lines) - 1:
+                logger.bind(src='journal').warning('Ignore incomplete journal record', path=str(path))
+                break
+            raise
+    return records
+
+
+def apply_records(data: Dict[str, Any], records: List[dict]) -> int:
+    """把快照之后的日志记录应用到 task.json 的字典上，返回应用的记录数"""
+    from .task import TaskData
+
+    base = data.get('journal_seq', 0)
+    applied = 0
+    for record in records:
+        seq = record['seq']
+        if seq <= base:
+            continue
+        type, value = record['type'], record['data']
+        if type == 'task':
+            data.update(value)
+        elif type == 'messages':
+            storage = data.setdefault('message_storage', {})
+            storage.setdefault('messages', {}).update(value)
+        elif type == 'shared':
+            data.setdefault('message_storage', {}).setdefault('shared', []).extend(value)
+        elif type == 'step':
+            steps = data.setdefault('steps', [])
+            index = value['index']
+            if index < len(steps):
+                steps[index] = {**value['data'], 'rounds': steps[index].get('rounds', [])}
+            else:
+                steps.append({**value['data'], 'rounds': []})
+        elif type == 'round':
+            rounds = data['steps'][value['step']]['rounds']
+            if value['index'] < len(rounds):
+                rounds[value['index']] = value['data']
+            else:
+                rounds.append(value['data'])
+        elif type == 'deleted':
+            rounds = data['steps'][value['step']]['rounds']
+            for j in value['rounds']:
+                rounds[j]['context_deleted'] = True
+        elif type == 'block':
+            data.setdefault('blocks', {}).setdefault('history', []).append(value)
+        elif type == 'events':
+            events = TaskData.deserialize_events(data.get('events'))
+            data['events'] = [e if isinstance(e, dict) else e.model_dump() for e in events] + value
+        elif type == 'context':
+            data['context'] = value
+        elif type == 'context_delta':
+            context = data.setdefault('context', {})
+            messages = context.setdefault('messages', [])
+            for op, items in value['ops']:
+                if op == '+':
+                    messages.extend({'id': id} for id in items)
+                else:
+                    removed = set(items)
+                    messages[:] = [msg for i, msg in enumerate(messages) if i not in removed]
+            context['total_tokens'] = value['total_tokens']
+        data['journal_seq'] = seq
+        applied += 1
+    return applied
+
+
+def find_task_file(path: Path) -> Optional[Path]:
+    """返回任务目录中的任务文件，优先使用 task.bin；只有日志时返回 task.json 的路径"""
+    path = Path(path)
+    if (path / TASK_BIN_FILE).exists():
+        return path / TASK_BIN_FILE
+    if (path / TASK_FILE).exists() or (path / JOURNAL_FILE).exists():
+        return path / TASK_FILE
+    return None
+
+
+def load_task_dict(path: Path, events: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    读取 task.json 或 task.bin 快照并应用日志，两者都不存在时返回 None
+
+    events 为 True 时，保存在事件日志中的事件也读入字典
+    """
+    path = Path(path)
+    journal = path.parent / JOURNAL_FILE
+    if path.exists() and path.name == TASK_BIN_FILE:
+        data = read_task_dict(path)
+    elif path.exists():
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.loads(f.read())
+    elif journal.exists():
+        data = {}
+    else:
+        return None
+
+    applied = apply_records(data, read_journal(journal))
+    if applied:
+        logger.bind(src='journal').info('Replayed journal', path=str(journal), records=applied)
+
+    event_dir = path.parent / EVENT_DIR
+    if events and not data.get('events') and EventLog.exists(event_dir):
+        data['events'] = list(EventLog(event_dir).iter_raw())
+    return data
+
+
+def read_task_summary(path: Path) -> Dict[str, Any]:
+    """读取任务 ID 和摘要（第一个 Step 的标题、指令、开始时间，Step/Round 数、token 用量和最后的回复），不创建 Task"""
+    path = Path(path)
+    if path.name == TASK_BIN_FILE and path.exists() and not (path.parent / JOURNAL_FILE).exists():
+        reader = TaskFileReader(path)
+        return {'id': reader.header['task']['id'], **reader.summary}
+
+    data = load_task_dict(path, events=False) or {}
+    messages = data.get('message_storage', {}).get('messages', {})
+    return {'id': data.get('id'), **task_summary(data.get('steps') or [], messages)}
+
+
+def export_task_json(path: Path, output: Path, attachments: AttachmentStore | None = None) -> Path:
+    """把任务文件（task.json、task.bin 及日志）导出为 task.json 格式
+
+    消息中的图片附件引用替换为 data URL，导出的文件可以复制到其它机器上使用。
+    """
+    from .task import TaskData
+
+    data = load_task_dict(path)
+    if data is None:
+        raise FileNotFoundError(f"Task file not found: {path}")
+    for message in data.get('message_storage', {}).get('messages', {}).values():
+        content = message.get('content')
+        if AttachmentStore.has_refs(content):
+            attachments = attachments or AttachmentStore()
+            message['content'] = attachments.inline(content)
+    data = TaskData.model_validate(data)
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write(data.model_dump_json(indent=2, exclude_none=True))
+    return output
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+跨任务共享的内容寻址消息存储
+
+消息以 MessageStorage._compute_id 计算的哈希为 key 保存在 CONFIG_DIR 下的 SQLite 数据库中，
+系统提示词、角色提示和重复的工具输出在所有任务和子任务之间只保存一份，task.json 中只保存消息 ID。
+保存任务之前由 MessageStorage.persist() 把新消息写入存储，加载时第一次访问消息时批量读取。
+AI 消息的 usage 等字段不参与 ID 计算，仍然保存在各自的 task.json 中。
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+from loguru import logger
+from pydantic import BaseModel, Field, TypeAdapter
+
+from ..llm import AIMessage, UserMessage, SystemMessage, ErrorMessage, ToolMessage
+from .config import CONFIG_DIR
+
+MESSAGE_STORE_FILE = CONFIG_DIR / "messages.db"
+
+MessageType = Union[AIMessage, UserMessage, SystemMessage, ErrorMessage, ToolMessage]
+_adapter = TypeAdapter(MessageType)
+
+
+class MessageStoreConfig(BaseModel):
+    """共享消息存储配置"""
+    enable: bool = Field(False, description="是否把消息保存到共享存储")
+    path: Optional[str] = Field(None, description="数据库文件路径")
+
+
+class MessageStore:
+    """基于 SQLite 的消息存储，消息内容不可变，同一个 ID 只写入一次"""
+    BATCH_SIZE = 500
+
+    def __init__(self, path: Union[str, Path, None] = None):
+        self.path = Path(path or MESSAGE_STORE_FILE).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.log = logger.bind(src='msgstore')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id TEXT PRIMARY KEY,
+                body TEXT NOT NULL
+            )
+        ''')
+        self._conn.commit()
+
+    def __contains__(self, id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM messages WHERE id = ?', (id,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def get(self, id: str) -> Optional[MessageType]:
+        with self._lock:
+            row = self._conn.execute('SELECT body FROM messages WHERE id = ?', (id,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return _adapter.validate_json(row[0])
+        except Exception as e:
+            self.log.warning('Invalid message in store', id=id, error=str(e))
+            return None
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, MessageType]:
+        """批量读取消息，不存在或无法解析的 ID 不在返回值中"""
+        ids = list(ids)
+        rows = []
+        with self._lock:
+            # SQLite 限制单条语句的参数个数
+            for i in range(0, len(ids), self.BATCH_SIZE):
+                batch = ids[i:i + self.BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                rows.extend(self._conn.execute(f'SELECT id, body FROM messages WHERE id IN ({placeholders})', batch))
+        messages = {}
+        for id, body in rows:
+            try:
+                messages[id] = _adapter.validate_json(body)
+            except Exception as e:
+                self.log.warning('Invalid message in store', id=id, error=str(e))
+        return messages
+
+    def put_many(self, messages: Dict[str, MessageType]) -> int:
+        """写入消息，已存在的 ID 保持不变，返回写入的条数"""
+        if not messages:
+            return 0
+        rows = [(id, msg.model_dump_json()) for id, msg in messages.items()]
+        with self._lock:
+            cursor = self._conn.executemany('INSERT OR IGNORE INTO messages (id, body) VALUES (?, ?)', rows)
+            self._conn.commit()
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_message_store(config: MessageStoreConfig | dict | None) -> Optional[MessageStore]:
+    """根据配置创建共享消息存储，未启用或创建失败时返回 None"""
+    if not isinstance(config, MessageStoreConfig):
+        config = MessageStoreConfig(**(config or {}))
+    if not config.enable:
+        return None
+    try:
+        return MessageStore(config.path)
+    except Exception as e:
+        logger.bind(src='msgstore').warning('Failed to open message store', path=config.path, error=str(e))
+        return None
@@ -4,7 +4,7 @@
 from base64 import b64encode
 import re
 from pathlib import Path
-from typing import Union, List, Dict, Any, Protocol, Literal
+from typing import TYPE_CHECKING, Union, List, Dict, Any, Protocol, Literal
 import mimetypes
 from abc import ABC, abstractmethod
 
@@ -14,6 +14,9 @@ from pydantic import BaseModel, Field
 
 from ..llm import UserMessage
 
+if TYPE_CHECKING:
+    from .attachments import AttachmentStore
+
 class MMContentError(Exception):
     """Multimodal content processing base exception"""
     pass
@@ -157,6 +160,10 @@ class TextProcessor(ContentProcessor):
 
 class ImageProcessor(ContentProcessor):
     """Image processor"""
+
+    def __init__(self, attachments: 'AttachmentStore' = None, max_size: int | None = None):
+        self.attachments = attachments
+        self.max_size = max_size
     
     def process(self, item: ContentItem) -> Dict[str, Any]:
         url = item['path']
@@ -164,6 +171,13 @@ class ImageProcessor(ContentProcessor):
         # Use network URL directly
         if self._is_network_url(url):
             return {"type": "image_url", "image_url": {"url": url}}
+
+        # Save local image to attachment store, the data URL is built when sending the request
+        if self.attachments:
+            try:
+                return {"type": "image_url", "image_url": {"url": self.attachments.add_image(url, self.max_size)}}
+            except OSError as e:
+                raise FileReadError(url, e)
         
         # Convert local image to data URL
         mime = self._get_mime_type(url, 'image/jpeg')
@@ -236,8 +250,10 @@ class ContentProcessorFactory:
 class ContentFormatter:
     """Content formatter - responsible for formatting processed content into LLM-acceptable format"""
     
-    def __init__(self):
+    def __init__(self, attachments: 'AttachmentStore' = None, max_size: int | None = None):
         self.factory = ContentProcessorFactory()
+        # Processors overriding the factory defaults
+        self.processors = {'image': ImageProcessor(attachments, max_size)} if attachments else {}
     
     def format(self, items: List[ContentItem]) -> UserMessage:
         """Format content item list"""
@@ -245,7 +261,7 @@ class ContentFormatter:
         has_image = False
         
         for item in items:
-            processor = self.factory.get_processor(item.type)
+            processor = self.processors.get(item.type) or self.factory.get_processor(item.type)
             result = processor.process(item)
             results.append(result)
             
@@ -265,13 +281,13 @@ class MMContent:
     After refactoring, the composition pattern is used, and the responsibilities are separated more clearly.
     """
     
-    def __init__(self, string: str, base_path: Path = None):
+    def __init__(self, string: str, base_path: Path = None, attachments: 'AttachmentStore' = None, max_size: int | None = None):
         self.string = string
         self.log = logger.bind(type='MultiModal')
         
         # Use the various components of the composition
         self.parser = ContentParser(base_path)
-        self.formatter = ContentFormatter()
+        self.formatter = ContentFormatter(attachments, max_size)
         
         # Parse content
         self.items = self.parser.parse(string)
@@ -68,6 +68,7 @@ class Response(BaseModel):
     code_blocks: List[CodeBlock] | None = Field(default=None, description="Code blocks")
     tool_calls: List[ToolCall] | None = Field(default=None, description="Tool calls")
     errors: Errors | None = Field(default=None, description="Errors")
+    llm: str | None = Field(default=None, description="Name of the LLM client that served this response")
     
     @property
     def log(self):
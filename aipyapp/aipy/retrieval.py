@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+任务历史检索
+
+对任务的所有消息（MessageStorage）和代码块的所有版本（CodeBlocks.history）建立 BM25 倒排索引，
+上下文压缩时按当前指令检索最相关的历史内容重新放回上下文（见 context.RetrievalStrategy）。
+索引是增量的：新消息只分词一次，索引随任务一起保存；加载任务后第一次检索时补上还没有索引的历史消息，之后只检查新增的消息。
+"""
+
+from __future__ import annotations
+
+import re
+import math
+from collections import Counter
+from typing import TYPE_CHECKING, ClassVar, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from ..llm import MessageRole
+
+if TYPE_CHECKING:
+    from .chat import MessageStorage
+    from .blocks import CodeBlocks, CodeBlock
+
+RETRIEVED_TAG = "<retrieved_context>"
+SNIPPET_CHARS = 800
+
+_TOKEN_RE = re.compile(r'[a-z0-9_]+|[぀-ヿ㐀-䶿一-鿿가-힯]+')
+_CJK_RE = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯]')
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：英文按单词，中日韩文字按相邻两个字（单字词保留单字）"""
+    tokens = []
+    for word in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        elif len(word) > 1:
+            tokens.append(word)
+    return tokens
+
+
+def message_text(content) -> str:
+    """消息内容中的文本部分"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return '\n'.join(getattr(item, 'text', '') or '' for item in content)
+    return ''
+
+
+class BM25Index(BaseModel):
+    """BM25 倒排索引"""
+    K1: ClassVar[float] = 1.5
+    B: ClassVar[float] = 0.75
+
+    # 文档 ID -> 文档长度（词数）
+    docs: Dict[str, int] = Field(default_factory=dict)
+    # 词 -> {文档 ID: 词频}
+    postings: Dict[str, Dict[str, int]] = Field(default_factory=dict)
+    total_length: int = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.docs
+
+    def add(self, doc_id: str, text: str) -> bool:
+        """添加文档，已存在时忽略，返回是否添加"""
+        if doc_id in self.docs:
+            return False
+        tokens = tokenize(text)
+        self.docs[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        return True
+
+    def search(self, query: str, k: int, exclude: Set[str] | None = None) -> List[Tuple[str, float]]:
+        """返回得分最高的 k 个文档 [(文档 ID, 得分)]"""
+        if not self.docs or k <= 0:
+            return []
+        exclude = exclude or set()
+        n = len(self.docs)
+        avgdl = self.total_length / n or 1
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                if doc_id in exclude:
+                    continue
+                norm = tf + self.K1 * (1 - self.B + self.B * self.docs[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.K1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class RetrievalIndex(BaseModel):
+    """任务历史索引（随任务保存）"""
+    bm25: BM25Index = Field(default_factory=BM25Index)
+    # 已索引的 CodeBlocks.history 条数
+    blocks_indexed: int = 0
+
+
+class HistoryRetriever:
+    """在任务的消息和代码块历史中检索相关内容"""
+
+    def __init__(self, index: RetrievalIndex, message_storage: MessageStorage, blocks: CodeBlocks):
+        self.index = index
+        self.message_storage = message_storage
+        self.blocks = blocks
+        self.log = logger.bind(src='retrieval')
+        # 已索引的 MessageStorage.added 条数，None 表示还没有检查加载任务之前保存的消息
+        self._messages_indexed: int | None = None
+
+    @staticmethod
+    def message_doc(message_id: str) -> str:
+        return f"msg:{message_id}"
+
+    @staticmethod
+    def block_doc(block: CodeBlock) -> str:
+        return f"block:{block.name}:{block.version}"
+
+    def _new_message_ids(self) -> List[str]:
+        """上次索引之后新增的消息 ID"""
+        storage = self.message_storage
+        if self._messages_indexed is None:
+            # 第一次检索时补上加载任务之前还没有索引的消息：延迟解码的消息和共享存储中的消息也要读取，
+            # 检索结果本来就需要它们的内容；之后只检查 store() 新增的消息
+            storage.load_deferred()
+            storage.load_pending()
+            ids = list(storage.messages)
+        else:
+            ids = storage.added[self._messages_indexed:]
+        self._messages_indexed = len(storage.added)
+        return ids
+
+    def update(self) -> int:
+        """索引新增的消息和代码块版本，返回新增的文档数"""
+        bm25 = self.index.bm25
+        messages = self.message_storage.messages
+        added = 0
+        for id in self._new_message_ids():
+            doc_id = self.message_doc(id)
+            message = messages.get(id)
+            if message is None or doc_id in bm25 or message.role == MessageRole.SYSTEM:
+                continue
+            text = message_text(message.content)
+            if text.startswith(RETRIEVED_TAG):
+                continue
+            added += bm25.add(doc_id, text)
+
+        history = self.blocks.history
+        for block in history[self.index.blocks_indexed:]:
+            added += bm25.add(self.block_doc(block), f"{block.name}\n{block.code}")
+        self.index.blocks_indexed = len(history)
+
+        if added:
+            self.log.info('Indexed task history', added=added, total=len(bm25))
+        return added
+
+    def _snippet(self, doc_id: str) -> Optional[str]:
+        kind, _, key = doc_id.partition(':')
+        if kind == 'msg':
+            message = self.message_storage.get(key)
+            if message is None:
+                return None
+            text = message_text(message.content)
+            body = text[:SNIPPET_CHARS] + ('...' if len(text) > SNIPPET_CHARS else '')
+            return f'<message role="{message.role.value}">\n{body}\n</message>'
+
+        name, _, version = key.rpartition(':')
+        for block in self.blocks.history:
+            if block.name == name and str(block.version) == version:
+                code = block.code[:SNIPPET_CHARS] + ('\n...' if len(block.code) > SNIPPET_CHARS else '')
+                return f'<code_block name="{name}" version="{version}" lang="{block.lang}">\n{code}\n</code_block>'
+        return None
+
+    def search(self, query: str, k: int, exclude_messages: Set[str] | None = None) -> List[str]:
+        """检索与 query 最相关的 k 条历史内容，exclude_messages 是仍在上下文中的消息 ID"""
+        self.update()
+        exclude = {self.message_doc(id) for id in exclude_messages or ()}
+        snippets = []
+        for doc_id, _ in self.index.bm25.search(query, k, exclude):
+            snippet = self._snippet(doc_id)
+            if snippet:
+                snippets.append(snippet)
+        return snippets
@@ -2,12 +2,15 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import annotations
-from typing import List, TYPE_CHECKING, Any
+from typing import Dict, List, TYPE_CHECKING, Any
 import time
+import asyncio
 from collections import Counter
+from dataclasses import dataclass, field
+from enum import Enum
 
 from loguru import logger
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 from ..llm import ErrorMessage, UserMessage, ToolMessage
 from .chat import ChatMessage
@@ -18,6 +21,32 @@ from .prompts import Prompts
 if TYPE_CHECKING:
     from .task import Task
 
+class CompactPolicy(str, Enum):
+    """Step 上下文压缩策略"""
+    NONE = "none"                        # 不压缩
+    FAILED_ROUNDS = "failed-rounds"      # 删除失败的 Round
+    ALL_BUT_LAST = "all-but-last"        # 只保留最后一个 Round
+    SUMMARY_REPLACE = "summary-replace"  # 用一条摘要替换最后一个 Round 之前的 Round
+
+class StepCompactConfig(BaseModel):
+    """新 Step 开始前自动压缩上一个 Step 的配置"""
+    policy: CompactPolicy = Field(CompactPolicy.FAILED_ROUNDS, description="压缩策略")
+    min_tokens_saved: int = Field(0, ge=0, description="预计节省的 token 数达到该值时才压缩")
+
+@dataclass
+class CompactPlan:
+    """压缩计划：dry-run 的结果，执行前不修改上下文"""
+    policy: CompactPolicy
+    # 要从上下文删除的 Round 下标
+    rounds: List[int] = field(default_factory=list)
+    message_ids: List[str] = field(default_factory=list)
+    # 上下文中实际会删除的消息数
+    messages: int = 0
+    # 预计节省的 token 数（已减去摘要消息的 token 数）
+    tokens_saved: int = 0
+    # summary-replace 策略替换进上下文的摘要消息
+    summary: UserMessage | None = None
+
 class Round(BaseModel):
     # LLM的回复消息
     llm_response: Response = Field(default_factory=Response)
@@ -86,6 +115,12 @@ class StepData(BaseModel):
     
     # 每个Round包含完整的对话+执行循环  
     rounds: List[Round] = Field(default_factory=list)
+
+    # Round 之外的 LLM 请求（如后台上下文摘要）的 token 用量
+    extra_usage: Dict[str, int] | None = None
+
+    # 上次 take_deleted() 之后从上下文删除的 Round 下标（任务日志使用）
+    _deleted: List[int] = PrivateAttr(default_factory=list)
     
     @property
     def final_response(self):
@@ -94,12 +129,26 @@ class StepData(BaseModel):
     def add_round(self, round: Round):
         self.rounds.append(round)
 
+    def mark_context_deleted(self, index: int):
+        """标记 Round 的消息已从上下文删除"""
+        round = self.rounds[index]
+        if not round.context_deleted:
+            round.context_deleted = True
+            self._deleted.append(index)
+
+    def take_deleted(self) -> List[int]:
+        """返回并清空上次调用之后标记删除的 Round 下标"""
+        deleted, self._deleted = self._deleted, []
+        return deleted
+
 class Step:
     def __init__(self, task: Task, data: StepData):
         self.task = task
         self.log = logger.bind(src='Step')
         self._data = data
         self._summary = Counter()
+        # 每轮各阶段耗时（秒），仅运行时使用，不保存
+        self.timings: List[dict] = []
         self._cleaner = StepCleaner(task.context_manager)
 
         # 从现有数据初始化 summary counter
@@ -115,6 +164,15 @@ class Step:
                 usage = round_data.llm_response.message.usage
                 if usage:
                     self._summary.update(usage)
+        if self._data.extra_usage:
+            self._summary.update(self._data.extra_usage)
+
+    def add_usage(self, usage: Dict[str, int]):
+        """计入 Round 之外的 LLM 请求的 token 用量"""
+        extra = Counter(self._data.extra_usage or {})
+        extra.update(usage)
+        self._data.extra_usage = dict(extra)
+        self._summary.update(usage)
     
     @property
     def data(self):
@@ -132,14 +190,28 @@ class Step:
     def request(self, user_message: ChatMessage | List[ChatMessage]) -> Response:
         client = self.task.client
         self.task.emit('request_started', llm=client.name)
-        msg = client(user_message)
-        self.task.emit('response_completed', llm=client.name, msg=msg)
+        with self.task.timer.measure('llm'):
+            msg = client(user_message)
+        return self._on_response(client.served_by or client.name, msg)
+
+    async def arequest(self, user_message: ChatMessage | List[ChatMessage]) -> Response:
+        client = self.task.client
+        self.task.emit('request_started', llm=client.name)
+        with self.task.timer.measure('llm'):
+            msg = await client.acall(user_message)
+        return self._on_response(client.served_by or client.name, msg)
+
+    def _on_response(self, llm: str, msg: ChatMessage) -> Response:
+        self.task.emit('response_completed', llm=llm, msg=msg)
         if isinstance(msg.message, ErrorMessage):
-            response = Response(message=msg)
+            response = Response(message=msg, llm=llm)
             self.log.error('LLM request error', error=msg.content)
         else:
             self._summary.update(msg.usage)
-            response = Response.from_message(msg, parse_mcp=self.task.mcp)
+            with self.task.timer.measure('parse'):
+                response = Response.from_message(msg, parse_mcp=self.task.mcp)
+        # 记录实际响应本轮请求的客户端（可能是备用或对冲客户端）
+        response.llm = llm
         return response
 
     def process(self, response: Response) -> list[ToolCallResult] | None:
@@ -153,62 +225,101 @@ class Step:
             self.task.blocks.add_blocks(response.code_blocks)
         
         if response.tool_calls:
-            toolcall_results = self.task.tool_call_processor.process(self.task, response.tool_calls)
+            with self.task.timer.measure('tools'):
+                toolcall_results = self.task.tool_call_processor.process(self.task, response.tool_calls)
         else:
             toolcall_results = None
         return toolcall_results
     
     def run(self) -> Response:
         max_rounds = self.task.max_rounds
-        message_storage = self.task.message_storage
         user_message = self.data.initial_instruction
 
+        timer = self.task.timer
         response = None
         while len(self['rounds']) < max_rounds:
+            mark = timer.snapshot()
             # 请求LLM回复
             response = self.request(user_message)
             self.task.emit('parse_reply_completed', response=response)
-            
-            # 创建新的Round，包含LLM回复
-            round = Round(llm_response=response)
 
             # 处理工具调用
-            round.toolcall_results = self.process(response)
-
-            # 始终将round添加到rounds列表中
-            self._data.add_round(round)
-
-            # 生成系统反馈消息
-            system_feedback = None
-
-            # 优先尝试生成 ToolMessage
-            if round.toolcall_results and self.task.client.supports_function_calling():
-                tool_messages = []
-                for res in round.toolcall_results:
-                    if res.id: # ToolCallResult has id
-                        # 确保 result 是字符串
-                        content = res.result.to_json() if hasattr(res.result, 'to_json') else str(res.result)
-                        msg = ToolMessage(tool_call_id=res.id, content=content)
-                        tool_messages.append(message_storage.store(msg))
-                if tool_messages:
-                    system_feedback = tool_messages
-
-            if not system_feedback:
-                system_feedback = round.get_system_feedback(self.task.prompts)
-
-            if not system_feedback:
+            toolcall_results = self.process(response)
+
+            user_message = self._add_round(response, toolcall_results)
+            if user_message:
+                # Step 结束时由 Task 保存，中间的 Round 追加到任务日志
+                self.task.checkpoint()
+            self.timings.append(timer.since(mark))
+            if not user_message:
                 break
 
-            if isinstance(system_feedback, list):
-                round.system_feedback = system_feedback
-                user_message = system_feedback
-            else:
-                round.system_feedback = message_storage.store(system_feedback)
-                user_message = round.system_feedback
+        self['end_time'] = time.time()
+        return response
+
+    async def arun(self) -> Response:
+        """run 的异步版本：等待 LLM 时不占用线程，工具调用在线程中执行"""
+        max_rounds = self.task.max_rounds
+        user_message = self.data.initial_instruction
+
+        timer = self.task.timer
+        response = None
+        while len(self['rounds']) < max_rounds:
+            mark = timer.snapshot()
+            response = await self.arequest(user_message)
+            self.task.emit('parse_reply_completed', response=response)
+
+            # 代码执行等工具调用是同步阻塞的
+            toolcall_results = await asyncio.to_thread(self.process, response)
+
+            user_message = self._add_round(response, toolcall_results)
+            if user_message:
+                # Step 结束时由 Task 保存，中间的 Round 追加到任务日志（写文件，在线程中执行）
+                await asyncio.to_thread(self.task.checkpoint)
+            self.timings.append(timer.since(mark))
+            if not user_message:
+                break
 
         self['end_time'] = time.time()
         return response
 
+    def _add_round(self, response: Response, toolcall_results: list[ToolCallResult] | None) -> ChatMessage | List[ChatMessage] | None:
+        """记录Round并生成下一轮发送给LLM的消息，返回 None 表示Step结束"""
+        message_storage = self.task.message_storage
+
+        # 创建新的Round，包含LLM回复
+        round = Round(llm_response=response, toolcall_results=toolcall_results)
+
+        # 始终将round添加到rounds列表中
+        self._data.add_round(round)
+
+        # 生成系统反馈消息
+        system_feedback = None
+
+        # 优先尝试生成 ToolMessage
+        if round.toolcall_results and self.task.client.supports_function_calling():
+            tool_messages = []
+            for res in round.toolcall_results:
+                if res.id: # ToolCallResult has id
+                    # 确保 result 是字符串
+                    content = res.result.to_json() if hasattr(res.result, 'to_json') else str(res.result)
+                    msg = ToolMessage(tool_call_id=res.id, content=content)
+                    tool_messages.append(message_storage.store(msg))
+            if tool_messages:
+                system_feedback = tool_messages
+
+        if not system_feedback:
+            system_feedback = round.get_system_feedback(self.task.prompts)
+
+        if not system_feedback:
+            return None
+
+        if isinstance(system_feedback, list):
+            round.system_feedback = system_feedback
+        else:
+            round.system_feedback = message_storage.store(system_feedback)
+        return round.system_feedback
+
     def get_summary(self):
         summary = dict(self._summary)
 
@@ -220,6 +331,11 @@ class Step:
         summary['elapsed_time'] = int(self['end_time'] - self['start_time'])
         summary['rounds'] = len(self['rounds'])
         summarys = "{rounds} | {elapsed_time}s | Tokens: {input_tokens}/{output_tokens}/{total_tokens}".format(**summary)
+        # 提示词缓存命中率
+        cached_tokens = summary.get('cached_tokens', 0)
+        if cached_tokens and summary['input_tokens']:
+            summary['cache_hit_ratio'] = round(cached_tokens / summary['input_tokens'], 3)
+            summarys += " | Cache: {cached_tokens} ({cache_hit_ratio:.0%})".format(**summary)
         summary['summary'] = summarys
         return summary
 
@@ -227,9 +343,16 @@ class Step:
         """清理步骤消息"""
         return self._cleaner.cleanup_step(self)
 
-    def compact(self) -> tuple[int, int, int, int]:
-        """智能压缩步骤消息"""
-        return self._cleaner.compact_step(self)
+    def compact(self, policy: CompactPolicy | str = CompactPolicy.FAILED_ROUNDS,
+                min_tokens_saved: int = 0) -> tuple[int, int, int, int]:
+        """按策略压缩步骤消息"""
+        return self._cleaner.compact_step(self, policy, min_tokens_saved)
+
+    def compact_preview(self, policy: CompactPolicy | str | None = None) -> CompactPlan | List[CompactPlan]:
+        """dry-run：返回指定策略（默认所有策略）的压缩计划，不修改上下文"""
+        if policy is None:
+            return self._cleaner.preview(self)
+        return self._cleaner.plan(self, policy)
 
     def delete_cleanup(self) -> tuple[int, int, int, int]:
         """删除步骤时的清理"""
@@ -239,200 +362,122 @@ class Step:
 class StepCleaner:
     """Step级别的清理器"""
 
+    SUMMARY_PREVIEW_CHARS = 200
+
     def __init__(self, context_manager):
         self.context_manager = context_manager
         self.log = logger.bind(src='StepCleaner')
 
-    def _execute_cleaning(self, step: 'Step', messages_to_clean: List[str],
-                         operation_name: str, log_prefix: str) -> tuple[int, int, int, int]:
-        """执行清理的核心公共逻辑
+    def _stats(self) -> tuple[int, int, int, int]:
+        stats = self.context_manager.get_stats()
+        return 0, stats['message_count'], 0, stats['total_tokens']
+
+    @staticmethod
+    def _round_message_ids(round: Round) -> List[str]:
+        """Round 对应的上下文消息 ID"""
+        ids = []
+        # Response 没有工具调用和代码块时为 False，这里只检查消息
+        if round.llm_response.message:
+            ids.append(round.llm_response.message.id)
+        if round.system_feedback:
+            if isinstance(round.system_feedback, list):
+                ids.extend(msg.id for msg in round.system_feedback)
+            else:
+                ids.append(round.system_feedback.id)
+        return ids
 
-        Args:
-            step: 要清理的Step对象
-            messages_to_clean: 需要清理的消息ID列表
-            operation_name: 操作名称 (cleanup/compact/delete)
-            log_prefix: 日志前缀
+    def _select_rounds(self, step: 'Step', policy: CompactPolicy) -> List[int]:
+        """按策略选择要从上下文删除的 Round，已删除的 Round 不再选择"""
+        rounds = step.data.rounds
+        if policy == CompactPolicy.NONE or len(rounds) < 2:
+            return []
+        if policy == CompactPolicy.FAILED_ROUNDS:
+            selected = [i for i, round in enumerate(rounds) if round.can_safely_delete()]
+        else:
+            selected = list(range(len(rounds) - 1))
+        return [i for i in selected if not rounds[i].context_deleted]
+
+    def _summary_message(self, step: 'Step', indices: List[int]) -> UserMessage:
+        """summary-replace 策略的摘要：每个 Round 的结果和回复开头，不请求 LLM"""
+        lines = []
+        for i in indices:
+            round = step.data.rounds[i]
+            content = round.llm_response.message.content if round.llm_response.message else ''
+            preview = ' '.join((content or '').split())
+            if len(preview) > self.SUMMARY_PREVIEW_CHARS:
+                preview = preview[:self.SUMMARY_PREVIEW_CHARS] + '...'
+            lines.append(f"- Round {i} [{self._get_round_summary(round)}]: {preview}")
+        body = '\n'.join(lines)
+        return UserMessage(content=f"<compacted_rounds>\nEarlier rounds of this step were removed from the context:\n{body}\n</compacted_rounds>")
+
+    def plan(self, step: 'Step', policy: CompactPolicy | str) -> CompactPlan:
+        """dry-run：计算按策略压缩的效果，不修改上下文和 Round 记录"""
+        policy = CompactPolicy(policy)
+        plan = CompactPlan(policy=policy, rounds=self._select_rounds(step, policy))
+        for i in plan.rounds:
+            plan.message_ids.extend(self._round_message_ids(step.data.rounds[i]))
+        plan.messages, plan.tokens_saved = self.context_manager.estimate_delete(plan.message_ids)
+
+        if policy == CompactPolicy.SUMMARY_REPLACE and plan.messages:
+            plan.summary = self._summary_message(step, plan.rounds)
+            tokens = self.context_manager.compressor.estimate_message_tokens(
+                ChatMessage(id=f"compact:{hash(plan.summary.content)}", message=plan.summary))
+            plan.tokens_saved -= tokens
+
+        self.log.debug('Compact plan', policy=policy.value, rounds=plan.rounds,
+                       messages=plan.messages, tokens_saved=plan.tokens_saved)
+        return plan
+
+    def preview(self, step: 'Step') -> List[CompactPlan]:
+        """所有策略的 dry-run 结果"""
+        return [self.plan(step, policy) for policy in CompactPolicy]
+
+    def apply(self, step: 'Step', plan: CompactPlan) -> tuple[int, int, int, int]:
+        """执行压缩计划（只清理上下文消息，保留执行记录）
 
         Returns:
             (cleaned_count, remaining_messages, tokens_saved, tokens_remaining)
         """
-        # 执行清理
-        if not messages_to_clean:
-            self.log.info("No messages need to be cleaned")
-            stats = self.context_manager.get_stats()
-            return 0, stats['message_count'], 0, stats['total_tokens']
-
-        # 获取清理前的统计信息
-        stats_before = self.context_manager.get_stats()
-        messages_before = stats_before['message_count']
-        tokens_before = stats_before['total_tokens']
+        if not plan.message_ids:
+            return self._stats()
 
-        # 执行清理（只清理上下文消息，不影响rounds记录）
-        self.log.info(f"Executing {log_prefix} with {len(messages_to_clean)} message IDs")
-        deleted_result = self.context_manager.delete_messages_by_ids(messages_to_clean)
-        self.log.info(f"delete_messages_by_ids returned: {deleted_result}")
-
-        # 获取清理后的统计信息
-        stats_after = self.context_manager.get_stats()
-        messages_after = stats_after['message_count']
-        tokens_after = stats_after['total_tokens']
+        for i in plan.rounds:
+            step.data.mark_context_deleted(i)
 
-        # 计算清理结果
-        cleaned_count = messages_before - messages_after
-        tokens_saved = tokens_before - tokens_after
-
-        self.log.info(f"{operation_name} completed: {cleaned_count} messages deleted")
-        self.log.info(f"Messages: {messages_before} -> {messages_after}")
-        self.log.info(f"Tokens: {tokens_before} -> {tokens_after} (saved: {tokens_saved})")
-
-        return cleaned_count, messages_after, tokens_saved, tokens_after
-
-    def _get_cleanup_messages(self, step: 'Step') -> List[str]:
-        """cleanup 策略：保留最后一轮，删除其他所有消息"""
-        messages_to_clean = []
-        rounds = step.data.rounds
-
-        for i, round in enumerate(rounds[:-1]):
-            # 收集这个Round的所有消息ID
-            round.context_deleted = True
-            if round.llm_response and round.llm_response.message:
-                messages_to_clean.append(round.llm_response.message.id)
-            if round.system_feedback:
-                if isinstance(round.system_feedback, list):
-                    for msg in round.system_feedback:
-                        messages_to_clean.append(msg.id)
-                else:
-                    messages_to_clean.append(round.system_feedback.id)
-
-            self.log.info(f"Will clean Round {i}: {self._get_round_summary(round)}")
-
-        self.log.info(f"Will clean {len(messages_to_clean)} messages from {len(rounds)-1} rounds (preserving last round)")
-        return messages_to_clean
-
-    def _get_compact_messages(self, step: 'Step') -> List[str]:
-        """compact 策略：基于 round.can_safely_delete() 智能选择"""
-        messages_to_clean = []
-        rounds = step.data.rounds
-
-        # 分析每个Round，收集可删除Round的消息ID
-        for i, round in enumerate(rounds):
-            if round.can_safely_delete():
-                # 收集这个Round的消息ID用于删除
-                round.context_deleted = True
-                if round.llm_response and round.llm_response.message:
-                    messages_to_clean.append(round.llm_response.message.id)
-                if round.system_feedback:
-                    if isinstance(round.system_feedback, list):
-                        for msg in round.system_feedback:
-                            messages_to_clean.append(msg.id)
-                    else:
-                        messages_to_clean.append(round.system_feedback.id)
-
-                self.log.info(f"Will clean Round {i}: {self._get_round_summary(round)}")
-            else:
-                self.log.info(f"Preserving Round {i}: {self._get_round_summary(round)}")
-
-        self.log.info(f"Will clean {len(messages_to_clean)} messages from deletable rounds")
-        return messages_to_clean
-
-    def _get_delete_messages(self, step: 'Step') -> List[str]:
-        """delete 策略：删除所有消息（包括初始指令）"""
-        messages_to_clean = []
-
-        # 1. 删除initial_instruction
-        if step.data.initial_instruction:
-            messages_to_clean.append(step.data.initial_instruction.id)
-            self.log.info(f"Will delete initial_instruction: {step.data.initial_instruction.id}")
-
-        # 2. 删除所有rounds的消息
-        for i, round in enumerate(step.data.rounds):
-            self.log.info(f"Processing Round {i}: {self._get_round_summary(round)}")
-            if round.llm_response.message:
-                msg_id = round.llm_response.message.id
-                messages_to_clean.append(msg_id)
-                self.log.info(f"✅ Will delete Round {i} LLM response: {msg_id}")
-
-            # 检查系统反馈
-            if round.system_feedback:
-                if isinstance(round.system_feedback, list):
-                    for msg in round.system_feedback:
-                        messages_to_clean.append(msg.id)
-                        self.log.info(f"✅ Will delete Round {i} system feedback: {msg.id}")
-                else:
-                    feedback_id = round.system_feedback.id
-                    messages_to_clean.append(feedback_id)
-                    self.log.info(f"✅ Will delete Round {i} system feedback: {feedback_id}")
-
-            # 标记为删除
-            round.context_deleted = True
+        if plan.summary is not None:
+            summary = self.context_manager.message_store.store(plan.summary)
+            cleaned_count, tokens_saved = self.context_manager.replace_messages_by_ids(plan.message_ids, summary)
+        else:
+            cleaned_count, tokens_saved = self.context_manager.delete_messages_by_ids(plan.message_ids)
 
-        self.log.info(f"Will delete {len(messages_to_clean)} messages from step deletion")
-        return messages_to_clean
+        stats = self.context_manager.get_stats()
+        self.log.info(f"{plan.policy.value} completed: {cleaned_count} messages from {len(plan.rounds)} rounds, "
+                      f"saved {tokens_saved} tokens, remaining {stats['total_tokens']}")
+        return cleaned_count, stats['message_count'], tokens_saved, stats['total_tokens']
 
-    def cleanup_step(self, step: 'Step') -> tuple[int, int, int, int]:
-        """Step完成后的最大化清理：从上下文删除所有Round消息，但保留执行记录
+    def compact_step(self, step: 'Step', policy: CompactPolicy | str = CompactPolicy.FAILED_ROUNDS,
+                     min_tokens_saved: int = 0) -> tuple[int, int, int, int]:
+        """按策略压缩Step的上下文消息，完全保留step.data.rounds（执行历史记录）
 
-        与compact_step的区别：
-        - cleanup_step: 删除所有Round消息（最大化清理）
-        - compact_step: 只删除失败Round消息（智能清理）
+        预计节省的 token 数小于 min_tokens_saved 时不压缩。
+        Step级别的initial_instruction自动保护。
 
         Returns:
             (cleaned_count, remaining_messages, tokens_saved, tokens_remaining)
         """
-        if len(step.data.rounds) < 2:
-            self.log.info("No enough rounds found in step, skipping cleanup")
-            stats = self.context_manager.get_stats()
-            return 0, stats['message_count'], 0, stats['total_tokens']
+        plan = self.plan(step, policy)
+        if not plan.messages or plan.tokens_saved < max(min_tokens_saved, 1):
+            self.log.info(f"Skip {plan.policy.value} compact: {plan.tokens_saved} tokens < {min_tokens_saved}")
+            return self._stats()
+        return self.apply(step, plan)
 
-        rounds = step.data.rounds
-        self.log.info(f"Step has {len(rounds)} rounds, implementing maximum cleanup")
-
-        # 使用策略选择器获取要清理的消息
-        messages_to_clean = self._get_cleanup_messages(step)
-
-        # 使用公共清理逻辑
-        cleaned_count, remaining_messages, tokens_saved, tokens_remaining = self._execute_cleaning(
-            step, messages_to_clean, "Maximum cleanup", "Maximum cleanup"
-        )
-
-        # 记录特定于cleanup的日志
-        self.log.info(f"Execution records preserved: {len(rounds)} rounds kept")
-        self.log.info("Context preserved: initial_instruction + last round")
-
-        return cleaned_count, remaining_messages, tokens_saved, tokens_remaining
-
-    def compact_step(self, step: 'Step') -> tuple[int, int, int, int]:
-        """智能压缩Step：只清理上下文消息，保留执行记录
-
-        基于Round.can_safely_delete()方法智能判断哪些上下文消息可以删除：
-        - 删除可安全删除Round对应的上下文消息
-        - 保留重要Round对应的上下文消息
-        - 完全保留step.data.rounds（执行历史记录）
-        - Step级别的initial_instruction自动保护
+    def cleanup_step(self, step: 'Step') -> tuple[int, int, int, int]:
+        """Step完成后的最大化清理：从上下文删除最后一轮之外的所有Round消息，但保留执行记录
 
         Returns:
             (cleaned_count, remaining_messages, tokens_saved, tokens_remaining)
         """
-        if len(step.data.rounds) < 2:
-            self.log.info("No enough rounds found in step, skipping compact")
-            stats = self.context_manager.get_stats()
-            return 0, stats['message_count'], 0, stats['total_tokens']
-
-        rounds = step.data.rounds
-        self.log.info(f"Step has {len(rounds)} rounds, implementing smart compact")
-
-        # 使用策略选择器获取要清理的消息
-        messages_to_clean = self._get_compact_messages(step)
-
-        # 使用公共清理逻辑
-        cleaned_count, remaining_messages, tokens_saved, tokens_remaining = self._execute_cleaning(
-            step, messages_to_clean, "Compact", "Smart compact"
-        )
-
-        # 记录特定于compact的日志
-        self.log.info(f"Execution records preserved: {len(rounds)} rounds kept")
-
-        return cleaned_count, remaining_messages, tokens_saved, tokens_remaining
+        return self.compact_step(step, CompactPolicy.ALL_BUT_LAST)
 
     def delete_step(self, step: 'Step') -> tuple[int, int, int, int]:
         """删除Step时清理所有相关消息：initial_instruction + 所有rounds
@@ -442,15 +487,18 @@ class StepCleaner:
         """
         self.log.info(f"Deleting step context: {step.data.instruction[:50]}...")
 
-        # 使用策略选择器获取要清理的消息
-        messages_to_clean = self._get_delete_messages(step)
-
-        # 使用公共清理逻辑
-        cleaned_count, remaining_messages, tokens_saved, tokens_remaining = self._execute_cleaning(
-            step, messages_to_clean, "Step deletion", "Step deletion"
-        )
+        messages_to_clean = []
+        if step.data.initial_instruction:
+            messages_to_clean.append(step.data.initial_instruction.id)
+        for i, round in enumerate(step.data.rounds):
+            messages_to_clean.extend(self._round_message_ids(round))
+            step.data.mark_context_deleted(i)
 
-        return cleaned_count, remaining_messages, tokens_saved, tokens_remaining
+        stats_before = self.context_manager.get_stats()
+        self.context_manager.delete_messages_by_ids(messages_to_clean)
+        stats_after = self.context_manager.get_stats()
+        return (stats_before['message_count'] - stats_after['message_count'], stats_after['message_count'],
+                stats_before['total_tokens'] - stats_after['total_tokens'], stats_after['total_tokens'])
 
     def _get_round_summary(self, round: Round) -> str:
         """获取Round的简要描述用于日志"""
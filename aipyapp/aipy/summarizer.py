@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+后台上下文摘要
+
+上下文 token 数超过 ContextConfig.summary_threshold * max_tokens 时（默认不启用），在 Step 完成后（用户空闲时）
+用后台线程请求 LLM 为已完成的对话生成摘要。已有的摘要在之后新增的消息较少时继续使用，不重复请求。上下文达到 max_tokens 时，ContextManager 直接用
+摘要替换这部分消息，不需要在关键路径上额外等待一轮 LLM 请求。
+"""
+
+from __future__ import annotations
+
+import time
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from loguru import logger
+
+from ..llm import MessageRole, UserMessage, AIMessage, ErrorMessage
+from .chat import ChatMessage, MessageStorage
+from .client import QuietStreamProcessor
+
+if TYPE_CHECKING:
+    from .task import Task
+    from .context import ContextManager
+
+SUMMARY_USER_TEMPLATE = (
+    "CONTEXT SUMMARY:\n{summary}\n\n"
+    "This is a compressed summary of the previous conversation. "
+    "Please continue the work based on this summarized context."
+)
+SUMMARY_AI_ACK = (
+    "I understand the context summary. I'll continue the work based on this compressed information. "
+    "Feel free to ask me to elaborate on any specific aspect if needed."
+)
+
+def summary_messages(message_storage: MessageStorage, summary: str) -> List[ChatMessage]:
+    """构造替换原始上下文的摘要消息对（用户摘要 + AI 确认）"""
+    return [
+        message_storage.store(UserMessage(content=SUMMARY_USER_TEMPLATE.format(summary=summary))),
+        message_storage.store(AIMessage(content=SUMMARY_AI_ACK)),
+    ]
+
+@dataclass
+class PreparedSummary:
+    """已生成的摘要，ids 是生成摘要时上下文中的非系统消息 ID，usage 是生成摘要的 token 用量"""
+    ids: List[str]
+    content: str
+    created: float
+    usage: Dict[str, int] = field(default_factory=dict)
+
+def _covered_prefix(summary: PreparedSummary, rest: List[ChatMessage]) -> int | None:
+    """摘要覆盖的上下文前缀长度，被摘要的消息不再全部位于开头时返回 None"""
+    covered = set(summary.ids)
+    count = 0
+    while count < len(rest) and rest[count].id in covered:
+        count += 1
+    if not count or any(msg.id in covered for msg in rest[count:]):
+        return None
+    return count
+
+class BackgroundSummarizer:
+    """在后台线程中预先生成上下文摘要"""
+    # 摘要之后新增的消息超过上下文 token 数的该比例时才重新生成摘要
+    REFRESH_RATIO = 0.3
+
+    def __init__(self, task: Task):
+        self.task = task
+        self.log = logger.bind(src='summarizer', id=task.task_id)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._summary: Optional[PreparedSummary] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def ready(self) -> bool:
+        return self._summary is not None
+
+    def _get_client(self, name: str | None):
+        client = self.task.client_manager.get_client(name) if name else None
+        if client is None or not client.usable():
+            if name:
+                self.log.warning('Summary LLM not available, using task LLM', llm=name)
+            client = self.task.client.current
+        return client
+
+    def maybe_start(self, context_manager: ContextManager) -> bool:
+        """上下文超过软阈值时启动后台摘要，返回是否启动"""
+        config = context_manager.config
+        threshold = config.summary_threshold
+        if not threshold or context_manager.total_tokens < threshold * config.max_tokens:
+            return False
+        if self.running:
+            return False
+
+        messages = context_manager.messages
+        ids = [msg.id for msg in messages if msg.role != MessageRole.SYSTEM]
+        if len(ids) < 4:
+            return False
+        summary = self._summary
+        if summary and self._fresh(summary, context_manager):
+            return False
+
+        try:
+            instruction = self.task.prompts.get_prompt('compact')
+        except Exception as e:
+            self.log.warning('Failed to get compact template', error=str(e))
+            return False
+
+        # 在当前线程中生成请求数据，后台线程只访问这份快照
+        to_wire = self.task.message_storage.to_wire
+        wire = [to_wire(msg) for msg in messages]
+        wire.append(UserMessage(content=instruction).dict())
+
+        client = self._get_client(config.summary_llm)
+        self._thread = threading.Thread(target=self._run, args=(client, wire, ids), name='context-summarizer', daemon=True)
+        self._thread.start()
+        self.log.info('Background summary started', llm=client.name, messages=len(ids), tokens=context_manager.total_tokens)
+        return True
+
+    def _fresh(self, summary: PreparedSummary, context_manager: ContextManager) -> bool:
+        """已有的摘要仍可使用（take 只替换被摘要的前缀），且之后新增的消息不多"""
+        rest = [msg for msg in context_manager.messages if msg.role != MessageRole.SYSTEM]
+        count = _covered_prefix(summary, rest)
+        if count is None:
+            return False
+        data = context_manager.data
+        estimator = context_manager.compressor.estimator
+        tail = sum(data.tokens_of(msg, estimator) for msg in rest[count:])
+        return tail < self.REFRESH_RATIO * max(context_manager.total_tokens, 1)
+
+    def _run(self, client, wire: list, ids: List[str]):
+        start = time.time()
+        try:
+            msg = client(wire, stream_processor=QuietStreamProcessor(self.task, client.name))
+        except Exception:
+            self.log.exception('Background summary failed')
+            return
+
+        if isinstance(msg, ErrorMessage) or not msg.content or not msg.content.strip():
+            self.log.warning('Background summary failed', error=msg.content)
+            return
+
+        with self._lock:
+            self._summary = PreparedSummary(ids=ids, content=msg.content.strip(), created=time.time(),
+                                            usage=Counter(msg.usage or {}))
+        self.log.info('Background summary ready', messages=len(ids), elapsed=round(time.time() - start, 2))
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """等待正在进行的摘要完成，返回摘要是否可用"""
+        thread = self._thread
+        if thread:
+            thread.join(timeout)
+        return self.ready
+
+    def take(self, messages: List[ChatMessage], message_storage: MessageStorage) -> List[ChatMessage] | None:
+        """
+        用已生成的摘要替换上下文中被摘要的前缀，返回新的消息列表
+
+        生成摘要后前缀中的部分消息可能已被清理（如 Step 压缩），只要剩余的被摘要消息仍然位于上下文开头即可；
+        否则（例如上下文被重建）摘要作废，返回 None
+        """
+        with self._lock:
+            summary, self._summary = self._summary, None
+        if not summary:
+            return None
+
+        system = [msg for msg in messages if msg.role == MessageRole.SYSTEM]
+        rest = [msg for msg in messages if msg.role != MessageRole.SYSTEM]
+        count = _covered_prefix(summary, rest)
+        if count is None:
+            self.log.info('Context changed, discarding prepared summary')
+            return None
+
+        self.log.info('Using prepared summary', messages=count, usage=dict(summary.usage))
+        # 摘要请求的 token 用量计入使用摘要的 Step
+        steps = self.task.steps
+        if summary.usage and steps:
+            steps[-1].add_usage(summary.usage)
+        return system + summary_messages(message_storage, summary.content) + rest[count:]
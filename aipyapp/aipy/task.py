@@ -6,14 +6,16 @@ from __future__ import annotations
 import os
 import json
 import uuid
+import asyncio
 import zlib
 import base64
 import weakref
-from typing import Any, Dict, List, Union, TYPE_CHECKING
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Union, TYPE_CHECKING
 from pathlib import Path
 from importlib.resources import read_text
 
-from pydantic import BaseModel, Field, ValidationError, field_serializer, field_validator
+from pydantic import BaseModel, Field, PrivateAttr, ValidationError, field_serializer, field_validator
 from loguru import logger
 
 from .. import T, __respkg__, Stoppable, TaskPlugin
@@ -25,12 +27,20 @@ from .events import TypedEventBus, BaseEvent
 from .multimodal import MMContent   
 from .context import ContextManager, ContextData
 from .toolcalls import ToolCallProcessor
+from .artifacts import ArtifactStore, ARTIFACT_DIR
 from .chat import MessageStorage, ChatMessage
-from .step import Step, StepData
+from .step import Step, StepData, StepCompactConfig, CompactPolicy
 from .blocks import CodeBlocks
 from .client import Client
 from .response import Response
 from .prompts import Prompts
+from .timing import PhaseTimer
+from .summarizer import BackgroundSummarizer, summary_messages
+from .retrieval import RetrievalIndex, HistoryRetriever
+from .journal import TaskJournal, JournalConfig, load_task_dict, find_task_file, read_task_summary, TASK_FILE, JOURNAL_FILE
+from .taskfile import TaskFileConfig, open_task_file, write_task_file, TASK_BIN_FILE
+from .eventlog import EventLog, EventLogConfig, EVENT_DIR
+from .catalog import TaskRecorder
 
 if TYPE_CHECKING:
     from .taskmgr import TaskManager
@@ -66,13 +76,88 @@ class TaskData(BaseModel):
     blocks: CodeBlocks = Field(default_factory=CodeBlocks)
     context: ContextData = Field(default_factory=ContextData)
     message_storage: MessageStorage = Field(default_factory=MessageStorage)
+    retrieval: RetrievalIndex = Field(default_factory=RetrievalIndex)
     events: List[BaseEvent.get_subclasses_union()] = Field(default_factory=list)
     session: Dict[str, Any] = Field(default_factory=dict, exclude=True)
+    # 快照包含的最后一条日志记录的序号
+    journal_seq: int = 0
+
+    # 延迟解码的字段 -> 解码函数（二进制任务文件）
+    _lazy: Dict[str, Callable[[], Any]] = PrivateAttr(default_factory=dict)
+    # 延迟解码的字段在解码前新增的元素，解码时追加到末尾
+    _pending: Dict[str, List[Any]] = PrivateAttr(default_factory=dict)
+    # 任务文件头部的摘要：第一条指令、开始时间和 Step 数
+    _summary: Dict[str, Any] = PrivateAttr(default_factory=dict)
+    # 事件保存在任务目录的事件日志中，不写入 task.json/task.bin
+    _events_external: bool = PrivateAttr(default=False)
+
+    def __getattr__(self, name: str):
+        if not name.startswith('_'):
+            loader = self._lazy.pop(name, None)
+            if loader is not None:
+                value = loader()
+                value.extend(self._pending.pop(name, ()))
+                self.__dict__[name] = value
+                return value
+        return super().__getattr__(name)
+
+    def defer(self, name: str, loader: Callable[[], Any]):
+        """字段在第一次访问时才调用 loader 解码"""
+        self.__dict__.pop(name, None)
+        self._pending.pop(name, None)
+        self._lazy[name] = loader
+
+    def is_deferred(self, name: str) -> bool:
+        return name in self._lazy and name not in self.__dict__
+
+    def append_deferred(self, name: str, item: Any):
+        """列表字段还没有解码时新增元素：先单独保存，解码时追加到末尾"""
+        self._pending.setdefault(name, []).append(item)
+
+    def pending(self, name: str) -> List[Any] | None:
+        """还没有解码的列表字段中新增的元素，字段已经解码时返回 None"""
+        if not self.is_deferred(name):
+            return None
+        return self._pending.get(name, [])
+
+    def load_all(self):
+        """解码所有延迟的字段，保存在事件日志中的事件除外"""
+        for name in list(self._lazy):
+            if name == 'events' and self._events_external:
+                continue
+            if name in self.__dict__:
+                del self._lazy[name]
+            else:
+                getattr(self, name)
+
+    @property
+    def events_external(self) -> bool:
+        return self._events_external
+
+    @events_external.setter
+    def events_external(self, value: bool):
+        self._events_external = value
+
+    @property
+    def summary(self) -> Dict[str, Any]:
+        return self._summary
+
+    @summary.setter
+    def summary(self, value: Dict[str, Any]):
+        self._summary = value
+
+    def model_dump(self, **kwargs) -> Dict[str, Any]:
+        self.load_all()
+        return super().model_dump(**kwargs)
+
+    def model_dump_json(self, **kwargs) -> str:
+        self.load_all()
+        return super().model_dump_json(**kwargs)
 
     @field_serializer('events')
     def serialize_events(self, events: List, _info):
         """序列化时压缩 events 字段"""
-        if not events:
+        if not events or self._events_external:
             return None
         # 将 events 序列化为 JSON 字符串
         json_str = json.dumps([e.model_dump() for e in events], ensure_ascii=False)
@@ -106,6 +191,50 @@ class TaskData(BaseModel):
     def add_step(self, step: StepData):
         self.steps.append(step)
 
+class SubTaskStub:
+    """
+    从文件加载的子任务占位
+
+    只保存任务 ID、第一个 Step 的标题、指令、开始时间、Step 数、任务摘要（read_task_summary）和文件路径。
+    访问其它属性时才调用 Task.from_file 创建子任务（包括 Client、运行时等），之后的访问都转发给该 Task。
+    """
+
+    def __init__(self, path: Path, manager: TaskManager, parent: Task, summary: Dict[str, Any]):
+        self.path = Path(path)
+        self.manager = manager
+        self._parent = weakref.ref(parent)
+        self.task_id = summary.get('id') or self.path.parent.name
+        self.title = summary.get('title')
+        self.instruction = summary.get('instruction')
+        self.start_time = summary.get('start_time')
+        self.step_count = summary.get('steps', 0)
+        # Round 数、token 用量、耗时和最后的回复，/subtask list 不需要加载子任务
+        self.summary = summary
+        self._task: Task | None = None
+
+    def __repr__(self):
+        return f"<SubTaskStub {self.task_id} loaded={self.loaded}>"
+
+    @property
+    def parent(self) -> Task | None:
+        return self._parent()
+
+    @property
+    def loaded(self) -> bool:
+        return self._task is not None
+
+    def load(self) -> Task:
+        """创建子任务"""
+        if self._task is None:
+            self._task = Task.from_file(self.path, self.manager, parent=self.parent)
+            logger.info('Loaded subtask from file', path=str(self.path), task_id=self.task_id)
+        return self._task
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
 class Task(Stoppable):
     def __init__(self, manager: TaskManager, data: TaskData | None = None, parent: Task | None = None, inherit_context: bool = False):
         super().__init__()
@@ -138,7 +267,10 @@ class Task(Stoppable):
             self.context = data.context
 
         self.message_storage = data.message_storage
-        self.events = data.events
+        if manager.message_store is not None:
+            self.message_storage.attach(manager.message_store)
+        if manager.attachments is not None:
+            self.message_storage.use_attachments(manager.attachments)
 
         # session: 子任务共享父任务的 session 引用，根任务使用 TaskData 中的 session
         if parent:
@@ -148,12 +280,27 @@ class Task(Stoppable):
         
         # Phase 3: Initialize managers and processors (depend on Phase 2)
         self.event_bus = TypedEventBus()
+        self.timer = PhaseTimer()
         self.context_manager = ContextManager(
             self.message_storage,
             self.context,
             manager.settings.get('context_manager')
         )
+        self.context_manager.set_retriever(HistoryRetriever(data.retrieval, self.message_storage, self.blocks))
         self.tool_call_processor = ToolCallProcessor() if not parent else parent.tool_call_processor
+        self.artifacts = ArtifactStore(self.cwd / ARTIFACT_DIR, manager.settings.get('artifacts'))
+        self.file_config = TaskFileConfig(**(manager.settings.get('task_file') or {}))
+        event_config = EventLogConfig(**(manager.settings.get('event_log') or {}))
+        self.event_log = EventLog(self.cwd / EVENT_DIR, event_config) if event_config.enable else None
+        data.events_external = self.event_log is not None
+        # 从文件加载、还没有读入内存的事件所在的事件日志
+        self.event_source: EventLog | None = None
+        journal_config = JournalConfig(**(manager.settings.get('task_journal') or {}))
+        if journal_config.enable:
+            self.journal = TaskJournal(self.cwd, data, journal_config, self.file_config.format)
+        else:
+            self.journal = None
+        self.summarizer = None
         
         # Phase 4: Initialize display (depends on event_bus)
         if manager.display_manager:
@@ -161,6 +308,8 @@ class Task(Stoppable):
             self.event_bus.add_listener(self.display)
         else:
             self.display = None
+        if manager.catalog is not None:
+            self.event_bus.add_listener(TaskRecorder(manager.catalog, self))
         
         # Phase 5: Initialize execution components (depend on task)
         self.mcp = manager.mcp
@@ -170,6 +319,10 @@ class Task(Stoppable):
         self.runner = BlockExecutor()
         self.runner.set_python_runtime(self.runtime)
         self.client = Client(self)
+        if not parent:
+            # 根任务在空闲时预先生成上下文摘要
+            self.summarizer = BackgroundSummarizer(self)
+            self.context_manager.summarizer = self.summarizer
         
         # Phase 6: (Cleaners are now initialized in Step class)
         
@@ -180,10 +333,12 @@ class Task(Stoppable):
             self.plugins = parent.plugins
         
         # Phase 8: Initialize steps last (depend on almost everything)
-        self.steps: List[Step] = [Step(self, step_data) for step_data in data.steps]
+        # 从二进制任务文件加载时，第一次访问才解码 Step
+        self._steps: List[Step] | None = None
 
         # Subtasks list (runtime only, not serialized)
-        self.subtasks: List['Task'] = []
+        # 从文件加载的子任务是 SubTaskStub，第一次访问摘要之外的属性时才创建 Task
+        self.subtasks: List[Task | SubTaskStub] = []
     
     def _initialize_plugins(self, manager: TaskManager):
         """Separate method to initialize plugins, improving clarity and testability"""
@@ -202,12 +357,38 @@ class Task(Stoppable):
     def parent(self):
         return self._parent() if self._parent else None
 
+    @property
+    def steps(self) -> List[Step]:
+        if self._steps is None:
+            self._steps = [Step(self, step_data) for step_data in self.data.steps]
+        return self._steps
+
+    @property
+    def events(self) -> List[BaseEvent]:
+        return self.data.events
+
+    def iter_events(self) -> Iterator[BaseEvent]:
+        """按顺序返回事件，事件还没有读入内存时从事件日志流式读取"""
+        if self.event_source is not None and self.data.is_deferred('events'):
+            return chain(self.event_source.iter_events(), list(self.data.pending('events')))
+        return iter(self.events)
+
+    @property
+    def step_count(self) -> int:
+        if self._steps is None and self.data.is_deferred('steps'):
+            return self.data.summary.get('steps', 0)
+        return len(self.steps)
+
     @property
     def instruction(self):
+        if self._steps is None and self.data.is_deferred('steps'):
+            return self.data.summary.get('instruction')
         return self.steps[0].data.instruction if self.steps else None
 
     @property
     def start_time(self) -> Union[float, None]:
+        if self._steps is None and self.data.is_deferred('steps'):
+            return self.data.summary.get('start_time')
         if self.steps:
             return self.steps[0].data.start_time
         return None
@@ -228,8 +409,13 @@ class Task(Stoppable):
         return True
 
     def emit(self, event_name: str, **kwargs):
-        event = self.event_bus.emit(event_name, **kwargs)
-        self.events.append(event)
+        with self.timer.measure('events'):
+            event = self.event_bus.emit(event_name, **kwargs)
+            if self.data.is_deferred('events'):
+                # 不为追加一个事件解码整个事件日志
+                self.data.append_deferred('events', event)
+            else:
+                self.events.append(event)
         return event
 
     def get_system_message(self) -> ChatMessage:
@@ -246,9 +432,10 @@ class Task(Stoppable):
     def new_step(self, step_data: StepData) -> Step:
         """ 准备一个新的Step
         """
+        steps = self.steps
         self.data.add_step(step_data)
         step = Step(self, step_data)
-        self.steps.append(step)
+        steps.append(step)
         return step
     
     def delete_step(self, index: int) -> bool:
@@ -290,88 +477,157 @@ class Task(Stoppable):
         return {
             'llm': self.client.name,
             'blocks': len(self.blocks),
-            'steps': len(self.steps),
+            'steps': self.step_count,
         }
 
     @classmethod
     def from_file(cls, path: Union[str, Path], manager: TaskManager, parent: Task|None = None) -> 'Task':
         """从文件创建 TaskState 对象"""
         path = Path(path)
-        validate_file(path)
+        journal = path.parent / JOURNAL_FILE
+        # 没有快照、只有日志的任务（第一次保存快照前中断）
+        if path.exists() or not journal.exists():
+            validate_file(path)
         
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.loads(f.read())
-                try:
-                    model_context = {'message_storage': MessageStorage.model_validate(data['message_storage'])}
-                except Exception:
-                    model_context = None
-
-                task_data = TaskData.model_validate(data, context=model_context)
-                task = cls(manager, task_data, parent=parent)
-                logger.info('Loaded task state from file', path=str(path), task_id=task.task_id)
-
-                subtasks = []
-                subdirs = [p for p in path.parent.iterdir() if p.is_dir()]
-                for subdir in subdirs:
-                    subjson = subdir / "task.json"
-                    if not subjson.exists():
-                        continue
-
-                    subtask = cls.from_file(subjson, manager, parent=task)
-                    logger.info('Loaded subtask from file', path=str(subjson), task_id=subtask.task_id)
-                    subtasks.append(subtask)
-
-                if subtasks:
-                    task.subtasks = sorted(subtasks, key=lambda t: t.start_time or 0)
-                return task
+            if path.name == TASK_BIN_FILE and not journal.exists():
+                # 二进制任务文件：Step、事件和历史消息在第一次访问时解码
+                task_data = open_task_file(path, manager.message_store)
+                events_external = task_data.events_external
+            else:
+                task_data, events_external = cls._load_data(path, manager)
+
+            # 事件保存在事件日志中时，第一次访问才读取
+            event_source = None
+            event_dir = path.parent / EVENT_DIR
+            if events_external and EventLog.exists(event_dir):
+                event_source = EventLog(event_dir)
+                task_data.defer('events', event_source.load)
+            task = cls(manager, task_data, parent=parent)
+            task.event_source = event_source
+            logger.info('Loaded task state from file', path=str(path), task_id=task.task_id)
+
+            subtasks = []
+            subdirs = [p for p in path.parent.iterdir() if p.is_dir()]
+            for subdir in subdirs:
+                subfile = find_task_file(subdir)
+                if subfile is None:
+                    continue
+
+                subtask = SubTaskStub(subfile, manager, task, read_task_summary(subfile))
+                logger.info('Found subtask file', path=str(subfile), task_id=subtask.task_id)
+                subtasks.append(subtask)
+
+            if subtasks:
+                task.subtasks = sorted(subtasks, key=lambda t: t.start_time or 0)
+            return task
         except json.JSONDecodeError as e:
             raise TaskError(f'Invalid JSON file: {e}') from e
         except ValidationError as e:
             raise TaskError(f'Invalid task state: {e.errors()}') from e
         except Exception as e:
             raise TaskError(f'Failed to load task state: {e}') from e
+
+    @staticmethod
+    def _load_data(path: Path, manager: TaskManager) -> tuple[TaskData, bool]:
+        """读取快照并应用任务日志，同时返回事件是否保存在事件日志中"""
+        data = load_task_dict(path, events=False)
+        events_external = not data.get('events')
+        # 消息只解析一次，ChatMessage 和 TaskData 共用同一个 MessageStorage
+        message_store = manager.message_store
+        try:
+            message_storage = MessageStorage.model_validate(
+                data['message_storage'], context={'message_store': message_store}
+            )
+        except Exception:
+            message_storage = None
+            model_context = None
+        else:
+            del data['message_storage']
+            model_context = {'message_storage': message_storage}
+
+        task_data = TaskData.model_validate(data, context=model_context)
+        if message_storage is not None:
+            task_data.message_storage = message_storage
+        return task_data, events_external
     
     def to_file(self, path: Union[str, Path]) -> None:
-        """保存任务状态到文件"""
+        """保存任务状态到文件，.bin 文件使用二进制格式"""
         path = Path(path)
         path.parent.mkdir(parents=True, exist_ok=True)
         try:
-            with open(path, 'w', encoding='utf-8') as f:
-                data = self.data
-                f.write(data.model_dump_json(indent=2, exclude_none=True))
+            if path.suffix == '.bin':
+                write_task_file(path, self.data)
+            else:
+                with open(path, 'w', encoding='utf-8') as f:
+                    data = self.data
+                    f.write(data.model_dump_json(indent=2, exclude_none=True))
             self.log.info('Saved task state to file', path=str(path))
         except Exception as e:
             self.log.exception('Failed to save task state', path=str(path))
             raise TaskError(f'Failed to save task state: {e}') from e
         
-    def _auto_save(self):
-        """自动保存任务状态"""
+    def checkpoint(self):
+        """每轮结束后把新增的内容追加到任务日志，中断时最多丢失最后一条记录"""
+        if self.journal is None or not self.cwd.exists():
+            return
+        with self.timer.measure('save'):
+            try:
+                self._save_events()
+                self.journal.append()
+            except Exception:
+                self.log.exception('Failed to append task journal')
+
+    def _save_events(self):
+        """把新增的事件追加到事件日志"""
+        if self.event_log is None:
+            return
+        pending = self.data.pending('events')
+        if pending is not None and self.event_source is not None and len(self.event_log) >= len(self.event_source):
+            # 事件还没有读入内存：只追加之后新增的事件
+            self.event_log.append(pending, offset=len(self.event_source))
+        else:
+            self.event_log.append(self.events)
+
+    def _auto_save(self, snapshot: bool = False):
+        """自动保存任务状态，使用任务日志时只追加新增的内容，snapshot 为 True 时重写 task.json"""
         # 如果任务目录不存在，则不保存
         cwd = self.cwd
         if not cwd.exists():
             self.log.warning('Task directory not found, skipping save')
             return
-        
-        try:
-            display = self.display
-            if display:
-                filename = cwd / "console.html"
-                display.save(filename, clear=False, code_format=CONSOLE_WHITE_HTML)
-            
-            self.to_file(cwd / "task.json")
-            self._saved = True
-            self.log.info('Task auto saved')
-        except Exception as e:
-            self.log.exception('Error saving task')
-            self.emit('exception', msg='save_task', exception=e)
+
+        with self.timer.measure('save'):
+            try:
+                display = self.display
+                if display:
+                    filename = cwd / "console.html"
+                    display.save(filename, clear=False, code_format=CONSOLE_WHITE_HTML)
+
+                self._save_events()
+                # 新消息先写入共享消息存储，任务文件和日志中只保存它们的 ID
+                self.message_storage.persist()
+                if self.journal is None:
+                    self.to_file(cwd / (TASK_BIN_FILE if self.file_config.format == 'binary' else TASK_FILE))
+                elif snapshot:
+                    self.journal.snapshot()
+                else:
+                    self.journal.append()
+                self._saved = True
+                self.log.info('Task auto saved')
+            except Exception as e:
+                self.log.exception('Error saving task')
+                self.emit('exception', msg='save_task', exception=e)
 
     def done(self):
         if not self.steps or not self.cwd.exists():
             self.log.warning('Task not started, skipping save')
             return
 
-        if not self._saved:
+        if self.journal is not None:
+            # 结束时写快照，清空日志
+            self._auto_save(snapshot=True)
+        elif not self._saved:
             self.log.warning('Task not saved, trying to save')
             self._auto_save()
 
@@ -393,7 +649,10 @@ class Task(Stoppable):
 
     def prepare_user_prompt(self, instruction: str, first_run: bool=False, lang: str | None = None) -> ChatMessage:
         """处理多模态内容并验证模型能力"""
-        mmc = MMContent(instruction, base_path=self.cwd.parent)
+        # 模型可以在 models.yaml 中用 image_max_size 字段指定图片长边的建议像素数
+        model_info = self.client.get_model_info()
+        max_size = (model_info.extra or {}).get('image_max_size') if model_info else None
+        mmc = MMContent(instruction, base_path=self.cwd.parent, attachments=self.manager.attachments, max_size=max_size)
         try:
             message = mmc.message
         except Exception as e:
@@ -413,29 +672,43 @@ class Task(Stoppable):
         return self.message_storage.store(message)
 
     def _auto_compact(self):
-       # Step级别的上下文清理
-        auto_compact_enabled = self.settings.get('auto_compact_enabled', True)
-        if not auto_compact_enabled:
+        # Step级别的上下文清理
+        config = StepCompactConfig(**(self.settings.get('step_compact') or {}))
+        if not self.settings.get('auto_compact_enabled', True):
+            config.policy = CompactPolicy.NONE
+        if config.policy == CompactPolicy.NONE:
             return
-        
-        self.log.info("Starting step compact...")
-        result = self.steps[-1].compact()
-        self.log.info(f"Step compact result: {result}")
+
+        result = self.steps[-1].compact(config.policy, config.min_tokens_saved)
         cleaned_count, remaining_messages, tokens_saved, tokens_remaining = result
-        self.log.info(f"Step compact completed, cleaned_count: {cleaned_count}")
-        
+        if not cleaned_count:
+            return
+
         self.emit('step_cleanup_completed', 
                     cleaned_messages=cleaned_count,
                     remaining_messages=remaining_messages,
                     tokens_saved=tokens_saved,
                     tokens_remaining=tokens_remaining)
-        self.log.info(f"Step compact completed: {cleaned_count} messages cleaned")
 
     def run(self, instruction: str, title: str | None = None, lang: str | None = None) -> Response:
         """
         执行自动处理循环，直到 LLM 不再返回代码消息
         instruction: 用户输入的字符串（可包含@file等多模态标记）
         """
+        step = self._start_step(instruction, title, lang)
+        response = step.run()
+        self._finish_step(step, response)
+        return response
+
+    async def arun(self, instruction: str, title: str | None = None, lang: str | None = None) -> Response:
+        """run 的异步版本，供 agent 模式在单个事件循环中并发执行多个任务"""
+        # 准备提示词、压缩上下文和创建任务目录会阻塞，不在事件循环中执行
+        step = await asyncio.to_thread(self._start_step, instruction, title, lang)
+        response = await step.arun()
+        await asyncio.to_thread(self._finish_step, step, response)
+        return response
+
+    def _start_step(self, instruction: str, title: str | None, lang: str | None) -> Step:
         first_run = not self.steps
         user_message = self.prepare_user_prompt(instruction, first_run, lang=lang)
         if first_run:
@@ -458,12 +731,15 @@ class Task(Stoppable):
         )
         step = self.new_step(step_data)
         self.emit('step_started', instruction=instruction, step=len(self.steps) + 1, title=title)
-        response = step.run()
+        return step
+
+    def _finish_step(self, step: Step, response: Response):
         self.emit('step_completed', summary=step.get_summary(), response=response)
 
         self._auto_save()
         self.log.info('Step done', rounds=len(step.data.rounds))
-        return response
+        if self.summarizer:
+            self.summarizer.maybe_start(self.context_manager)
 
     def run_subtask(self, instruction: str, title: str | None = None, cli=False, inherit_context: bool = False, client_name: str | None = None) -> Response:
         """运行子任务"""
@@ -500,7 +776,7 @@ class Task(Stoppable):
             - compression_ratio: float 压缩比例
             - error: str 错误信息(如果失败)
         """
-        from ..llm import UserMessage, AIMessage, MessageRole
+        from ..llm import MessageRole
 
         try:
             # 1. 获取压缩前统计
@@ -562,20 +838,8 @@ class Task(Stoppable):
             system_msgs = [msg for msg in self.context_manager.messages if msg.role == MessageRole.SYSTEM]
             new_messages.extend(system_msgs)
 
-            # 添加摘要用户消息
-            summary_user_msg = UserMessage(content=(
-                f"CONTEXT SUMMARY:\n{summary_content}\n\n"
-                f"This is a compressed summary of the previous conversation. "
-                f"Please continue the work based on this summarized context."
-            ))
-            new_messages.append(self.message_storage.store(summary_user_msg))
-
-            # 添加AI确认消息
-            summary_ai_msg = AIMessage(content=(
-                "I understand the context summary. I'll continue the work based on this compressed information. "
-                "Feel free to ask me to elaborate on any specific aspect if needed."
-            ))
-            new_messages.append(self.message_storage.store(summary_ai_msg))
+            # 添加摘要用户消息和AI确认消息
+            new_messages.extend(summary_messages(self.message_storage, summary_content))
 
             # 9. 重建上下文
             self.context_manager.rebuild(new_messages)
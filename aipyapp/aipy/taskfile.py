@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+二进制任务文件（task.bin）
+
+文件由头部和若干独立压缩的段组成：
+
+    MAGIC | 头部长度(uint32) | 头部(JSON) | 段 ...
+
+头部保存任务 ID、版本、摘要（第一个 Step 的标题、指令、开始时间，Step/Round 数、token 用量和最后的回复）和段索引（偏移、长度）。
+段用 msgpack 编码、zstd 压缩，没有安装 msgpack/zstandard 时分别退回 JSON 和 zlib，使用的编码记录在头部中。
+
+打开任务时只读取头部并映射文件（mmap），只解码 context、blocks、retrieval 和上下文中的消息，
+steps、events 和其余消息内容在第一次访问时才读取和解码，大任务的 resume/replay 不再需要读入和解析整个文件。
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import mmap
+import zlib
+import struct
+from pathlib import Path
+from functools import partial
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional, Union
+
+from loguru import logger
+from pydantic import BaseModel, Field, TypeAdapter
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+if TYPE_CHECKING:
+    from .task import TaskData
+    from .msgstore import MessageStore
+
+TASK_BIN_FILE = "task.bin"
+MAGIC = b"AIPYTASK"
+FORMAT_VERSION = 1
+# 摘要中保存的最后回复的最大长度
+SUMMARY_RESPONSE_LENGTH = 500
+
+# 打开任务时第一次访问才解码的 TaskData 字段
+LAZY_SECTIONS = ('steps', 'events')
+
+_HEADER_LEN = struct.Struct('<I')
+_adapters: Dict[str, TypeAdapter] = {}
+
+
+class TaskFileError(Exception):
+    pass
+
+
+class TaskFileConfig(BaseModel):
+    """任务文件配置"""
+    format: Literal['json', 'binary'] = Field('json', description="任务快照格式：json 写 task.json，binary 写 task.bin")
+
+
+def _encode(obj: Any, codec: str) -> bytes:
+    if codec == 'msgpack':
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _decode(raw: bytes, codec: str) -> Any:
+    if codec == 'msgpack':
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+    return json.loads(raw)
+
+
+def _compress(raw: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    return zlib.compress(raw, level=6)
+
+
+def _decompress(raw: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(raw)
+    return zlib.decompress(raw)
+
+
+def _adapter(name: str) -> TypeAdapter:
+    """TaskData 字段的校验器"""
+    adapter = _adapters.get(name)
+    if adapter is None:
+        from .task import TaskData
+        from .chat import MessageStorage
+        if name == 'messages':
+            annotation = MessageStorage.model_fields['messages'].annotation
+        else:
+            annotation = TaskData.model_fields[name].annotation
+        adapter = _adapters[name] = TypeAdapter(annotation)
+    return adapter
+
+
+def task_summary(steps: List[Dict[str, Any]], messages: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    从任务字典生成摘要：第一个 Step 的标题、指令和开始时间，Step 数、Round 数、token 用量、耗时和最后的回复
+
+    保存在 task.bin 头部，列出子任务时不需要加载整个任务
+    """
+    first = steps[0] if steps else {}
+    usage = Counter()
+    rounds = elapsed = 0
+    for step in steps:
+        step_rounds = step.get('rounds') or []
+        rounds += len(step_rounds)
+        for round in step_rounds:
+            message = messages.get(round.get('llm_response', {}).get('message', {}).get('id')) or {}
+            usage.update(message.get('usage') or {})
+        usage.update(step.get('extra_usage') or {})
+        if step.get('end_time') and step.get('start_time'):
+            elapsed += int(step['end_time'] - step['start_time'])
+
+    last_rounds = steps[-1].get('rounds') if steps else None
+    response = None
+    if last_rounds:
+        message = messages.get(last_rounds[-1].get('llm_response', {}).get('message', {}).get('id')) or {}
+        content = message.get('content')
+        if isinstance(content, str):
+            response = content[:SUMMARY_RESPONSE_LENGTH]
+    return {
+        'title': first.get('title'),
+        'instruction': first.get('instruction'),
+        'start_time': first.get('start_time'),
+        'steps': len(steps),
+        'rounds': rounds,
+        'input_tokens': usage['input_tokens'],
+        'output_tokens': usage['output_tokens'],
+        'total_tokens': usage['total_tokens'],
+        'elapsed_time': elapsed,
+        'response': response,
+    }
+
+
+def write_task_file(path: Union[str, Path], data: TaskData):
+    """把任务写成二进制文件（先写临时文件再替换）"""
+    path = Path(path)
+    codec = 'msgpack' if msgpack is not None else 'json'
+    compression = 'zstd' if zstandard is not None else 'zlib'
+
+    raw = data.model_dump(mode='json', exclude_none=True, exclude={'events'})
+    storage = raw.get('message_storage', {})
+    messages = storage.get('messages', {})
+    # 上下文中的消息随任务一起解码，其余消息只在访问 Step 或历史消息时解码
+    eager = {msg['id'] for msg in raw.get('context', {}).get('messages', [])}
+    storage['messages'] = {id: msg for id, msg in messages.items() if id in eager}
+    storage['deferred'] = [id for id in messages if id not in eager]
+
+    sections = {
+        'context': raw.get('context', {}),
+        'blocks': raw.get('blocks', {}),
+        'retrieval': raw.get('retrieval', {}),
+        'storage': storage,
+        'messages': {id: messages[id] for id in storage['deferred']},
+        'steps': raw.get('steps', []),
+        # 事件保存在事件日志中时不写入任务文件
+        'events': [] if data.events_external else [e.model_dump(mode='json') for e in data.events],
+    }
+
+    index = {}
+    chunks = []
+    offset = 0
+    for name, value in sections.items():
+        chunk = _compress(_encode(value, codec), compression)
+        index[name] = [offset, len(chunk)]
+        chunks.append(chunk)
+        offset += len(chunk)
+
+    header = {
+        'format': FORMAT_VERSION,
+        'codec': codec,
+        'compression': compression,
+        'task': {'id': data.id, 'version': data.version, 'journal_seq': data.journal_seq},
+        'events_external': data.events_external,
+        'summary': task_summary(raw.get('steps', []), messages),
+        'sections': index,
+    }
+    header = json.dumps(header, ensure_ascii=False).encode('utf-8')
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp, path)
+
+
+class TaskFileReader:
+    """读取二进制任务文件的头部，按需解码各段"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            # 只读取头部，段在解码时才从内存映射中读取
+            prefix = f.read(len(MAGIC) + _HEADER_LEN.size)
+            if len(prefix) < len(MAGIC) + _HEADER_LEN.size or prefix[:len(MAGIC)] != MAGIC:
+                raise TaskFileError(f'Not a task file: {self.path}')
+            size, = _HEADER_LEN.unpack_from(prefix, len(MAGIC))
+            self.header = json.loads(f.read(size))
+            if self.header.get('format') != FORMAT_VERSION:
+                raise TaskFileError(f'Unsupported task file format: {self.header.get("format")}')
+            self.codec = self.header['codec']
+            self.compression = self.header['compression']
+            if self.codec == 'msgpack' and msgpack is None:
+                raise TaskFileError('Reading this task file requires msgpack')
+            if self.compression == 'zstd' and zstandard is None:
+                raise TaskFileError('Reading this task file requires zstandard')
+            # 保存任务时用新文件替换，映射的仍然是打开时的内容
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._map)[len(prefix) + size:]
+
+    @property
+    def summary(self) -> Dict[str, Any]:
+        return self.header.get('summary', {})
+
+    def section(self, name: str) -> Any:
+        offset, length = self.header['sections'][name]
+        raw = _decompress(self._buffer[offset:offset + length], self.compression)
+        return _decode(raw, self.codec)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """解码全部内容，返回与 task.json 相同结构的字典"""
+        storage = self.section('storage')
+        storage.pop('deferred', None)
+        storage.setdefault('messages', {}).update(self.section('messages'))
+        return {
+            **self.header['task'],
+            'steps': self.section('steps'),
+            'blocks': self.section('blocks'),
+            'context': self.section('context'),
+            'message_storage': storage,
+            'retrieval': self.section('retrieval'),
+            'events': self.section('events'),
+        }
+
+
+def _load_section(reader: TaskFileReader, name: str, context: Dict[str, Any]):
+    logger.bind(src='taskfile').debug('Decode task file section', path=str(reader.path), section=name)
+    return _adapter(name).validate_python(reader.section(name), context=context)
+
+
+def open_task_file(path: Union[str, Path], message_store: Optional[MessageStore] = None) -> TaskData:
+    """打开二进制任务文件，steps、events 和上下文之外的消息在第一次访问时解码"""
+    from .task import TaskData
+    from .chat import MessageStorage
+
+    reader = TaskFileReader(path)
+    storage = reader.section('storage')
+    deferred = storage.pop('deferred', [])
+    message_storage = MessageStorage.model_validate(storage, context={'message_store': message_store})
+    message_storage.defer(deferred, partial(_load_section, reader, 'messages', None))
+
+    context = {'message_storage': message_storage}
+    data = TaskData.model_validate({
+        **reader.header['task'],
+        'blocks': reader.section('blocks'),
+        'context': reader.section('context'),
+        'retrieval': reader.section('retrieval'),
+    }, context=context)
+    data.message_storage = message_storage
+    for name in LAZY_SECTIONS:
+        data.defer(name, partial(_load_section, reader, name, context))
+    data.summary = reader.summary
+    data.events_external = reader.header.get('events_external', False)
+    return data
+
+
+def read_task_dict(path: Union[str, Path]) -> Dict[str, Any]:
+    """读取二进制任务文件的全部内容"""
+    return TaskFileReader(path).to_dict()
@@ -12,9 +12,12 @@ from ..llm import ClientManager
 from .task import Task
 from .plugins import PluginManager
 from .diagnose import Diagnose
-from .config import PLUGINS_DIR, ROLES_DIR, get_mcp_config_file, get_tt_api_key
+from .config import PLUGINS_DIR, ROLES_DIR, REPLAY_DIR, get_mcp_config_file, get_tt_api_key
 from .role import RoleManager
 from .mcp_tool import MCPToolManager
+from .msgstore import create_message_store
+from .attachments import create_attachment_store
+from .catalog import create_task_catalog
 
 class TaskManager:
     MAX_TASKS = 16
@@ -66,8 +69,26 @@ class TaskManager:
         self.diagnose = Diagnose.create(settings)
         
         # 客户端管理器
-        self.client_manager = ClientManager(settings.llm, max_tokens=settings.get('max_tokens'))
+        replay = dict(settings.get('replay') or {})
+        replay.setdefault('path', str(REPLAY_DIR))
+        self.client_manager = ClientManager(
+            settings.llm,
+            max_tokens=settings.get('max_tokens'),
+            http=settings.get('http'),
+            replay=replay,
+            routing=settings.get('routing'),
+            breaker=settings.get('circuit_breaker')
+        )
         
+        # 共享消息存储
+        self.message_store = create_message_store(settings.get('message_store'))
+
+        # 图片附件存储
+        self.attachments = create_attachment_store(settings.get('attachments'))
+
+        # 任务目录
+        self.catalog = create_task_catalog(settings.get('task_catalog'))
+
         # 角色管理器
         api_conf = settings.get('api', {})
         self.role_manager = RoleManager(ROLES_DIR, api_conf)
@@ -123,6 +144,14 @@ class TaskManager:
             rows.append(TaskRecord(task.task_id, instruction))
         return rows
     
+    def find_tasks(self, query=None, limit=20, offset=0):
+        """从任务目录查询历史任务，query 为空时按更新时间列出，否则搜索指令和回复"""
+        if self.catalog is None:
+            return []
+        if query:
+            return self.catalog.search(query, limit=limit, offset=offset)
+        return self.catalog.list(limit=limit, offset=offset)
+
     def get_task_by_id(self, task_id):
         for task in self.tasks:
             if task.task_id == task_id:
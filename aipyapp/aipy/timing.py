@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+任务执行各阶段的耗时统计
+
+PhaseTimer 按阶段（llm、parse、tools、events、save）累计耗时。阶段可以嵌套，
+统计的是独占时间：例如流式输出时在 llm 阶段内分发的事件计入 events，不计入 llm。
+嵌套关系按线程记录，工具调用在线程池中执行时也能正确统计。
+"""
+
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict
+
+
+class PhaseTimer:
+    """按阶段累计独占耗时（秒）"""
+
+    def __init__(self):
+        self.totals = Counter()
+        self.counts = Counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def measure(self, phase: str):
+        stack = self._stack()
+        frame = [phase, 0.0]
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                # 从外层阶段中扣除本阶段的耗时
+                stack[-1][1] += elapsed
+            with self._lock:
+                self.totals[phase] += elapsed - frame[1]
+                self.counts[phase] += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.totals)
+
+    def since(self, mark: Dict[str, float]) -> Dict[str, float]:
+        """返回从 snapshot() 到现在各阶段新增的耗时"""
+        with self._lock:
+            return {phase: total - mark.get(phase, 0.0) for phase, total in self.totals.items()}
+
+    def reset(self):
+        with self._lock:
+            self.totals.clear()
+            self.counts.clear()
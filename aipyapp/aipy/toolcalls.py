@@ -13,6 +13,7 @@ from pydantic import BaseModel, model_validator, Field, ValidationError
 from promptabs import SurveyRunner
 
 from .types import Error
+from .artifacts import ArtifactStore, ArtifactError
 from ..exec import ExecResult, ProcessResult, PythonResult
 
 if TYPE_CHECKING:
@@ -25,6 +26,7 @@ class ToolName(str, Enum):
     MCP = "MCP"
     SUBTASK = "SubTask"
     SURVEY = "Survey"
+    ARTIFACT = "Artifact"
 
 class ToolResult(BaseModel):
     """Tool result"""
@@ -86,11 +88,24 @@ class SurveyToolResult(ToolResult):
     answers: Dict[str, Any] = Field(title="Survey answers", default_factory=dict)
     feedback: Optional[str] = Field(default=None, title="User feedback")
 
+class ArtifactToolArgs(BaseModel):
+    """Artifact tool arguments"""
+    id: str = Field(title="Artifact id", min_length=1, strip_whitespace=True)
+    pattern: Optional[str] = Field(default=None, title="Regular expression to search for")
+    offset: int = Field(default=0, ge=0, title="Number of lines (or matches) to skip")
+    limit: int = Field(default=100, gt=0, le=500, title="Maximum number of lines (or matches) to return")
+
+class ArtifactToolResult(ToolResult):
+    """Artifact tool result"""
+    artifact: str = Field(title="Artifact id")
+    total: int | None = Field(default=None, title="Total lines, or total matches when searching")
+    lines: List[str] = Field(default_factory=list, title="Lines prefixed with line numbers")
+
 class ToolCall(BaseModel):
     """Tool call"""
     id: str = Field(title='Unique ID for this ToolCall')
     name: ToolName
-    arguments: Union[ExecToolArgs, EditToolArgs, MCPToolArgs, SubTaskArgs, SurveyToolArgs]
+    arguments: Union[ExecToolArgs, EditToolArgs, MCPToolArgs, SubTaskArgs, SurveyToolArgs, ArtifactToolArgs]
 
     @model_validator(mode='before')
     @classmethod
@@ -110,11 +125,13 @@ class ToolCallResult(BaseModel):
     """Tool call result"""
     id: str = Field(title='Unique ID for this ToolCall')
     name: ToolName
-    result: Union[ExecToolResult, EditToolResult, MCPToolResult, SubTaskResult, SurveyToolResult] = Field(title="Tool result")
+    result: Union[ExecToolResult, EditToolResult, MCPToolResult, SubTaskResult, SurveyToolResult, ArtifactToolResult] = Field(title="Tool result")
 
 class ToolCallProcessor:
     """工具调用处理器 - 高级接口"""
-    
+    # Artifact 工具返回的单行最大字符数
+    MAX_LINE_CHARS = 1000
+
     def __init__(self):
         self.log = logger.bind(src='ToolCallProcessor')
     
@@ -181,9 +198,14 @@ class ToolCallProcessor:
             result = self._call_subtask(task, tool_call)
         elif tool_call.name == ToolName.SURVEY:
             result = self._call_survey(task, tool_call)
+        elif tool_call.name == ToolName.ARTIFACT:
+            result = self._call_artifact(task, tool_call)
         else:
             result = ToolResult(error=Error('Unknown tool'))
 
+        if tool_call.name != ToolName.ARTIFACT:
+            self._spill(task.artifacts, result)
+
         toolcall_result = ToolCallResult(
             id=tool_call.id,
             name=tool_call.name,
@@ -192,6 +214,51 @@ class ToolCallProcessor:
         task.emit('tool_call_completed', result=toolcall_result)
         return toolcall_result
            
+    def _spill(self, artifacts: ArtifactStore, result: ToolResult):
+        """把超过阈值的输出保存为 artifact，结果中只保留摘录"""
+        if isinstance(result, ExecToolResult) and result.result:
+            exec_result = result.result
+            for field in ('stdout', 'stderr', 'traceback'):
+                setattr(exec_result, field, artifacts.spill(getattr(exec_result, field)))
+        elif isinstance(result, MCPToolResult):
+            result.result = self._spill_value(artifacts, result.result)
+            text = json.dumps(result.result, ensure_ascii=False, default=str)
+            if artifacts.should_spill(text):
+                result.result = {'excerpt': artifacts.spill(text)}
+        elif isinstance(result, SubTaskResult):
+            result.result = artifacts.spill(result.result)
+
+    def _spill_value(self, artifacts: ArtifactStore, value: Any) -> Any:
+        """递归处理 MCP 结果中的长字符串，保持原有结构"""
+        if isinstance(value, str):
+            return artifacts.spill(value)
+        if isinstance(value, dict):
+            return {k: self._spill_value(artifacts, v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._spill_value(artifacts, v) for v in value]
+        return value
+
+    def _call_artifact(self, task: 'Task', tool_call: ToolCall) -> ArtifactToolResult:
+        """执行 Artifact 工具：分页读取或搜索保存的输出"""
+        args = tool_call.arguments
+        try:
+            if args.pattern:
+                lines, total = task.artifacts.grep(args.id, args.pattern, args.offset, args.limit)
+            else:
+                lines, total = task.artifacts.read(args.id, args.offset, args.limit)
+        except ArtifactError as e:
+            return ArtifactToolResult(artifact=args.id, error=Error.new(str(e)))
+
+        max_chars = self.MAX_LINE_CHARS
+        return ArtifactToolResult(
+            artifact=args.id,
+            total=total,
+            lines=[
+                f"{i}: {line[:max_chars]}" + (f"... [{len(line) - max_chars} chars]" if len(line) > max_chars else '')
+                for i, line in lines
+            ]
+        )
+
     def _call_edit(self, task: 'Task', tool_call: ToolCall) -> EditToolResult:
         """执行 Edit 工具"""
         args = tool_call.arguments
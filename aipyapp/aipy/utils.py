@@ -95,8 +95,8 @@ def validate_file(path: Union[str, Path]) -> None:
     if not path.exists():
         raise FileNotFoundError(f"Task file not found: {path}")
     
-    if not path.name.endswith('.json'):
-        raise ValueError("Task file must be a .json file")
+    if path.suffix not in ('.json', '.bin'):
+        raise ValueError("Task file must be a .json or .bin file")
     
     if not path.is_file():
         raise ValueError(f"Path is not a file: {path}")
@@ -60,8 +60,8 @@ async def startup_event():
 async def shutdown_event():
     """应用关闭时清理"""
     logger.info("Shutting down AIPython Agent API server...")
-    if agent_manager and hasattr(agent_manager, 'executor'):
-        agent_manager.executor.shutdown(wait=True)
+    if agent_manager:
+        await agent_manager.client_manager.aclose()
 
 @app.get("/", response_model=Dict[str, str])
 async def root():
@@ -77,6 +77,7 @@ async def root():
             "get_task_result": "GET /tasks/{task_id}/result",
             "list_tasks": "GET /tasks",
             "cancel_task": "DELETE /tasks/{task_id}",
+            "search_history": "GET /history",
             "health": "GET /health"
         }
     }
@@ -84,10 +85,19 @@ async def root():
 @app.get("/health")
 async def health_check():
     """健康检查"""
+    llm = agent_manager.client_manager.health() if agent_manager else {}
+    states = [h['state'] for h in llm.values() if h]
+    if states and all(state != 'closed' for state in states):
+        status = "unhealthy"
+    elif any(state != 'closed' for state in states):
+        status = "degraded"
+    else:
+        status = "healthy"
     return {
-        "status": "healthy",
+        "status": status,
         "timestamp": datetime.now().isoformat(),
-        "agent_manager": "initialized" if agent_manager else "not_initialized"
+        "agent_manager": "initialized" if agent_manager else "not_initialized",
+        "llm": llm
     }
 
 @app.post("/tasks", response_model=TaskResponse)
@@ -182,6 +192,21 @@ async def list_tasks():
         logger.error(f"Failed to list tasks: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/history")
+async def search_history(q: Optional[str] = None, limit: int = 20, offset: int = 0):
+    """从任务目录查询历史任务，q 为空时按更新时间列出"""
+    if not agent_manager:
+        raise HTTPException(status_code=500, detail="Agent manager not initialized")
+    if agent_manager.catalog is None:
+        raise HTTPException(status_code=404, detail="Task catalog not enabled")
+
+    try:
+        tasks = agent_manager.find_tasks(q, limit=min(max(limit, 1), 1000), offset=max(offset, 0))
+        return {"tasks": tasks}
+    except Exception as e:
+        logger.error(f"Failed to search task history: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/tasks/{task_id}")
 async def cancel_task(task_id: str):
     """取消任务"""
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark mode: 通过 TaskManager.new_task().run() 运行 N 个任务，LLM 使用本地的假服务，
+报告每轮在 LLM 等待、响应解析、工具执行、事件分发和自动保存上的耗时，用于发现非网络部分的性能回退。
+"""
+
+import os
+import json
+import time
+import tempfile
+from pathlib import Path
+from collections import Counter
+
+from rich.console import Console
+from rich.table import Table
+
+from .. import __version__
+from ..aipy import TaskManager
+from ..display import DisplayManager
+from ..llm.stub import StubServer, StubConfig
+
+PHASES = ('llm', 'parse', 'tools', 'events', 'save')
+DEFAULT_INSTRUCTION = 'Compute the sum of 0..99 with Python'
+
+
+def run_benchmark(settings, server: StubServer, tasks: int = 10, instruction: str = DEFAULT_INSTRUCTION, display: bool = True) -> dict:
+    """运行基准测试，返回汇总结果（时间单位：秒）"""
+    settings.set('llm', {'stub': server.client_config()}, merge=False)
+    settings.set('replay', {'mode': 'off'}, merge=False)
+    # 基准任务不写入用户的任务目录、共享消息库和附件目录
+    for key in ('task_catalog', 'message_store', 'attachments'):
+        settings.set(key, {'enable': False}, merge=False)
+    display_manager = DisplayManager({'style': 'classic', 'quiet': True}) if display else None
+    tm = TaskManager(settings, display_manager=display_manager)
+
+    totals = Counter()
+    rounds = 0
+    wall = 0.0
+    cwd = os.getcwd()
+    try:
+        for _ in range(tasks):
+            task = tm.new_task()
+            start = time.perf_counter()
+            task.run(instruction)
+            task.done()
+            wall += time.perf_counter() - start
+            rounds += sum(len(step.timings) for step in task.steps)
+            totals.update(task.timer.totals)
+    finally:
+        os.chdir(cwd)
+        tm.client_manager.close()
+
+    phases = {phase: totals[phase] for phase in PHASES}
+    phases['other'] = max(wall - sum(phases.values()), 0.0)
+    return {
+        'tasks': tasks,
+        'rounds': rounds,
+        'requests': server.requests,
+        'wall': wall,
+        'phases': phases,
+        'per_round': {phase: value / rounds if rounds else 0.0 for phase, value in phases.items()},
+    }
+
+
+def print_report(console: Console, result: dict):
+    rounds = result['rounds']
+    console.print(f"Tasks: {result['tasks']} | Rounds: {rounds} | LLM requests: {result['requests']} | Wall: {result['wall']:.3f}s")
+
+    table = Table(title="Time per round")
+    table.add_column("Phase")
+    table.add_column("Total (s)", justify="right")
+    table.add_column("Per round (ms)", justify="right")
+    table.add_column("Share", justify="right")
+    wall = result['wall'] or 1.0
+    for phase, value in result['phases'].items():
+        table.add_row(phase, f"{value:.3f}", f"{result['per_round'][phase] * 1000:.2f}", f"{value / wall:.1%}")
+    console.print(table)
+
+
+def main(settings):
+    console = Console()
+    bench = settings.get('bench') or {}
+    config = StubConfig(ttft=bench.get('ttft', 0), tps=bench.get('tps', 0))
+    if bench.get('script'):
+        config.script = StubConfig.load_script(bench['script'])
+
+    console.print(f"🏁 AIPython Benchmark ({__version__})")
+    with tempfile.TemporaryDirectory(prefix='aipy-bench-') as workdir:
+        settings.set('workdir', workdir)
+        with StubServer(config) as server:
+            result = run_benchmark(
+                settings,
+                server,
+                tasks=bench.get('tasks', 10),
+                instruction=bench.get('instruction') or DEFAULT_INSTRUCTION,
+                display=bench.get('display', True)
+            )
+
+    print_report(console, result)
+    output = bench.get('output')
+    if output:
+        Path(output).write_text(json.dumps(result, indent=2), encoding='utf-8')
+        console.print(f"Results saved to {output}")
@@ -7,6 +7,7 @@ from rich.tree import Tree
 
 from ..base import CommandMode, ParserCommand
 from aipyapp import T
+from aipyapp.aipy.context import ContextStrategy
 
 class ContextCommand(ParserCommand):
     """上下文管理命令"""
@@ -19,7 +20,7 @@ class ContextCommand(ParserCommand):
         subparsers.add_parser('clear', help=T('Clear context'))
         subparsers.add_parser('stats', help=T('Show context stats'))
         parser = subparsers.add_parser('config', help=T('Show context config'))
-        parser.add_argument('--strategy', choices=['sliding_window', 'importance_filter', 'summary_compression', 'hybrid'], help=T('Set compression strategy'))
+        parser.add_argument('--strategy', choices=[strategy.value for strategy in ContextStrategy], help=T('Set compression strategy'))
         parser.add_argument('--max-tokens', type=int, help=T('Set max tokens'))
         parser.add_argument('--max-rounds', type=int, help=T('Set max rounds'))
         parser.add_argument('--auto-compress', action='store_true', help=T('Set auto compress'))
@@ -125,6 +126,9 @@ class ContextCommand(ParserCommand):
         
         table.add_row(T("Strategy"), config.strategy.value)
         table.add_row(T("Max tokens"), str(config.max_tokens))
+        if config.auto_budget and task.context_manager.context_length:
+            table.add_row(T("Context length"), str(task.context_manager.context_length))
+            table.add_row(T("Reserved tokens"), str(task.context_manager.reserved_tokens))
         table.add_row(T("Max rounds"), str(config.max_rounds))
         table.add_row(T("Auto compress"), str(config.auto_compress))
         table.add_row(T("Compression ratio"), str(config.compression_ratio))
@@ -148,7 +152,9 @@ class ContextCommand(ParserCommand):
                 console.print(T("Invalid strategy: {}, using default strategy", args.strategy), style="red")
         
         if args.max_tokens:
+            # 手动指定后不再按模型计算预算
             current_config.max_tokens = args.max_tokens
+            current_config.auto_budget = False
         
         if args.max_rounds:
             current_config.max_rounds = args.max_rounds
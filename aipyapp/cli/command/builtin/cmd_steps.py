@@ -8,6 +8,7 @@ from rich.text import Text
 
 from .utils import row2table
 from ..base import CommandMode, ParserCommand
+from aipyapp.aipy.step import CompactPolicy
 from aipyapp import T
 
 class StepsCommand(ParserCommand):
@@ -22,6 +23,10 @@ class StepsCommand(ParserCommand):
         parser.add_argument('index', type=int, nargs='?', default=-1, help=T('Index of the step to clear (default: last step)'))
         parser = subparsers.add_parser('compact', help=T('Smart compact step rounds'))
         parser.add_argument('index', type=int, nargs='?', default=-1, help=T('Index of the step to compact (default: last step)'))
+        parser.add_argument('--policy', choices=[p.value for p in CompactPolicy], default=CompactPolicy.FAILED_ROUNDS.value, help=T('Compact policy'))
+        parser.add_argument('--dry-run', action='store_true', help=T('Show projected savings without changing the context'))
+        parser = subparsers.add_parser('preview', help=T('Preview tokens saved by each compact policy'))
+        parser.add_argument('index', type=int, nargs='?', default=-1, help=T('Index of the step to preview (default: last step)'))
         parser = subparsers.add_parser('delete', help=T('Delete task steps'))
         parser.add_argument('index', type=int, help=T('Index of the task step to delete'))
         parser = subparsers.add_parser('show', help=T('Show rounds in a step'))
@@ -111,9 +116,12 @@ class StepsCommand(ParserCommand):
         step = task.steps[step_index]
         step_title = step.data.title or step.data.instruction[:50]
 
+        if args.dry_run:
+            return self._print_preview(ctx, step_index, [step.compact_preview(args.policy)])
+
         try:
             # 调用Step的compact方法
-            cleaned_count, remaining_messages, tokens_saved, tokens_remaining = step.compact()
+            cleaned_count, remaining_messages, tokens_saved, tokens_remaining = step.compact(args.policy)
 
             # 显示压缩结果
             ctx.console.print(f"[green]✅ Step {step_index} context compacted[/green]")
@@ -125,7 +133,8 @@ class StepsCommand(ParserCommand):
 
             if cleaned_count > 0:
                 ctx.console.print(f"[dim]💡 Use 'step show {step_index}' to see which rounds were compacted[/dim]")
-                ctx.console.print(f"[dim]💡 Only failed/error rounds were deleted, preserving important context[/dim]")
+                if args.policy == CompactPolicy.FAILED_ROUNDS:
+                    ctx.console.print(f"[dim]💡 Only failed/error rounds were deleted, preserving important context[/dim]")
             else:
                 ctx.console.print(f"[dim]💡 No rounds were compacted - all rounds are important or already cleaned[/dim]")
 
@@ -135,6 +144,31 @@ class StepsCommand(ParserCommand):
             ctx.console.print(f"[red]❌ Failed to compact step context: {e}[/red]")
             return False
 
+    def cmd_preview(self, args, ctx):
+        """dry-run：显示各压缩策略预计节省的 token 数"""
+        task = ctx.task
+        if not task.steps:
+            ctx.console.print(T("No task steps found"))
+            return False
+
+        step_index = len(task.steps) - 1 if args.index == -1 else args.index
+        if step_index < 0 or step_index >= len(task.steps):
+            ctx.console.print(T(f"Invalid step index: {step_index}"))
+            return False
+
+        return self._print_preview(ctx, step_index, task.steps[step_index].compact_preview())
+
+    def _print_preview(self, ctx, step_index, plans):
+        tokens = ctx.task.context_manager.total_tokens
+        rows = []
+        for plan in plans:
+            rounds = ', '.join(str(i) for i in plan.rounds) or '-'
+            rows.append([plan.policy.value, rounds, plan.messages, plan.tokens_saved, tokens - plan.tokens_saved])
+        table = row2table(rows, title=T('Compact preview of step {}').format(step_index),
+                          headers=[T('Policy'), T('Rounds'), T('Messages'), T('Tokens saved'), T('Tokens remaining')])
+        ctx.console.print(table)
+        return True
+
     def cmd_delete(self, args, ctx):
         """删除指定Step并清理其上下文"""
         task = ctx.task
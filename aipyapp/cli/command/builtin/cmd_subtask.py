@@ -8,6 +8,7 @@ from rich.tree import Tree
 from .utils import row2table
 from ..base import CommandMode, ParserCommand
 from aipyapp import T
+from aipyapp.aipy.task import SubTaskStub
 
 class SubTaskCommand(ParserCommand):
     """SubTask command - view and manage subtasks"""
@@ -31,6 +32,12 @@ class SubTaskCommand(ParserCommand):
     
     def _aggregate_subtask_stats(self, subtask):
         """聚合子任务的统计信息"""
+        if self._is_stub(subtask):
+            # 未加载的子任务使用任务文件中的摘要
+            summary = subtask.summary
+            return {key: summary.get(key) or 0 for key in
+                    ('rounds', 'input_tokens', 'output_tokens', 'total_tokens', 'elapsed_time')}
+
         total_rounds = 0
         total_input_tokens = 0
         total_output_tokens = 0
@@ -52,26 +59,33 @@ class SubTaskCommand(ParserCommand):
             'elapsed_time': total_elapsed_time
         }
 
+    @staticmethod
+    def _is_stub(subtask):
+        """从文件发现、还没有加载的子任务（SubTaskStub）"""
+        return isinstance(subtask, SubTaskStub) and not subtask.loaded
+
     def _extract_subtask_data(self, subtask, full_response=False):
         """提取子任务数据用于树状显示"""
         # 提取 instruction（完整显示）
         instruction = subtask.instruction or "No instruction"
 
         # 提取 response
-        response = ""
-        if subtask.steps:
+        if self._is_stub(subtask):
+            # 摘要中只保存了回复的开头部分
+            response_text = subtask.summary.get('response') or ""
+        elif subtask.steps:
             last_step = subtask.steps[-1]
-            response_text = last_step['final_response'].message.content or ""
+            final_response = last_step['final_response']
+            response_text = (final_response.message.content if final_response else None) or ""
+        else:
+            response_text = ""
 
-            if full_response:
-                response = response_text
-            else:
-                # 获取第一行用于预览
-                lines = response_text.split('\n')
-                if len(lines) > 1:
-                    response = lines[0] + "..."
-                else:
-                    response = response_text
+        response = response_text
+        if not full_response:
+            # 获取第一行用于预览
+            lines = response_text.split('\n')
+            if len(lines) > 1:
+                response = lines[0] + "..."
 
         # 聚合统计信息
         stats = self._aggregate_subtask_stats(subtask)
@@ -79,7 +93,7 @@ class SubTaskCommand(ParserCommand):
         return instruction, response, stats
 
     def _add_subtask_to_tree(self, tree, subtask, full_response=False):
-        """递归添加子任务到树中"""
+        """递归添加子任务到树中，不加载从文件发现的子任务"""
         instruction, response, stats = self._extract_subtask_data(subtask, full_response)
 
         # 创建以 task_id 为根的子树
@@ -90,7 +104,7 @@ class SubTaskCommand(ParserCommand):
         task_node.add(f"📝 {instruction}")
 
         # 2. 统计信息
-        task_node.add(f"🔄 {stats['rounds']} rounds in {len(subtask.steps)} steps")
+        task_node.add(f"🔄 {stats['rounds']} rounds in {subtask.step_count} steps")
 
         # 格式化 token 显示
         tokens_text = f"📊 Tokens: ↑{stats['input_tokens']} ↓{stats['output_tokens']} Σ{stats['total_tokens']}"
@@ -104,8 +118,8 @@ class SubTaskCommand(ParserCommand):
         else:
             task_node.add("💬 [dim]No response available[/dim]")
 
-        # 递归添加子任务的子任务
-        if hasattr(subtask, 'subtasks') and subtask.subtasks:
+        # 只展开已经加载的子任务的子任务
+        if not self._is_stub(subtask) and subtask.subtasks:
             for child_subtask in subtask.subtasks:
                 self._add_subtask_to_tree(task_node, child_subtask, full_response)
 
@@ -149,9 +163,11 @@ class SubTaskCommand(ParserCommand):
 
     def _find_subtask_by_id(self, task, task_id):
         """Recursively find subtask by ID"""
+        # 先比较同一层的 ID，从文件加载的子任务只在需要查找其子任务时才创建
         for subtask in task.subtasks:
             if subtask.task_id == task_id:
                 return subtask
+        for subtask in task.subtasks:
             # Recursively search in nested subtasks
             found = self._find_subtask_by_id(subtask, task_id)
             if found:
@@ -1,19 +1,25 @@
+import os
 import time
+from pathlib import Path
+from datetime import datetime
 
 from aipyapp.aipy.events import TypedEventBus
+from aipyapp.aipy.journal import export_task_json
 from aipyapp import T
 from ..base import ParserCommand
 from ..common import TaskModeResult
 from ..completer.base import CompleterBase
 from ..completer.argparse_completer import EnhancedArgparseCompleter
-from .utils import record2table
+from .utils import record2table, row2table
 
 class TaskCommand(ParserCommand):
     name = 'task'
     description = T('Task operations')
 
     def add_subcommands(self, subparsers):
-        subparsers.add_parser('list', help=T('List recent tasks'))
+        parser = subparsers.add_parser('list', help=T('List recent tasks'))
+        parser.add_argument('-s', '--search', type=str, help=T('Search instructions and responses'))
+        parser.add_argument('-n', '--limit', type=int, default=20, help=T('Maximum number of tasks to list'))
         parser = subparsers.add_parser('use', help=T('Load a recent task by task id'))
         parser.add_argument('tid', type=str, help=T('Task ID'))
         parser = subparsers.add_parser('resume', help=T('Load task from task.json file'))
@@ -21,39 +27,104 @@ class TaskCommand(ParserCommand):
         parser = subparsers.add_parser('replay', help=T('Replay task from task.json file'))
         parser.add_argument('path', type=str, help=T('Path to task.json file'))
         parser.add_argument('--speed', type=float, default=1.0, help=T('Replay speed multiplier'))
+        parser = subparsers.add_parser('export', help=T('Export task file to task.json'))
+        parser.add_argument('path', type=str, help=T('Path to task.json file'))
+        parser.add_argument('output', type=str, nargs='?', help=T('Output file, default is task.json in the same directory'))
 
     def _create_completer(self) -> CompleterBase:
         """创建任务命令的自定义补齐器"""
         return EnhancedArgparseCompleter(self)
 
     def cmd_list(self, args, ctx):
-        rows = ctx.tm.list_tasks()
+        tm = ctx.tm
+        if tm.catalog is None:
+            rows = tm.list_tasks()
+            if rows:
+                table = record2table(rows)
+                ctx.console.print(table)
+            return
+
+        # 从任务目录查询历史任务
+        records = tm.find_tasks(getattr(args, 'search', None), limit=getattr(args, 'limit', 20))
+        rows = []
+        for record in records:
+            updated = datetime.fromtimestamp(record['update_time']).strftime('%Y-%m-%d %H:%M') if record['update_time'] else '-'
+            instruction = record['instruction'][:32] if record['instruction'] else '-'
+            rows.append((record['id'], updated, record['status'] or '-', record['steps'], record['total_tokens'], instruction))
         if rows:
-            table = record2table(rows)
+            table = row2table(rows, headers=['Task ID', 'Updated', 'Status', 'Steps', 'Tokens', 'Instruction'])
             ctx.console.print(table)
+        else:
+            ctx.console.print(T("No tasks found"))
 
     def get_arg_values(self, name, subcommand=None, partial=None):
-        """为 tid 参数提供补齐值，path 参数由 PathCompleter 处理"""
+        """为 tid 和 path 参数提供补齐值，path 参数的其它补齐由 PathCompleter 处理"""
+        tm = self.manager.context.tm
         if name == 'tid':
-            tasks = self.manager.context.tm.get_tasks()
-            return [(task.task_id, task.instruction[:32]) for task in tasks]
+            values = [(task.task_id, (task.instruction or '')[:32]) for task in tm.get_tasks()]
+            known = {task_id for task_id, _ in values}
+            for record in tm.find_tasks(limit=50):
+                if record['id'] not in known:
+                    values.append((record['id'], (record['instruction'] or '')[:32]))
+            return values
+        if name == 'path' and tm.catalog is not None:
+            return self._catalog_paths(tm.catalog, partial or '')
         return None
 
+    def _catalog_paths(self, catalog, partial):
+        """任务目录中以 partial 开头的任务文件，保持用户输入的相对路径形式"""
+        cwd = os.getcwd()
+        if partial:
+            # 目录中保存的是绝对路径：把输入按当前目录解析后查询，结果再换回输入的前缀
+            prefix = os.path.abspath(os.path.expanduser(partial))
+            if partial.endswith(('/', os.sep)) and not prefix.endswith(os.sep):
+                prefix += os.sep
+            records = catalog.find_path(prefix)
+        else:
+            records = catalog.list()
+
+        values = []
+        for record in records:
+            if not record['path'] or not record['file']:
+                continue
+            path = os.path.join(record['path'], record['file'])
+            if partial:
+                path = partial + path[len(prefix):]
+            elif path.startswith(cwd + os.sep):
+                path = os.path.relpath(path, cwd)
+            values.append((path, (record['instruction'] or '')[:32]))
+        return values
+
     def cmd_use(self, args, ctx):
         task = ctx.tm.get_task_by_id(args.tid)
+        if task is None and ctx.tm.catalog is not None:
+            # 不在最近的任务中时，按任务目录中记录的路径加载
+            record = ctx.tm.catalog.get(args.tid)
+            if record and record['path'] and record['file']:
+                task = ctx.tm.load_task(Path(record['path']) / record['file'])
         return TaskModeResult(task=task)
 
     def cmd_resume(self, args, ctx):
         task = ctx.tm.load_task(args.path)
         return TaskModeResult(task=task)
 
+    def cmd_export(self, args, ctx):
+        path = Path(args.path)
+        output = Path(args.output) if args.output else path.parent / 'task.json'
+        try:
+            export_task_json(path, output, ctx.tm.attachments)
+        except Exception as e:
+            ctx.console.print(f"[red]{T('Export failed')}: {e}[/red]")
+            return
+        ctx.console.print(f"{T('Exported to')} {output}")
+
     def _replay_task(self, event_bus, task, speed=1.0):
-        if not task.steps:
+        if not task.step_count:
             return
 
         prev_event = None
         subtask_index = 0
-        for i, event in enumerate(task.events):
+        for i, event in enumerate(task.iter_events()):
             # 计算等待时间
             if i > 0:
                 wait_time = (event.timestamp - prev_event.timestamp) / speed
@@ -70,7 +141,7 @@ class TaskCommand(ParserCommand):
 
     def cmd_replay(self, args, ctx):
         task = ctx.tm.load_task(args.path)
-        if not task.steps:
+        if not task.step_count:
             ctx.console.print(T("No steps to replay"))
             return
 
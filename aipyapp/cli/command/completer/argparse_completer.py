@@ -405,7 +405,20 @@ class EnhancedArgparseCompleter(ArgparseCompleter):
             show_hidden=False
         )
         completions = path_completer.get_completions(context)
-        
+
+        # 命令提供的路径（例如任务目录中的任务文件）排在最前面
+        partial = context.current_word if not context.is_empty_position else ""
+        known = []
+        get_arg_values = getattr(self.command, 'get_arg_values', None)
+        values = get_arg_values(arg_info.dest, partial=partial) if callable(get_arg_values) else None
+        for name, desc in values or []:
+            if name.startswith(partial):
+                known.append(create_completion(
+                    name,
+                    start_position=-len(partial) if partial else 0,
+                    display_meta=desc or ""
+                ))
+
         # 过滤和排序：JSON 文件优先
         json_files = []
         directories = []
@@ -432,7 +445,7 @@ class EnhancedArgparseCompleter(ArgparseCompleter):
                 # 其他所有文件都保留，包括目录（如果display_meta不是"目录"）
                 other_files.append(completion)
         
-        return json_files + directories + other_files
+        return known + json_files + directories + other_files
     
     def _complete_positional(self, arg_info: ArgumentInfo, context: CompleterContext) -> List[Completion]:
         """重写位置参数补齐，为路径类型使用 PathCompleter"""
@@ -1,10 +1,10 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from .base import Message, MessageRole, UserMessage, SystemMessage, AIMessage, ErrorMessage, ToolMessage
+from .base import Message, MessageRole, UserMessage, SystemMessage, AIMessage, ErrorMessage, ToolMessage, RequestCancelled
 from .manager import ClientManager
 from .models import ModelCapability
 from .config import ClientConfig, create_client_config
 
-__all__ = ['Message', 'MessageRole', 'UserMessage', 'SystemMessage', 'AIMessage', 'ErrorMessage', 'ToolMessage',
+__all__ = ['Message', 'MessageRole', 'UserMessage', 'SystemMessage', 'AIMessage', 'ErrorMessage', 'ToolMessage', 'RequestCancelled',
            'ClientManager', 'ModelCapability', 'ClientConfig', 'create_client_config']
@@ -3,18 +3,27 @@
 
 import time
 import random
+import asyncio
 from dataclasses import dataclass
 import socket
 from enum import Enum
 from collections import Counter
+from functools import partial
 from abc import ABC, abstractmethod
-from typing import Union, List, Dict, Any, Literal
+from typing import TYPE_CHECKING, Union, List, Dict, Any, Literal
 
 from loguru import logger
 import httpx
 import openai
+import anthropic
 from pydantic import BaseModel, Field
 from .config import ClientConfig
+from .transport import HttpClientPool
+from .ratelimit import RateLimiter, estimate_tokens, parse_retry_after
+from .breaker import CircuitBreaker, CircuitState
+
+if TYPE_CHECKING:
+    from .replay import ReplayCache
 
 class TextItem(BaseModel):
     type: Literal['text'] = 'text'
@@ -24,7 +33,7 @@ class ImageUrl(BaseModel):
     url: str
 
 class ImageItem(BaseModel):
-    type: Literal['image-url'] = 'image-url'
+    type: Literal['image_url'] = 'image_url'
     image_url: ImageUrl
 
 class MessageRole(str, Enum):
@@ -53,9 +62,14 @@ class UserMessage(Message):
         for item in self.content:
             if item.type == 'text':
                 contents.append(item.text)
-            elif item.type == 'image-url':
+            elif item.type == 'image_url':
                 contents.append(item.image_url.url)
         return '\n'.join(contents)
+
+    def dict(self):
+        if isinstance(self.content, str):
+            return super().dict()
+        return {'role': self.role.value, 'content': [item.model_dump() for item in self.content]}
     
 class SystemMessage(Message):
     role: Literal[MessageRole.SYSTEM] = MessageRole.SYSTEM
@@ -85,6 +99,9 @@ class AIMessage(Message):
 class ErrorMessage(Message):
     role: Literal[MessageRole.ERROR] = MessageRole.ERROR
 
+class RequestCancelled(Exception):
+    """请求被取消，例如对冲请求中落后的一方"""
+
 @dataclass
 class RetryConfig:
     max_attempts: int = 3
@@ -98,6 +115,34 @@ class RetryConfig:
         delay += random.uniform(0, self.jitter)
         return delay
 
+RETRYABLE_ERRORS = (
+    httpx.RemoteProtocolError,
+    httpx.ReadTimeout,
+    httpx.ConnectTimeout,
+    httpx.HTTPStatusError,
+    httpx.ConnectError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    anthropic.RateLimitError,
+)
+
+# 计入熔断器错误率的传输层错误（连接失败、超时、协议错误）
+TRANSPORT_ERRORS = (
+    httpx.TransportError,
+    openai.APIConnectionError,
+    anthropic.APIConnectionError,
+)
+
+def is_service_failure(e: Exception) -> bool:
+    """传输错误和 5xx（包括 overloaded）说明服务不可用；4xx（包括 429 限流）和其它错误是请求本身的问题"""
+    if isinstance(e, TRANSPORT_ERRORS):
+        return True
+    status = getattr(e, 'status_code', None)
+    if status is None and isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+    return isinstance(status, int) and status >= 500
+
 class BaseClient(ABC):
     MODEL = None
     BASE_URL = None
@@ -108,7 +153,14 @@ class BaseClient(ABC):
         self.log = logger.bind(src='llm', name=config.name)
         self.console = None
         self._client = None
+        self._aclient = None
         self._retry = RetryConfig()
+        self._http_pool: HttpClientPool | None = None
+        self._replay: 'ReplayCache | None' = None
+        self._limiter: RateLimiter | None = None
+        self._breaker: CircuitBreaker | None = None
+        if config.rpm or config.tpm:
+            self._limiter = RateLimiter(rpm=config.rpm, tpm=config.tpm)
 
     @property
     def name(self) -> str:
@@ -148,15 +200,68 @@ class BaseClient(ABC):
     def usable(self):
         return self.model
     
+    def bind_http_pool(self, pool: HttpClientPool):
+        """使用 ClientManager 共享的 HTTP 连接池"""
+        self._http_pool = pool
+        self._client = None
+        self._aclient = None
+
+    def bind_circuit_breaker(self, breaker: CircuitBreaker | None):
+        """设置熔断器"""
+        self._breaker = breaker
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker | None:
+        return self._breaker
+
+    @property
+    def circuit_state(self) -> CircuitState:
+        return self._breaker.state if self._breaker else CircuitState.CLOSED
+
+    def probe(self) -> bool:
+        """熔断后在后台探测服务是否恢复：base URL 返回非 5xx 响应即认为可达"""
+        url = self.base_url
+        response = self._get_http_client(url).get(url, timeout=10)
+        return response.status_code < 500
+
+    def bind_replay_cache(self, cache: 'ReplayCache | None'):
+        """使用 ClientManager 共享的录制/重放缓存"""
+        self._replay = cache
+
+    def _get_http_client(self, url: str | None = None) -> httpx.Client:
+        """获取访问 url（默认 base_url）的 httpx.Client，优先复用共享连接池"""
+        if self._http_pool is None:
+            # 未绑定共享连接池时，使用实例私有的连接池
+            self._http_pool = HttpClientPool()
+        return self._http_pool.get(url or self.base_url, verify=self.config.tls_verify)
+
+    def _get_async_http_client(self, url: str | None = None) -> httpx.AsyncClient:
+        """获取访问 url（默认 base_url）的 httpx.AsyncClient"""
+        if self._http_pool is None:
+            self._http_pool = HttpClientPool()
+        return self._http_pool.aget(url or self.base_url, verify=self.config.tls_verify)
+
     def _get_client(self):
         return self._client
+
+    def _get_async_client(self):
+        return self._aclient
     
     @abstractmethod
     def get_completion(self, messages: list[Dict[str, Any]], **kwargs) -> AIMessage:
         pass
+
+    async def aget_completion(self, messages: list[Dict[str, Any]], **kwargs):
+        """异步获取 completion，没有原生异步实现的客户端在线程中执行同步版本"""
+        return await asyncio.to_thread(self.get_completion, messages, **kwargs)
         
-    def _prepare_messages(self, messages: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
-        return messages
+    def _prepare_messages(self, messages: list[Dict[str, Any]]) -> tuple[list[Dict[str, Any]], Any]:
+        """转换为接口需要的消息格式，返回 (messages, system)
+
+        单独传递系统提示词的接口返回 system，由调用方作为 system 参数传给 get_completion。
+        客户端实例在并发请求之间共享，不能把单次请求的数据保存在实例上。
+        """
+        return messages, None
     
     @abstractmethod
     def _parse_usage(self, response) -> Counter:
@@ -166,6 +271,26 @@ class BaseClient(ABC):
     def _parse_stream_response(self, response, stream_processor) -> AIMessage:
         pass
 
+    @staticmethod
+    def _close_stream(response):
+        """关闭流式响应，中途退出（异常、被取消）时也要释放连接"""
+        close = getattr(response, 'close', None)
+        if close:
+            close()
+
+    @staticmethod
+    async def _aclose_stream(response):
+        """_close_stream 的异步版本，兼容 aclose()（异步生成器）和异步的 close()"""
+        close = getattr(response, 'aclose', None) or getattr(response, 'close', None)
+        if close:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+
+    async def _aparse_stream_response(self, response, stream_processor) -> AIMessage:
+        """异步解析流式响应，默认在线程中执行同步版本"""
+        return await asyncio.to_thread(self._parse_stream_response, response, stream_processor)
+
     @abstractmethod
     def _parse_response(self, response) -> AIMessage:
         pass
@@ -176,51 +301,232 @@ class BaseClient(ABC):
         stream_processor=None,
         **kwargs,
     ) -> AIMessage | ErrorMessage:
-        messages = self._prepare_messages(messages)
+        key = self._replay_key(messages, kwargs)
+        if key and self._replay.replaying:
+            return self._replay_response(key, stream_processor)
+
+        tokens = estimate_tokens(messages) if self._limiter else 0
+        messages, system = self._prepare_messages(messages)
+        if system is not None:
+            kwargs['system'] = system
         start = time.time()
         attempt = 0
         while True:
             attempt += 1
+            if self._breaker and not self._breaker.allow():
+                return self._circuit_open(attempt)
             try:
+                self._check_cancelled(stream_processor)
+                if self._limiter:
+                    self._limiter.acquire(tokens)
                 response = self.get_completion(messages, **kwargs)
                 if self.config.stream:
+                    self._watch_cancel(stream_processor, response)
                     msg = self._parse_stream_response(response, stream_processor)
                 else:
                     msg = self._parse_response(response)
                 break
-            except (
-                httpx.RemoteProtocolError,
-                httpx.ReadTimeout,
-                httpx.ConnectTimeout,
-                httpx.HTTPStatusError,
-                httpx.ConnectError,
-                openai.APIConnectionError,
-                openai.APITimeoutError,
-            ) as e:
-                delay = self._retry.backoff(attempt)
+            except RETRYABLE_ERRORS as e:
+                if self._is_cancelled(stream_processor):
+                    # 对冲请求输掉竞争后响应被关闭
+                    return self._request_cancelled(f"Request to {self.name} lost the race")
+                if self._record_error(e) and self._breaker.state != CircuitState.CLOSED:
+                    # 熔断后不再等待重试
+                    return self._retry_exhausted(attempt, e)
+                delay = self._retry_delay(attempt, e)
                 self._log_retry(attempt, e, delay)
-                time.sleep(delay)
                 if attempt >= self._retry.max_attempts:
-                    self.log.exception(
-                        f"{self.name} API call failed after {attempt} attempt(s)",
-                        e=e,
-                    )
-                    return ErrorMessage(content=f"{e} (attempts={attempt})")
+                    return self._retry_exhausted(attempt, e)
+                self._wait_retry(stream_processor, delay)
+
+            except RequestCancelled as e:
+                return self._request_cancelled(str(e))
 
             except Exception as e:
-                self.log.exception(
-                    (
-                        f"{self.name} API call encountered non-retryable "
-                        f"error on attempt {attempt}"
-                    ),
-                    e=e,
-                )
-                return ErrorMessage(content=f"{e} (attempts={attempt})")
+                if self._is_cancelled(stream_processor):
+                    return self._request_cancelled(f"Request to {self.name} lost the race")
+                self._record_error(e)
+                return self._non_retryable(attempt, e)
 
+            except BaseException:
+                # asyncio.CancelledError、KeyboardInterrupt 等
+                self._release_breaker()
+                raise
+
+        if self._limiter:
+            self._limiter.settle(tokens, msg.usage.get('total_tokens', 0))
+        return self._finish(msg, start, attempt, key)
+
+    async def acall(
+        self,
+        messages: list[Dict[str, Any]],
+        stream_processor=None,
+        **kwargs,
+    ) -> AIMessage | ErrorMessage:
+        """__call__ 的异步版本，等待网络和退避时不占用线程"""
+        key = self._replay_key(messages, kwargs)
+        if key and self._replay.replaying:
+            return self._replay_response(key, stream_processor)
+
+        tokens = estimate_tokens(messages) if self._limiter else 0
+        messages, system = self._prepare_messages(messages)
+        if system is not None:
+            kwargs['system'] = system
+        start = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            if self._breaker and not self._breaker.allow():
+                return self._circuit_open(attempt)
+            try:
+                if self._limiter:
+                    await self._limiter.aacquire(tokens)
+                response = await self.aget_completion(messages, **kwargs)
+                if self.config.stream:
+                    msg = await self._aparse_stream_response(response, stream_processor)
+                else:
+                    msg = self._parse_response(response)
+                break
+            except RETRYABLE_ERRORS as e:
+                if self._record_error(e) and self._breaker.state != CircuitState.CLOSED:
+                    # 熔断后不再等待重试
+                    return self._retry_exhausted(attempt, e)
+                delay = self._retry_delay(attempt, e)
+                self._log_retry(attempt, e, delay)
+                if attempt >= self._retry.max_attempts:
+                    return self._retry_exhausted(attempt, e)
+                await asyncio.sleep(delay)
+
+            except RequestCancelled as e:
+                return self._request_cancelled(str(e))
+
+            except Exception as e:
+                self._record_error(e)
+                return self._non_retryable(attempt, e)
+
+            except BaseException:
+                # asyncio.CancelledError、KeyboardInterrupt 等
+                self._release_breaker()
+                raise
+
+        if self._limiter:
+            self._limiter.settle(tokens, msg.usage.get('total_tokens', 0))
+        return self._finish(msg, start, attempt, key)
+
+    def _retry_delay(self, attempt: int, e: Exception) -> float:
+        """重试等待时间，优先使用服务端返回的 Retry-After"""
+        retry_after = parse_retry_after(e)
+        if retry_after is None:
+            return self._retry.backoff(attempt)
+        if self._limiter:
+            # 共享这个客户端的其它请求也一起暂停
+            self._limiter.pause(retry_after)
+        return retry_after
+
+    @property
+    def rate_limit_stats(self) -> dict | None:
+        """限速器等待队列统计，未配置限速时返回 None"""
+        return self._limiter.stats() if self._limiter else None
+
+    def _release_breaker(self):
+        """请求被取消时归还熔断器的试探名额，否则半开状态会一直拒绝请求"""
+        if self._breaker:
+            self._breaker.release()
+
+    def _request_cancelled(self, reason: str) -> ErrorMessage:
+        self._release_breaker()
+        self.log.info('LLM request cancelled', reason=reason)
+        return ErrorMessage(content=reason)
+
+    @staticmethod
+    def _is_cancelled(stream_processor) -> bool:
+        """对冲请求中已经输掉竞争（stream_processor 提供 cancelled 属性时）"""
+        return bool(getattr(stream_processor, 'cancelled', False))
+
+    def _check_cancelled(self, stream_processor):
+        if self._is_cancelled(stream_processor):
+            raise RequestCancelled(f"Request to {self.name} lost the race")
+
+    def _watch_cancel(self, stream_processor, response):
+        """输掉竞争时关闭流式响应，落后的请求不用等到首个 token 才结束"""
+        on_cancel = getattr(stream_processor, 'on_cancel', None)
+        if on_cancel:
+            on_cancel(partial(self._close_stream, response))
+
+    @staticmethod
+    def _wait_retry(stream_processor, delay: float):
+        """重试前等待，输掉竞争时提前结束"""
+        wait = getattr(stream_processor, 'wait_cancelled', None)
+        if wait:
+            wait(delay)
+        else:
+            time.sleep(delay)
+
+    def _record_error(self, e: Exception) -> bool:
+        """只有服务不可用的错误计为熔断器失败，其它错误归还试探名额。返回是否计为失败"""
+        if not self._breaker:
+            return False
+        if is_service_failure(e):
+            self._breaker.record(False)
+            return True
+        self._breaker.release()
+        return False
+
+    def _circuit_open(self, attempt: int) -> ErrorMessage:
+        self.log.warning('Circuit open, failing fast', state=self._breaker.state.value)
+        return ErrorMessage(content=f"{self.name} is unavailable: circuit {self._breaker.state.value} (attempts={attempt - 1})")
+
+    def _retry_exhausted(self, attempt: int, e: Exception) -> ErrorMessage:
+        self.log.exception(
+            f"{self.name} API call failed after {attempt} attempt(s)",
+            e=e,
+        )
+        return ErrorMessage(content=f"{e} (attempts={attempt})")
+
+    def _non_retryable(self, attempt: int, e: Exception) -> ErrorMessage:
+        self.log.exception(
+            (
+                f"{self.name} API call encountered non-retryable "
+                f"error on attempt {attempt}"
+            ),
+            e=e,
+        )
+        return ErrorMessage(content=f"{e} (attempts={attempt})")
+
+    def _finish(self, msg: AIMessage, start: float, attempt: int, key: str | None = None) -> AIMessage:
         msg.usage['time'] = int(time.time() - start)
         msg.usage['retries'] = attempt - 1
+        if self._breaker:
+            self._breaker.record(True)
         if not msg.content:
             self.log.warning("Got empty LLM response")
+        if key:
+            try:
+                self._replay.save(key, msg, meta={'client': self.name, 'model': self.model})
+            except Exception:
+                self.log.exception('Error recording LLM response', key=key)
+        return msg
+
+    def _replay_key(self, messages: list[Dict[str, Any]], kwargs: dict) -> str | None:
+        """计算录制/重放缓存的 key，未启用缓存时返回 None"""
+        if not self._replay or not self._replay.enabled:
+            return None
+        # extra_headers 里带有任务 ID，不参与 key 计算
+        kwargs = {k: v for k, v in kwargs.items() if k != 'extra_headers'}
+        tools = kwargs.pop('tools', None)
+        return self._replay.make_key(self.model, messages, tools, self.get_api_params(**kwargs))
+
+    def _replay_response(self, key: str, stream_processor) -> AIMessage | ErrorMessage:
+        """从缓存返回响应，不访问网络"""
+        msg = self._replay.load(key)
+        if not msg:
+            self.log.error('Replay cache miss', key=key)
+            return ErrorMessage(content=f"Replay cache miss: {key}")
+
+        if self.config.stream and stream_processor is not None:
+            self._replay.replay_stream(msg, stream_processor)
+        msg.usage['time'] = 0
+        msg.usage['retries'] = 0
         return msg
 
     def _log_retry(self, attempt: int, e: Exception, delay: float) -> None:
@@ -1,10 +1,10 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import hashlib
 from typing import Any, Dict
 from collections import Counter
 
-import httpx
 import openai
 
 from .base import BaseClient, MessageRole, AIMessage
@@ -16,19 +16,30 @@ from openai.types.chat.chat_completion_message_tool_call import Function
 # https://api-docs.deepseek.com/api/create-chat-completion
 class OpenAIBaseClient(BaseClient):
     """ OpenAI compatible client """
+    # 是否支持 prompt_cache_key 参数，兼容 OpenAI 的其它服务商未必支持
+    PROMPT_CACHE_KEY = False
     
-    def get_api_params(self, **kwargs):
+    def get_api_params(self, messages: list[Dict[str, Any]] | None = None, **kwargs):
         params = super().get_api_params(**kwargs)
 
         # OpenAI 特定的流式选项
         if self.config.stream:
             params['stream_options'] = {'include_usage': True}
 
+        if messages and self.PROMPT_CACHE_KEY and self.config.prompt_cache:
+            params['prompt_cache_key'] = self._prompt_cache_key(messages, kwargs.get('tools'))
+
         params.update(self.config.extra_fields)
         params.update(kwargs)
 
         return params
 
+    def _prompt_cache_key(self, messages: list[Dict[str, Any]], tools=None) -> str:
+        """用系统提示词和工具列表计算缓存路由 key，前缀相同的请求被路由到同一缓存"""
+        system = messages[0].get('content') if messages[0].get('role') == MessageRole.SYSTEM else ''
+        data = f"{self.model}\n{system}\n{tools}"
+        return 'aipy-' + hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
     def usable(self):
         return super().usable() and self.config.api_key
 
@@ -37,9 +48,15 @@ class OpenAIBaseClient(BaseClient):
             api_key=self.config.api_key,
             base_url=self.base_url,
             timeout=self.config.timeout,
-            http_client=httpx.Client(
-                verify=self.config.tls_verify
-            )
+            http_client=self._get_http_client()
+        )
+
+    def _get_async_client(self):
+        return openai.AsyncClient(
+            api_key=self.config.api_key,
+            base_url=self.base_url,
+            timeout=self.config.timeout,
+            http_client=self._get_async_http_client()
         )
     
     def _parse_usage(self, usage) -> Counter:
@@ -48,39 +65,68 @@ class OpenAIBaseClient(BaseClient):
         except Exception:
             reasoning_tokens = 0
 
+        # OpenAI: prompt_tokens_details.cached_tokens，DeepSeek: prompt_cache_hit_tokens
+        try:
+            cached_tokens = int(usage.prompt_tokens_details.cached_tokens or 0)
+        except Exception:
+            cached_tokens = 0
+        cached_tokens = max(cached_tokens, int(getattr(usage, 'prompt_cache_hit_tokens', None) or 0))
+
         usage = Counter({
             'total_tokens': usage.prompt_tokens + usage.completion_tokens,
             'input_tokens': usage.prompt_tokens,
             'output_tokens': usage.completion_tokens,
             'reasoning_tokens': reasoning_tokens,
+            'cached_tokens': cached_tokens,
             'missing_tokens': usage.total_tokens - usage.prompt_tokens - usage.completion_tokens
         })
         return usage
     
+    def _process_stream_chunk(self, chunk, lm, tool_calls_chunks) -> Counter | None:
+        """处理单个流式 chunk，返回其中的 usage（如果有）"""
+        usage = None
+        if hasattr(chunk, 'usage') and chunk.usage is not None:
+            usage = self._parse_usage(chunk.usage)
+
+        if chunk.choices:
+            content = None
+            delta = chunk.choices[0].delta
+            if delta.content:
+                reason = False
+                content = delta.content
+            elif hasattr(delta, 'reasoning_content') and delta.reasoning_content:
+                reason = True
+                content = delta.reasoning_content
+
+            if delta.tool_calls:
+                tool_calls_chunks.append(delta.tool_calls)
+
+            if content:
+                lm.process_chunk(content, reason=reason)
+        return usage
+
     def _parse_stream_response(self, response, stream_processor) -> AIMessage:
         usage = Counter()
         tool_calls_chunks = []
-        with stream_processor as lm:
-            for chunk in response:
-                #print(chunk)
-                if hasattr(chunk, 'usage') and chunk.usage is not None:
-                    usage = self._parse_usage(chunk.usage)
-
-                if chunk.choices:
-                    content = None
-                    delta = chunk.choices[0].delta
-                    if delta.content:
-                        reason = False
-                        content = delta.content
-                    elif hasattr(delta, 'reasoning_content') and delta.reasoning_content:
-                        reason = True
-                        content = delta.reasoning_content
-
-                    if delta.tool_calls:
-                        tool_calls_chunks.append(delta.tool_calls)
-
-                    if content:
-                        lm.process_chunk(content, reason=reason)
+        try:
+            with stream_processor as lm:
+                for chunk in response:
+                    usage = self._process_stream_chunk(chunk, lm, tool_calls_chunks) or usage
+        finally:
+            self._close_stream(response)
+
+        tool_calls = self._reconstruct_tool_calls(tool_calls_chunks)
+        return AIMessage(role=MessageRole.ASSISTANT, content=lm.content, reason=lm.reason, usage=usage, tool_calls=tool_calls)
+
+    async def _aparse_stream_response(self, response, stream_processor) -> AIMessage:
+        usage = Counter()
+        tool_calls_chunks = []
+        try:
+            with stream_processor as lm:
+                async for chunk in response:
+                    usage = self._process_stream_chunk(chunk, lm, tool_calls_chunks) or usage
+        finally:
+            await self._aclose_stream(response)
 
         tool_calls = self._reconstruct_tool_calls(tool_calls_chunks)
         return AIMessage(role=MessageRole.ASSISTANT, content=lm.content, reason=lm.reason, usage=usage, tool_calls=tool_calls)
@@ -132,11 +178,22 @@ class OpenAIBaseClient(BaseClient):
             self._client = self._get_client()
 
         # 获取 API 参数
-        api_params = self.get_api_params(**kwargs)
+        api_params = self.get_api_params(messages=messages, **kwargs)
 
         response = self._client.chat.completions.create(
             messages=messages,
             **api_params
         )
         return response
-    
\ No newline at end of file
+
+    async def aget_completion(self, messages: list[Dict[str, Any]], **kwargs):
+        if not self._aclient:
+            self._aclient = self._get_async_client()
+
+        api_params = self.get_api_params(messages=messages, **kwargs)
+
+        response = await self._aclient.chat.completions.create(
+            messages=messages,
+            **api_params
+        )
+        return response
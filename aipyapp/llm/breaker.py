@@ -0,0 +1,179 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Circuit breaker for LLM clients
+
+每个 BaseClient 一个熔断器，根据最近 window 次请求的错误率切换状态：
+- closed: 正常发送请求
+- open: 错误率过高，直接返回错误，不再重试等待；cooldown 秒后进入 half_open
+- half_open: 在后台线程中探测服务是否恢复，成功则 closed，失败则重新 open 并加倍 cooldown
+"""
+
+import time
+import threading
+from enum import Enum
+from collections import deque
+from typing import Callable, Optional
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class BreakerConfig(BaseModel):
+    """熔断器配置"""
+    enabled: bool = Field(True, description="是否启用熔断器")
+    window: int = Field(20, gt=0, description="统计错误率的最近请求数")
+    min_requests: int = Field(5, gt=0, description="触发熔断所需的最少请求数")
+    error_threshold: float = Field(0.5, gt=0, le=1, description="触发熔断的错误率")
+    cooldown: float = Field(30.0, gt=0, description="熔断后进入半开状态前的等待时间（秒）")
+    max_cooldown: float = Field(300.0, gt=0, description="探测失败后 cooldown 加倍的上限（秒）")
+
+
+class CircuitBreaker:
+    """closed / open / half_open 三态熔断器"""
+
+    def __init__(self, config: BreakerConfig | dict | None = None, probe: Optional[Callable[[], bool]] = None, name: str = ''):
+        if isinstance(config, BreakerConfig):
+            self.config = config
+        else:
+            self.config = BreakerConfig(**(config or {}))
+        self.name = name
+        self.probe = probe
+        self.log = logger.bind(src='breaker', name=name)
+        self._lock = threading.Lock()
+        self._results = deque(maxlen=self.config.window)
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._cooldown = self.config.cooldown
+        self._trial = False
+        self._timer: Optional[threading.Timer] = None
+
+        # 计数器
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> CircuitState:
+        return self._state
+
+    @property
+    def error_rate(self) -> float:
+        if not self._results:
+            return 0.0
+        return self._results.count(False) / len(self._results)
+
+    def allow(self) -> bool:
+        """是否允许发送请求，熔断时直接拒绝"""
+        if not self.config.enabled:
+            return True
+        with self._lock:
+            if self._state == CircuitState.CLOSED:
+                return True
+            if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self._cooldown:
+                # 没有探测函数（或后台探测尚未执行）时，cooldown 到期后放行一个试探请求
+                self._state = CircuitState.HALF_OPEN
+                self._trial = False
+            if self._state == CircuitState.HALF_OPEN and not self.probe and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self):
+        """请求被取消或者出错但不说明服务不可用（如 4xx）时归还半开状态的试探名额，不改变熔断状态"""
+        if not self.config.enabled:
+            return
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                self._trial = False
+
+    def record(self, success: bool):
+        """记录一次请求结果"""
+        if not self.config.enabled:
+            return
+        with self._lock:
+            if success:
+                self.successes += 1
+            else:
+                self.failures += 1
+
+            if self._state == CircuitState.HALF_OPEN:
+                if success:
+                    self._close()
+                else:
+                    self._open(backoff=True)
+                return
+            if self._state == CircuitState.OPEN:
+                return
+
+            self._results.append(success)
+            if (len(self._results) >= self.config.min_requests and
+                    self.error_rate >= self.config.error_threshold):
+                self._open()
+
+    def _open(self, backoff: bool = False):
+        if backoff:
+            self._cooldown = min(self._cooldown * 2, self.config.max_cooldown)
+        self._state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+        self.log.warning('Circuit opened', error_rate=round(self.error_rate, 2), cooldown=self._cooldown)
+        if self.probe:
+            self._schedule_probe()
+
+    def _close(self):
+        self._state = CircuitState.CLOSED
+        self._results.clear()
+        self._cooldown = self.config.cooldown
+        self.log.info('Circuit closed')
+
+    def _schedule_probe(self):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(self._cooldown, self._run_probe)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run_probe(self):
+        """在后台线程中探测服务是否恢复"""
+        with self._lock:
+            if self._state == CircuitState.CLOSED:
+                return
+            self._state = CircuitState.HALF_OPEN
+        try:
+            ok = bool(self.probe())
+        except Exception as e:
+            self.log.info('Circuit probe failed', error=str(e))
+            ok = False
+        with self._lock:
+            if self._state != CircuitState.HALF_OPEN:
+                return
+            if ok:
+                self._close()
+            else:
+                self._open(backoff=True)
+
+    def close(self):
+        """停止后台探测"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def stats(self) -> dict:
+        return {
+            'state': self._state.value,
+            'error_rate': round(self.error_rate, 3),
+            'successes': self.successes,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'opened': self.opened,
+        }
@@ -9,42 +9,78 @@ from .base import BaseClient, MessageRole, AIMessage
 # https://docs.anthropic.com/en/api/messages
 class ClaudeClient(BaseClient):
     MODEL = "claude-sonnet-4.5"
+    BASE_URL = "https://api.anthropic.com"
     ENV_API_KEY = "ANTHROPIC_API_KEY"
     #PARAMS = {'thinking': {'type': 'enabled', 'budget_tokens': 1024}}
 
-    def __init__(self, config):
-        super().__init__(config)
-        self._system_prompt = None
-
     def _get_client(self):
         import anthropic
-        return anthropic.Anthropic(api_key=self.config.api_key, timeout=self.config.timeout)
+        return anthropic.Anthropic(
+            api_key=self.config.api_key,
+            timeout=self.config.timeout,
+            http_client=self._get_http_client()
+        )
+
+    def _get_async_client(self):
+        import anthropic
+        return anthropic.AsyncAnthropic(
+            api_key=self.config.api_key,
+            timeout=self.config.timeout,
+            http_client=self._get_async_http_client()
+        )
 
     def usable(self):
         return super().usable() and self.config.api_key
     
     def _parse_usage(self, response):
-        usage = response.usage
-        ret = Counter({
-            'input_tokens': usage.input_tokens,
-            'output_tokens': usage.output_tokens,
-            'total_tokens': usage.input_tokens + usage.output_tokens
+        usage = self._usage_counter(response.usage)
+        usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']
+        return usage
+
+    @staticmethod
+    def _usage_counter(usage) -> Counter:
+        """Claude 的 input_tokens 不含缓存部分，这里加上缓存读写的 token，与 OpenAI 的 prompt_tokens 含义一致"""
+        cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+        cache_write = getattr(usage, 'cache_creation_input_tokens', None) or 0
+        return Counter({
+            'input_tokens': (getattr(usage, 'input_tokens', None) or 0) + cache_read + cache_write,
+            'output_tokens': getattr(usage, 'output_tokens', None) or 0,
+            'cached_tokens': cache_read,
+            'cache_write_tokens': cache_write,
         })
-        return ret
+
+    def _process_stream_event(self, event, lm, usage: Counter):
+        if hasattr(event, 'delta') and hasattr(event.delta, 'text') and event.delta.text:
+            content = event.delta.text
+            lm.process_chunk(content)
+        elif hasattr(event, 'message') and hasattr(event.message, 'usage') and event.message.usage:
+            # message_start：输入 token 数
+            usage.update(self._usage_counter(event.message.usage))
+        elif hasattr(event, 'usage') and event.usage:
+            # message_delta：累计的输出 token 数
+            output_tokens = getattr(event.usage, 'output_tokens', None) or 0
+            usage['output_tokens'] = max(usage['output_tokens'], output_tokens)
 
     def _parse_stream_response(self, response, stream_processor):
         usage = Counter()    
-        with stream_processor as lm:
-            for event in response:
-                if hasattr(event, 'delta') and hasattr(event.delta, 'text') and event.delta.text:
-                    content = event.delta.text
-                    lm.process_chunk(content)
-                elif hasattr(event, 'message') and hasattr(event.message, 'usage') and event.message.usage:
-                    usage['input_tokens'] += getattr(event.message.usage, 'input_tokens', 0)
-                    usage['output_tokens'] += getattr(event.message.usage, 'output_tokens', 0)
-                elif hasattr(event, 'usage') and event.usage:
-                    usage['input_tokens'] += getattr(event.usage, 'input_tokens', 0)
-                    usage['output_tokens'] += getattr(event.usage, 'output_tokens', 0)
+        try:
+            with stream_processor as lm:
+                for event in response:
+                    self._process_stream_event(event, lm, usage)
+        finally:
+            self._close_stream(response)
+
+        usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']
+        return AIMessage(content=lm.content, usage=usage)
+
+    async def _aparse_stream_response(self, response, stream_processor):
+        usage = Counter()
+        try:
+            with stream_processor as lm:
+                async for event in response:
+                    self._process_stream_event(event, lm, usage)
+        finally:
+            await self._aclose_stream(response)
 
         usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']
         return AIMessage(content=lm.content, usage=usage)
@@ -55,17 +91,43 @@ class ClaudeClient(BaseClient):
         return AIMessage(role=role, content=content, usage=self._parse_usage(response))
     
     def _prepare_messages(self, messages):
+        system = None
         if messages[0]['role'] == MessageRole.SYSTEM:
-            self._system_prompt = messages[0]['content']
+            system = messages[0]['content']
             messages = messages[1:]
-        return messages
-
-    def get_api_params(self, **kwargs):
+            if self.config.prompt_cache and isinstance(system, str):
+                system = [self._cache_block(system)]
+
+        if self.config.prompt_cache and messages:
+            # 在最后一条消息上设置缓存断点，下一轮请求可以读取到这里为止的前缀
+            messages = messages[:-1] + [self._with_cache_control(messages[-1])]
+        return messages, system
+
+    @staticmethod
+    def _cache_block(text: str) -> dict:
+        return {'type': 'text', 'text': text, 'cache_control': {'type': 'ephemeral'}}
+
+    def _with_cache_control(self, message: dict) -> dict:
+        content = message.get('content')
+        if isinstance(content, str):
+            if not content:
+                return message
+            content = [self._cache_block(content)]
+        elif isinstance(content, list) and content:
+            last = content[-1]
+            if not isinstance(last, dict):
+                return message
+            content = content[:-1] + [{**last, 'cache_control': {'type': 'ephemeral'}}]
+        else:
+            return message
+        return {**message, 'content': content}
+
+    def get_api_params(self, system=None, **kwargs):
         params = super().get_api_params(**kwargs)
 
         # Claude 特定的参数
-        if self._system_prompt:
-            params['system'] = self._system_prompt
+        if system:
+            params['system'] = system
 
         # 处理 extra_headers
         extra_headers = kwargs.pop('extra_headers', None)
@@ -86,4 +148,15 @@ class ClaudeClient(BaseClient):
             **api_params
         )
         return message
-    
\ No newline at end of file
+
+    async def aget_completion(self, messages: list[Dict[str, Any]], **kwargs):
+        if not self._aclient:
+            self._aclient = self._get_async_client()
+
+        api_params = self.get_api_params(**kwargs)
+
+        message = await self._aclient.messages.create(
+            messages=messages,
+            **api_params
+        )
+        return message
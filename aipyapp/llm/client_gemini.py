@@ -13,25 +13,22 @@ from .base import BaseClient, AIMessage
 class GeminiClient(BaseClient):
     MODEL = 'gemini-2.5-flash'
 
-    def __init__(self, config):
-        super().__init__(config)
-        self._system_prompt = None
-
     def usable(self):
         return super().usable() and self.config.api_key
 
     def _get_client(self):
         return genai.Client(api_key=self.config.api_key)
     
-    def _prepare_messages(self, messages: list[Dict[str, Any]]) -> list[types.Content]:
+    def _prepare_messages(self, messages: list[Dict[str, Any]]) -> tuple[list[types.Content], Any]:
         """将OpenAI格式的messages转换为Gemini的contents格式"""
         contents = []
+        system = None
         
         for msg in messages:
             role = msg.get('role', '')
             content = msg.get('content', '')
             if role == 'system':
-                self._system_prompt = content
+                system = content
             elif role == 'user':
                 contents.append(types.UserContent(
                     parts=[types.Part.from_text(text=content)]
@@ -41,7 +38,7 @@ class GeminiClient(BaseClient):
                     parts=[types.Part.from_text(text=content)]
                 ))
         
-        return contents
+        return contents, system
     
     def _parse_usage(self, response) -> Counter:
         """解析Gemini响应中的使用统计"""
@@ -63,25 +60,49 @@ class GeminiClient(BaseClient):
 
         return usage
     
+    def _process_stream_chunk(self, chunk, lm) -> Counter | None:
+        # 处理流式响应的每个chunk
+        if hasattr(chunk, 'text') and chunk.text:
+            lm.process_chunk(chunk.text, reason=False)
+
+        # 获取usage信息
+        if hasattr(chunk, 'usage_metadata'):
+            return self._parse_usage(chunk)
+        return None
+
     def _parse_stream_response(self, response, stream_processor) -> AIMessage:
         """处理Gemini的流式响应"""
         usage = Counter()
         
-        with stream_processor as lm:
-            for chunk in response:
-                # 处理流式响应的每个chunk
-                if hasattr(chunk, 'text') and chunk.text:
-                    lm.process_chunk(chunk.text, reason=False)
-                
-                # 获取usage信息
-                if hasattr(chunk, 'usage_metadata'):
-                    usage = self._parse_usage(chunk)
+        try:
+            with stream_processor as lm:
+                for chunk in response:
+                    usage = self._process_stream_chunk(chunk, lm) or usage
+        finally:
+            self._close_stream(response)
         
         return AIMessage(
             content=lm.content,
             reason=lm.reason,
             usage=usage
         )
+
+    async def _aparse_stream_response(self, response, stream_processor) -> AIMessage:
+        """异步处理Gemini的流式响应"""
+        usage = Counter()
+
+        try:
+            with stream_processor as lm:
+                async for chunk in response:
+                    usage = self._process_stream_chunk(chunk, lm) or usage
+        finally:
+            await self._aclose_stream(response)
+
+        return AIMessage(
+            content=lm.content,
+            reason=lm.reason,
+            usage=usage
+        )
     
     def _parse_response(self, response) -> AIMessage:
         """处理Gemini的非流式响应"""
@@ -101,7 +122,7 @@ class GeminiClient(BaseClient):
             usage=self._parse_usage(response)
         )
     
-    def get_api_params(self, **kwargs):
+    def get_api_params(self, system=None, **kwargs):
         # Gemini 使用特殊的 config 对象，在这里处理参数
         params = {}
 
@@ -110,8 +131,8 @@ class GeminiClient(BaseClient):
             params['temperature'] = self.config.temperature
         if self.config.max_tokens:
             params['max_output_tokens'] = self.config.max_tokens
-        if self._system_prompt:
-            params['system_instruction'] = self._system_prompt
+        if system:
+            params['system_instruction'] = system
 
         # 默认启用 Google 搜索工具
         params['tools'] = [types.Tool(google_search=types.GoogleSearch())]
@@ -127,9 +148,7 @@ class GeminiClient(BaseClient):
         if not self._client:
             self._client = self._get_client()
 
-        # 转换消息格式
-        contents = self._prepare_messages(messages)
-
+        # messages 已经由 _prepare_messages 转换为 contents 格式
         # 获取 API 参数
         api_params = self.get_api_params(**kwargs)
 
@@ -139,10 +158,29 @@ class GeminiClient(BaseClient):
         try:
             response = self._client.models.generate_content_stream(
                 model=self.model,
-                contents=contents,
+                contents=messages,
+                config=generation_config,
+            )
+            return response
+        except Exception as e:
+            self.log.exception("Gemini API call failed", e=e)
+            raise e
+
+    async def aget_completion(self, messages: list[Dict[str, Any]], **kwargs) -> Any:
+        """异步获取Gemini的completion响应"""
+        if not self._client:
+            self._client = self._get_client()
+
+        api_params = self.get_api_params(**kwargs)
+        generation_config = types.GenerateContentConfig(**api_params)
+
+        try:
+            response = await self._client.aio.models.generate_content_stream(
+                model=self.model,
+                contents=messages,
                 config=generation_config,
             )
             return response
         except Exception as e:
             self.log.exception("Gemini API call failed", e=e)
-            raise e
\ No newline at end of file
+            raise e
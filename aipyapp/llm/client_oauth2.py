@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import time
+import asyncio
 import httpx
 from typing import Optional, Dict
 
@@ -52,6 +53,18 @@ class OAuth2Client(OpenAIBaseClient):
 
         return client
 
+    def _get_async_client(self):
+        # 使用 aget_completion 中刷新过的 access token
+        original_api_key = self.config.api_key
+        self.config.api_key = self._access_token
+
+        try:
+            client = super()._get_async_client()
+        finally:
+            self.config.api_key = original_api_key
+
+        return client
+
     def _get_access_token(self) -> str:
         """Get OAuth2 access token using client credentials"""
         current_time = time.time()
@@ -71,14 +84,16 @@ class OAuth2Client(OpenAIBaseClient):
         if scope:
             auth_data['scope'] = scope
 
-        with httpx.Client(timeout=self.config.timeout, verify=self.config.tls_verify) as client:
-            response = client.post(
-                self.token_url,
-                data=auth_data
-            )
-            response.raise_for_status()
-            token_data = response.json()
-            self._access_token = token_data['access_token']
+        # 复用共享连接池，避免每次获取 token 都重新建立 TLS 连接
+        client = self._get_http_client(self.token_url)
+        response = client.post(
+            self.token_url,
+            data=auth_data,
+            timeout=self.config.timeout or httpx.USE_CLIENT_DEFAULT
+        )
+        response.raise_for_status()
+        token_data = response.json()
+        self._access_token = token_data['access_token']
 
         # Calculate expiration time (default to 5 mins if not provided)
         expires_in = token_data.get("expires_in", 300)
@@ -91,3 +106,9 @@ class OAuth2Client(OpenAIBaseClient):
         self._client = None
 
         return response
+
+    async def aget_completion(self, messages, **kwargs):
+        # 获取 token 是同步请求，放到线程中执行以免阻塞事件循环
+        await asyncio.to_thread(self._get_access_token)
+        self._aclient = None
+        return await super().aget_completion(messages, **kwargs)
@@ -2,17 +2,14 @@
 # -*- coding: utf-8 -*-
 
 import json
-import requests
 from collections import Counter
 
+import httpx
+
 from .base import BaseClient, AIMessage
 
 # https://github.com/ollama/ollama/blob/main/docs/api.md
 class OllamaClient(BaseClient):
-    def __init__(self, config):
-        super().__init__(config)
-        self._session = requests.Session()
-
     def usable(self):
         return super().usable() and self.base_url
     
@@ -24,18 +21,44 @@ class OllamaClient(BaseClient):
         })
         return ret
 
+    def _process_stream_line(self, line, lm) -> Counter | None:
+        """处理一行流式响应，返回 usage 表示流已结束"""
+        if not line:
+            return None
+        msg = json.loads(line)
+        if msg['done']:
+            return self._parse_usage(msg)
+
+        if 'message' in msg and 'content' in msg['message'] and msg['message']['content']:
+            content = msg['message']['content']
+            lm.process_chunk(content)
+        return None
+
     def _parse_stream_response(self, response, stream_processor):
-        with stream_processor as lm:
-            for chunk in response.iter_lines():
-                chunk = chunk.decode(encoding='utf-8')
-                msg = json.loads(chunk)
-                if msg['done']:
-                    usage = self._parse_usage(msg)
-                    break
-
-                if 'message' in msg and 'content' in msg['message'] and msg['message']['content']:
-                    content = msg['message']['content']
-                    lm.process_chunk(content)
+        usage = Counter()
+        try:
+            with stream_processor as lm:
+                for line in response.iter_lines():
+                    done = self._process_stream_line(line, lm)
+                    if done is not None:
+                        usage = done
+                        break
+        finally:
+            response.close()
+
+        return AIMessage(content=lm.content, usage=usage)
+
+    async def _aparse_stream_response(self, response, stream_processor):
+        usage = Counter()
+        try:
+            with stream_processor as lm:
+                async for line in response.aiter_lines():
+                    done = self._process_stream_line(line, lm)
+                    if done is not None:
+                        usage = done
+                        break
+        finally:
+            await response.aclose()
 
         return AIMessage(content=lm.content, usage=usage)
 
@@ -69,7 +92,7 @@ class OllamaClient(BaseClient):
 
         return params
 
-    def get_completion(self, messages, **kwargs):
+    def _build_request(self, client, messages, **kwargs):
         # 获取 API 参数
         api_params = self.get_api_params(**kwargs)
 
@@ -79,11 +102,30 @@ class OllamaClient(BaseClient):
         # 处理 extra_headers
         extra_headers = kwargs.pop('extra_headers', None)
 
-        response = self._session.post(
+        return client.build_request(
+            "POST",
             f"{self.base_url}/api/chat",
             json=api_params,
-            timeout=self.config.timeout,
             headers=extra_headers,
+            timeout=self.config.timeout or httpx.USE_CLIENT_DEFAULT,
         )
+
+    def get_completion(self, messages, **kwargs):
+        client = self._get_http_client()
+        request = self._build_request(client, messages, **kwargs)
+        response = client.send(request, stream=self.config.stream)
+        if response.is_error:
+            response.read()
+            response.close()
+        response.raise_for_status()
+        return response
+
+    async def aget_completion(self, messages, **kwargs):
+        client = self._get_async_http_client()
+        request = self._build_request(client, messages, **kwargs)
+        response = await client.send(request, stream=self.config.stream)
+        if response.is_error:
+            await response.aread()
+            await response.aclose()
         response.raise_for_status()
         return response
@@ -44,6 +44,13 @@ class ClientConfig(BaseModel):
     # 流式配置
     stream: bool = Field(True, description="是否使用流式响应")
 
+    # 提示词缓存：Claude 设置 cache_control 断点，OpenAI 发送 prompt_cache_key
+    prompt_cache: bool = Field(True, description="是否启用服务商的提示词缓存")
+
+    # 限速配置
+    rpm: Optional[int] = Field(None, gt=0, description="每分钟最大请求数")
+    tpm: Optional[int] = Field(None, gt=0, description="每分钟最大 token 数")
+
     # 自定义参数 - 不同 API 特有的参数
     extra_fields: Dict[str, Any] = Field(default_factory=dict, description="客户端特定参数")
 
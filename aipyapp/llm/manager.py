@@ -9,10 +9,14 @@ from .client_ollama import OllamaClient
 from .client_oauth2 import OAuth2Client
 from .models import ModelRegistry
 from .config import create_client_config
+from .transport import HttpClientPool
+from .replay import ReplayCache
+from .routing import Router
+from .breaker import BreakerConfig, CircuitBreaker, CircuitState
 
 class OpenAIBaseClientV2(OpenAIBaseClient): 
-    def get_api_params(self, **kwargs):
-        params = super().get_api_params(**kwargs)
+    def get_api_params(self, messages=None, **kwargs):
+        params = super().get_api_params(messages=messages, **kwargs)
 
         # Adjust max_tokens to max_completion_tokens for OpenAI
         max_tokens = params.pop('max_tokens', None)
@@ -22,6 +26,7 @@ class OpenAIBaseClientV2(OpenAIBaseClient):
 
 class OpenAIClient(OpenAIBaseClientV2): 
     MODEL = 'gpt-4o'
+    PROMPT_CACHE_KEY = True
 
 class GeminiClient(OpenAIBaseClient): 
     BASE_URL = 'https://generativelanguage.googleapis.com/v1beta/'
@@ -58,7 +63,18 @@ class AzureOpenAIClient(OpenAIBaseClientV2):
             azure_endpoint=self.endpoint,
             api_key=self.config.api_key,
             api_version="2024-02-01",
-            timeout=self.config.timeout
+            timeout=self.config.timeout,
+            http_client=self._get_http_client(self.endpoint)
+        )
+
+    def _get_async_client(self):
+        from openai import AsyncAzureOpenAI
+        return AsyncAzureOpenAI(
+            azure_endpoint=self.endpoint,
+            api_key=self.config.api_key,
+            api_version="2024-02-01",
+            timeout=self.config.timeout,
+            http_client=self._get_async_http_client(self.endpoint)
         )
 
 class DoubaoClient(OpenAIBaseClient): 
@@ -96,12 +112,26 @@ CLIENTS = {
 class ClientManager(object):
     MAX_TOKENS = 8192
 
-    def __init__(self, settings: dict, max_tokens: int | None = None):
+    def __init__(
+        self,
+        settings: dict,
+        max_tokens: int | None = None,
+        http: dict | None = None,
+        replay: dict | None = None,
+        routing: dict | None = None,
+        breaker: dict | None = None,
+    ):
         self.clients = {}
         self.default = None
         self.current = None
         self.max_tokens = max_tokens or self.MAX_TOKENS
         self.log = logger.bind(src='client_manager')
+        self.http_pool = HttpClientPool(http)
+        self.router = Router(routing)
+        self.breaker_config = BreakerConfig(**(breaker or {}))
+        self.replay_cache = ReplayCache(replay)
+        if self.replay_cache.enabled:
+            self.log.info('LLM replay cache enabled', mode=self.replay_cache.mode.value, path=str(self.replay_cache.path))
         self.names = self._init_clients(settings)
         self.model_registry = ModelRegistry(__respath__ / "models.yaml")
         
@@ -120,7 +150,13 @@ class ClientManager(object):
 
         # 创建 ClientConfig 对象
         client_config = create_client_config(config2)
-        return client_class(client_config)
+        client = client_class(client_config)
+        client.bind_http_pool(self.http_pool)
+        client.bind_replay_cache(self.replay_cache)
+        if self.breaker_config.enabled:
+            probe = client.probe if client.base_url else None
+            client.bind_circuit_breaker(CircuitBreaker(self.breaker_config, probe=probe, name=name))
+        return client
     
     def _init_clients(self, settings):
         names = defaultdict(set)
@@ -179,14 +215,62 @@ class ClientManager(object):
 
     def get_client(self, name):
         return self.clients.get(name)
+
+    def plan(self, primary, role: str | None = None) -> list:
+        """返回本次请求依次尝试的客户端列表"""
+        names = self.router.plan(primary.name, self.clients.keys(), role=role)
+        clients = []
+        for name in names:
+            client = primary if name == primary.name else self.clients.get(name)
+            if client and client.usable():
+                clients.append(client)
+        # 熔断中的客户端排到最后
+        clients.sort(key=lambda client: client.circuit_state != CircuitState.CLOSED)
+        return clients
     
     def to_records(self):
-        LLMRecord = namedtuple('LLMRecord', ['Name', 'Model', 'Max_Tokens', 'Base_URL'])
+        LLMRecord = namedtuple('LLMRecord', ['Name', 'Model', 'Max_Tokens', 'Base_URL', 'Rate_Limit', 'Waiting', 'Waits', 'Wait_Time', 'Circuit', 'Errors'])
         rows = []
         for name, client in self.clients.items():
-            rows.append(LLMRecord(name, client.model, client.max_tokens, client.base_url))
+            config = client.config
+            stats = client.rate_limit_stats
+            if stats:
+                rate_limit = f"{config.rpm or '-'} rpm / {config.tpm or '-'} tpm"
+                waiting, waits, wait_time = stats['waiting'], stats['waits'], stats['wait_time']
+            else:
+                rate_limit = waiting = waits = wait_time = '-'
+            health = self.get_health(client)
+            if health:
+                circuit, errors = health['state'], f"{health['failures']}/{health['failures'] + health['successes']}"
+            else:
+                circuit = errors = '-'
+            rows.append(LLMRecord(name, client.model, config.max_tokens, client.base_url, rate_limit, waiting, waits, wait_time, circuit, errors))
         return rows
+
+    def get_health(self, client) -> dict | None:
+        """客户端的熔断器状态和计数"""
+        breaker = client.circuit_breaker
+        return breaker.stats() if breaker else None
+
+    def health(self) -> dict:
+        """所有客户端的健康状态"""
+        return {name: self.get_health(client) for name, client in self.clients.items()}
     
     def get_model_info(self, model: str):
         return self.model_registry.get_model_info(model)
+
+    def _close_breakers(self):
+        for client in self.clients.values():
+            if client.circuit_breaker:
+                client.circuit_breaker.close()
+
+    def close(self):
+        """关闭共享的 HTTP 连接"""
+        self._close_breakers()
+        self.http_pool.close()
+
+    async def aclose(self):
+        """关闭共享的 HTTP 连接（包括异步连接）"""
+        self._close_breakers()
+        await self.http_pool.aclose()
     
\ No newline at end of file
@@ -0,0 +1,165 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Token-bucket rate limiter for LLM clients
+
+每个 BaseClient 一个 RateLimiter，按 ClientConfig 中的 rpm（每分钟请求数）和 tpm（每分钟 token 数）限速。
+请求发送前按估算的 token 数预留额度，额度不足时等待；响应返回后按实际用量修正。
+预留在锁内完成，等待在锁外进行，所以同一个限速器可以被多个线程和异步任务共享。
+收到 Retry-After 时暂停整个限速器，避免所有任务同时重试。
+"""
+
+import time
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional
+
+
+IMAGE_TOKENS = 1000
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """粗略估算消息的 token 数：文本按 UTF-8 字节数 / 4，图片等非文本内容按固定值"""
+    total = 0
+    for message in messages:
+        content = message.get('content') if isinstance(message, dict) else message
+        if isinstance(content, list):
+            for item in content:
+                if isinstance(item, dict) and item.get('type') == 'text':
+                    total += len(str(item.get('text', '')).encode('utf-8')) // 4
+                else:
+                    total += IMAGE_TOKENS
+        elif content is not None:
+            total += len(str(content).encode('utf-8')) // 4
+        total += 4
+    return total
+
+
+def parse_retry_after(e: Exception) -> Optional[float]:
+    """从异常携带的 HTTP 响应中解析 Retry-After（秒）"""
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """令牌桶，允许预留超出当前余额的额度（欠账），返回需要等待的时间"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.fill_rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # 单次请求超过桶容量时按容量计算，否则永远无法发出
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.fill_rate
+
+    def adjust(self, delta: float):
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class RateLimiter:
+    """按请求数和 token 数限速"""
+
+    def __init__(self, rpm: int | None = None, tpm: int | None = None):
+        self.rpm = TokenBucket(rpm) if rpm else None
+        self.tpm = TokenBucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+
+        # 等待队列统计
+        self.waiting = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def reserve(self, tokens: int = 0) -> float:
+        """预留一次请求的额度，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(self._blocked_until - now, 0.0)
+            if self.rpm:
+                delay = max(delay, self.rpm.reserve(1, now))
+            if self.tpm and tokens:
+                delay = max(delay, self.tpm.reserve(tokens, now))
+            if delay > 0:
+                self.waiting += 1
+                self.waits += 1
+                self.wait_time += delay
+                self.max_wait = max(self.max_wait, delay)
+            return delay
+
+    def _done_waiting(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self, tokens: int = 0) -> float:
+        """同步等待额度，返回等待的秒数"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            try:
+                time.sleep(delay)
+            finally:
+                self._done_waiting()
+        return delay
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        """异步等待额度，返回等待的秒数"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._done_waiting()
+        return delay
+
+    def settle(self, estimated: int, actual: int):
+        """按实际 token 用量修正预留的额度"""
+        if not self.tpm or not actual:
+            return
+        with self._lock:
+            self.tpm.adjust(actual - estimated)
+
+    def pause(self, seconds: float):
+        """收到 Retry-After 后暂停发送请求"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        return {
+            'waiting': self.waiting,
+            'waits': self.waits,
+            'wait_time': round(self.wait_time, 2),
+            'max_wait': round(self.max_wait, 2),
+        }
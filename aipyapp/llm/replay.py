@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Record/replay cache for LLM responses
+
+以请求内容（模型、消息、工具、API 参数）的哈希作为 key，把 LLM 响应保存到磁盘：
+- off: 不使用缓存
+- record: 正常请求 LLM，并把成功的响应写入缓存
+- replay: 只从缓存读取响应，不访问网络；流式客户端会通过 StreamProcessor 重放 stream 事件
+
+用于回归测试和性能测试时确定性、零成本地重跑整个任务。
+"""
+
+import json
+import hashlib
+import threading
+from enum import Enum
+from pathlib import Path
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+from pydantic import BaseModel, Field
+from openai.types.chat import ChatCompletionMessageToolCall
+
+from .base import AIMessage
+
+
+class ReplayMode(str, Enum):
+    OFF = "off"
+    RECORD = "record"
+    REPLAY = "replay"
+
+
+class ReplayConfig(BaseModel):
+    """LLM 响应录制/重放配置"""
+    mode: ReplayMode = Field(ReplayMode.OFF, description="缓存模式：off/record/replay")
+    path: Optional[str] = Field(None, description="缓存目录")
+
+
+class ReplayCache:
+    """按请求哈希保存 LLM 响应的磁盘缓存，每个响应一个 JSON 文件"""
+
+    def __init__(self, config: ReplayConfig | dict | None = None):
+        if isinstance(config, ReplayConfig):
+            self.config = config
+        else:
+            self.config = ReplayConfig(**(config or {}))
+        self.path = Path(self.config.path or 'replay').expanduser()
+        self.log = logger.bind(src='replay')
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def mode(self) -> ReplayMode:
+        return self.config.mode
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != ReplayMode.OFF
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == ReplayMode.REPLAY
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, Any]], tools: Any, params: Dict[str, Any]) -> str:
+        """计算请求的缓存 key"""
+        payload = {'model': model, 'messages': messages, 'tools': tools, 'params': params}
+        data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _file(self, key: str) -> Path:
+        return self.path / key[:2] / f"{key}.json"
+
+    def load(self, key: str) -> AIMessage | None:
+        """读取缓存的响应，不存在时返回 None"""
+        file = self._file(key)
+        try:
+            data = json.loads(file.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            self.log.exception('Error loading replay entry', key=key)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        tool_calls = data.get('tool_calls')
+        if tool_calls:
+            tool_calls = [ChatCompletionMessageToolCall.model_validate(tc) for tc in tool_calls]
+        return AIMessage(
+            content=data.get('content'),
+            reason=data.get('reason'),
+            usage=Counter(data.get('usage') or {}),
+            tool_calls=tool_calls,
+        )
+
+    def save(self, key: str, msg: AIMessage, meta: Dict[str, Any] | None = None):
+        """保存响应"""
+        data = msg.dict()
+        data.pop('role', None)
+        data['reason'] = msg.reason
+        data['usage'] = dict(msg.usage)
+        if meta:
+            data['meta'] = meta
+
+        file = self._file(key)
+        with self._lock:
+            file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = file.with_suffix('.tmp')
+            tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2, default=str), encoding='utf-8')
+            tmp.replace(file)
+        self.log.info('Recorded LLM response', key=key)
+
+    @staticmethod
+    def replay_stream(msg: AIMessage, stream_processor):
+        """通过 StreamProcessor 重放流式事件"""
+        with stream_processor as lm:
+            if msg.reason:
+                lm.process_chunk(msg.reason, reason=True)
+            if msg.content:
+                lm.process_chunk(msg.content)
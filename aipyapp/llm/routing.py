@@ -0,0 +1,176 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+LLM request routing
+
+根据配置的备用列表（fallback）和每个客户端的延迟 EWMA、错误率，决定一次请求依次尝试哪些客户端。
+对冲请求（hedge）：首个 token 在 hedge_delay 毫秒内没有到达时，同时向下一个客户端发送同样的请求，
+使用先返回的结果。
+"""
+
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+
+class RoutingConfig(BaseModel):
+    """请求路由配置"""
+    fallback: List[str] = Field(default_factory=list, description="按顺序尝试的备用 LLM 名称")
+    roles: Dict[str, List[str]] = Field(default_factory=dict, description="按角色指定的备用 LLM 名称")
+    hedge_delay: int = Field(0, ge=0, description="首个 token 超过该毫秒数未到达时发送对冲请求，0 表示不对冲")
+    ewma_alpha: float = Field(0.3, gt=0, le=1, description="延迟和错误率 EWMA 的平滑系数")
+    error_threshold: float = Field(0.5, ge=0, le=1, description="错误率达到该值的客户端被视为不健康")
+    min_samples: int = Field(3, ge=1, description="判断客户端健康状况所需的最少请求数")
+
+
+class ClientStats:
+    """单个客户端的请求统计"""
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.requests = 0
+        self.errors = 0
+        self.latency: Optional[float] = None
+        self.ttft: Optional[float] = None
+        self.error_rate = 0.0
+
+    def _ewma(self, old: Optional[float], value: float) -> float:
+        if old is None:
+            return value
+        return self.alpha * value + (1 - self.alpha) * old
+
+    def observe(self, latency: float, ttft: Optional[float] = None, error: bool = False):
+        """记录一次请求的结果，latency 和 ttft 单位为秒"""
+        self.requests += 1
+        self.error_rate = self._ewma(self.error_rate if self.requests > 1 else None, 1.0 if error else 0.0)
+        if error:
+            self.errors += 1
+            return
+        self.latency = self._ewma(self.latency, latency)
+        if ttft is not None:
+            self.ttft = self._ewma(self.ttft, ttft)
+
+    def to_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'error_rate': round(self.error_rate, 3),
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'ttft': round(self.ttft, 3) if self.ttft is not None else None,
+        }
+
+
+class RequestRace:
+    """对冲请求的竞争状态，第一个认领的客户端胜出，其它客户端的请求被取消"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claimed = threading.Event()
+        self._cancels: List[Tuple[str, Callable[[], None]]] = []
+        self.winner: Optional[str] = None
+
+    @property
+    def claimed(self) -> bool:
+        return self.winner is not None
+
+    def lost(self, name: str) -> bool:
+        """name 的请求是否已经输掉竞争"""
+        return self.winner is not None and self.winner != name
+
+    def claim(self, name: str) -> bool:
+        """认领本次请求，返回 name 是否是胜出者"""
+        with self._lock:
+            if self.winner is not None:
+                return self.winner == name
+            self.winner = name
+            cancels, self._cancels = self._cancels, []
+        self._claimed.set()
+        for other, callback in cancels:
+            if other != name:
+                self._cancel(other, callback)
+        return True
+
+    def on_cancel(self, name: str, callback: Callable[[], None]):
+        """name 输掉竞争时调用 callback（例如关闭响应），已经输掉时立即调用"""
+        with self._lock:
+            if self.winner is None:
+                self._cancels.append((name, callback))
+                return
+        if self.winner != name:
+            self._cancel(name, callback)
+
+    def wait(self, name: str, timeout: float) -> bool:
+        """最多等待 timeout 秒，name 输掉竞争时提前返回 True"""
+        if not self.claimed:
+            self._claimed.wait(timeout)
+        return self.lost(name)
+
+    @staticmethod
+    def _cancel(name: str, callback: Callable[[], None]):
+        try:
+            callback()
+        except Exception as e:
+            logger.bind(src='routing').warning('Failed to cancel hedged request', client=name, error=str(e))
+
+
+class Router:
+    """根据配置和统计数据规划请求路由"""
+
+    def __init__(self, config: RoutingConfig | dict | None = None):
+        if isinstance(config, RoutingConfig):
+            self.config = config
+        else:
+            self.config = RoutingConfig(**(config or {}))
+        self._stats: Dict[str, ClientStats] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def hedge_delay(self) -> float:
+        """对冲延迟（秒），0 表示不对冲"""
+        return self.config.hedge_delay / 1000
+
+    def get_stats(self, name: str) -> ClientStats:
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = ClientStats(self.config.ewma_alpha)
+                self._stats[name] = stats
+            return stats
+
+    def record(self, name: str, latency: float, ttft: Optional[float] = None, error: bool = False):
+        stats = self.get_stats(name)
+        with self._lock:
+            stats.observe(latency, ttft=ttft, error=error)
+
+    def healthy(self, name: str) -> bool:
+        stats = self._stats.get(name)
+        if not stats or stats.requests < self.config.min_samples:
+            return True
+        return stats.error_rate < self.config.error_threshold
+
+    def _score(self, name: str) -> tuple:
+        stats = self._stats.get(name)
+        latency = stats.latency if stats and stats.latency is not None else 0.0
+        return (not self.healthy(name), latency)
+
+    def plan(self, primary: str, available: Iterable[str], role: str | None = None) -> List[str]:
+        """返回依次尝试的客户端名称，primary 优先，除非它不健康而备用客户端健康"""
+        available = set(available)
+        chain = self.config.roles.get(role) if role else None
+        if chain is None:
+            chain = self.config.fallback
+
+        fallbacks = []
+        for name in chain:
+            if name != primary and name in available and name not in fallbacks:
+                fallbacks.append(name)
+        fallbacks.sort(key=self._score)
+
+        if not self.healthy(primary) and fallbacks and self.healthy(fallbacks[0]):
+            healthy = [name for name in fallbacks if self.healthy(name)]
+            unhealthy = [name for name in fallbacks if not self.healthy(name)]
+            return healthy + [primary] + unhealthy
+        return [primary] + fallbacks
@@ -0,0 +1,366 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+OpenAI-compatible stub LLM server
+
+本地的假 LLM 服务，用于测量 aipy 自身（非网络部分）的开销：
+- 兼容 OpenAI /v1/chat/completions，支持流式输出、usage chunk 和原生工具调用
+- 可配置首 token 延迟（ttft，毫秒）和输出速度（tps，token/秒）
+- 按脚本回放响应：请求中已有 N 条 assistant 消息时返回脚本中第 N 个响应，超出时返回最后一个
+
+用法：
+    python -m aipyapp.llm.stub --port 8000 --ttft 300 --tps 50 --script script.json
+"""
+
+import re
+import json
+import time
+import uuid
+import threading
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from .ratelimit import estimate_tokens
+
+TOKEN_PATTERN = re.compile(r'\s*\S+|\s+')
+
+DEFAULT_SCRIPT = [
+    {
+        'content': (
+            'Run a small Python program.\n\n'
+            '<!-- Block-Start: {"name": "main", "path": "main.py"} -->\n'
+            '```python\n'
+            'total = sum(range(100))\n'
+            'print("total:", total)\n'
+            '```\n'
+            '<!-- Block-End: {"name": "main"} -->\n\n'
+            '<!-- ToolCall: {"id": "call_1", "name": "Exec", "arguments": {"name": "main"}} -->\n'
+        ),
+    },
+    {
+        'content': (
+            '---\n'
+            'completed: true\n'
+            'confidence: 1.0\n'
+            '---\n'
+            'The program printed the expected total, the task is done.\n'
+        ),
+    },
+]
+
+
+class StubToolCall(BaseModel):
+    """脚本中的原生工具调用"""
+    name: str = Field(..., description="函数名称")
+    arguments: Dict[str, Any] | str = Field(default_factory=dict, description="函数参数")
+    id: Optional[str] = Field(None, description="工具调用 ID，默认自动生成")
+
+
+class StubResponse(BaseModel):
+    """脚本中的一个响应"""
+    content: str = Field('', description="响应内容，可包含 Block-Start/ToolCall 标记")
+    reason: Optional[str] = Field(None, description="推理内容（reasoning_content）")
+    tool_calls: List[StubToolCall] = Field(default_factory=list, description="原生工具调用")
+
+
+class StubConfig(BaseModel):
+    """假 LLM 服务配置"""
+    host: str = Field('127.0.0.1', description="监听地址")
+    port: int = Field(0, ge=0, description="监听端口，0 表示自动选择")
+    model: str = Field('stub', description="模型名称")
+    ttft: float = Field(0, ge=0, description="首 token 延迟（毫秒）")
+    tps: float = Field(0, ge=0, description="每秒输出 token 数，0 表示不限速")
+    chunk_tokens: int = Field(4, gt=0, description="每个流式 chunk 包含的 token 数")
+    script: List[StubResponse] = Field(
+        default_factory=lambda: [StubResponse(**item) for item in DEFAULT_SCRIPT],
+        min_length=1,
+        description="按轮次回放的响应"
+    )
+
+    @classmethod
+    def load_script(cls, path: str | Path) -> List[StubResponse]:
+        """从 JSON 文件加载脚本，文件内容为响应列表"""
+        data = json.loads(Path(path).read_text(encoding='utf-8'))
+        return [StubResponse(**item) if isinstance(item, dict) else StubResponse(content=str(item)) for item in data]
+
+
+def split_tokens(text: str) -> List[str]:
+    """把文本切分为近似的 token（单词及其前导空白）"""
+    return TOKEN_PATTERN.findall(text) if text else []
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: 'StubHTTPServer'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        self.server.log.debug(format % args)
+
+    def _send_json(self, status: int, data: Dict[str, Any]):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        config = self.server.config
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': config.model, 'object': 'model', 'owned_by': 'stub'}]})
+        else:
+            self._send_json(200, {'status': 'ok'})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'Unknown path: {self.path}', 'type': 'invalid_request_error'}})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError as e:
+            self._send_json(400, {'error': {'message': str(e), 'type': 'invalid_request_error'}})
+            return
+
+        messages = request.get('messages') or []
+        response = self.server.select(messages)
+        completion = CompletionWriter(self, request, response, prompt_tokens=estimate_tokens(messages))
+        if request.get('stream'):
+            completion.stream()
+        else:
+            completion.complete()
+
+
+class CompletionWriter:
+    """按配置的速度输出一个脚本响应"""
+
+    def __init__(self, handler: StubHandler, request: Dict[str, Any], response: StubResponse, prompt_tokens: int):
+        self.handler = handler
+        self.config = handler.server.config
+        self.request = request
+        self.response = response
+        self.prompt_tokens = prompt_tokens
+        self.id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        self.created = int(time.time())
+        self.model = request.get('model') or self.config.model
+        self.completion_tokens = 0
+        self.tool_calls = [
+            {
+                'id': tc.id or f"call_{uuid.uuid4().hex[:24]}",
+                'type': 'function',
+                'function': {
+                    'name': tc.name,
+                    'arguments': tc.arguments if isinstance(tc.arguments, str) else json.dumps(tc.arguments, ensure_ascii=False),
+                },
+            }
+            for tc in response.tool_calls
+        ]
+
+    @property
+    def finish_reason(self) -> str:
+        return 'tool_calls' if self.tool_calls else 'stop'
+
+    @property
+    def usage(self) -> Dict[str, int]:
+        return {
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': self.prompt_tokens + self.completion_tokens,
+        }
+
+    def _wait(self, tokens: int):
+        if self.config.tps and tokens:
+            time.sleep(tokens / self.config.tps)
+
+    def _chunks(self, text: str):
+        tokens = split_tokens(text)
+        size = self.config.chunk_tokens
+        for i in range(0, len(tokens), size):
+            piece = tokens[i:i + size]
+            self._wait(len(piece))
+            self.completion_tokens += len(piece)
+            yield ''.join(piece)
+
+    def _chunk(self, delta: Dict[str, Any], finish_reason: str | None = None) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'object': 'chat.completion.chunk',
+            'created': self.created,
+            'model': self.model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+        }
+
+    def _write_event(self, data: Dict[str, Any] | str):
+        payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+        body = f"data: {payload}\n\n".encode('utf-8')
+        wfile = self.handler.wfile
+        wfile.write(f"{len(body):x}\r\n".encode('ascii') + body + b"\r\n")
+        wfile.flush()
+
+    def stream(self):
+        handler = self.handler
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Cache-Control', 'no-cache')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+
+        time.sleep(self.config.ttft / 1000)
+        self._write_event(self._chunk({'role': 'assistant', 'content': ''}))
+        if self.response.reason:
+            for piece in self._chunks(self.response.reason):
+                self._write_event(self._chunk({'reasoning_content': piece}))
+        for piece in self._chunks(self.response.content):
+            self._write_event(self._chunk({'content': piece}))
+
+        for index, tool_call in enumerate(self.tool_calls):
+            function = tool_call['function']
+            self._write_event(self._chunk({'tool_calls': [{
+                'index': index,
+                'id': tool_call['id'],
+                'type': 'function',
+                'function': {'name': function['name'], 'arguments': ''},
+            }]}))
+            for piece in self._chunks(function['arguments']):
+                self._write_event(self._chunk({'tool_calls': [{'index': index, 'function': {'arguments': piece}}]}))
+
+        self._write_event(self._chunk({}, finish_reason=self.finish_reason))
+        if (self.request.get('stream_options') or {}).get('include_usage'):
+            chunk = self._chunk({})
+            chunk['choices'] = []
+            chunk['usage'] = self.usage
+            self._write_event(chunk)
+        self._write_event('[DONE]')
+        handler.wfile.write(b"0\r\n\r\n")
+        handler.wfile.flush()
+
+    def complete(self):
+        time.sleep(self.config.ttft / 1000)
+        reason = ''.join(self._chunks(self.response.reason or '')) or None
+        content = ''.join(self._chunks(self.response.content))
+        for tool_call in self.tool_calls:
+            self._wait(len(split_tokens(tool_call['function']['arguments'])))
+
+        message = {'role': 'assistant', 'content': content}
+        if reason:
+            message['reasoning_content'] = reason
+        if self.tool_calls:
+            message['tool_calls'] = self.tool_calls
+        self.handler._send_json(200, {
+            'id': self.id,
+            'object': 'chat.completion',
+            'created': self.created,
+            'model': self.model,
+            'choices': [{'index': 0, 'message': message, 'finish_reason': self.finish_reason}],
+            'usage': self.usage,
+        })
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.log = logger.bind(src='stub')
+        self.requests = 0
+        self._lock = threading.Lock()
+        super().__init__((config.host, config.port), StubHandler)
+
+    def select(self, messages: List[Dict[str, Any]]) -> StubResponse:
+        """按请求中 assistant 消息的数量选择脚本中的响应"""
+        with self._lock:
+            self.requests += 1
+        script = self.config.script
+        rounds = sum(1 for message in messages if message.get('role') == 'assistant')
+        return script[min(rounds, len(script) - 1)]
+
+
+class StubServer:
+    """在后台线程中运行的假 LLM 服务"""
+
+    def __init__(self, config: StubConfig | dict | None = None):
+        if isinstance(config, StubConfig):
+            self.config = config
+        else:
+            self.config = StubConfig(**(config or {}))
+        self._server: StubHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1] if self._server else self.config.port
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.config.host}:{self.port}/v1"
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests if self._server else 0
+
+    def client_config(self, name: str = 'stub') -> Dict[str, Any]:
+        """返回指向本服务的 LLM 配置，可直接用作 settings.llm 中的一项"""
+        return {
+            'type': 'openai',
+            'api_key': 'stub',
+            'base_url': self.base_url,
+            'model': self.config.model,
+            'default': True,
+            'enable': True,
+            'name': name,
+        }
+
+    def start(self) -> 'StubServer':
+        self._server = StubHTTPServer(self.config)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-llm', daemon=True)
+        self._thread.start()
+        self._server.log.info('Stub LLM server started', url=self.base_url)
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--ttft', type=float, default=0, help="Time to first token in milliseconds")
+    parser.add_argument('--tps', type=float, default=0, help="Output tokens per second, 0 for unlimited")
+    parser.add_argument('--script', default=None, help="JSON file with the list of scripted responses")
+    args = parser.parse_args()
+
+    config = StubConfig(host=args.host, port=args.port, ttft=args.ttft, tps=args.tps)
+    if args.script:
+        config.script = StubConfig.load_script(args.script)
+
+    server = StubServer(config).start()
+    print(f"Stub LLM server listening on {server.base_url}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
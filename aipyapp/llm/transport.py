@@ -0,0 +1,134 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Shared HTTP transport for LLM clients
+
+ClientManager 持有一个 HttpClientPool，按 base URL（scheme://host:port）和 TLS 校验
+选项复用同一个带连接池的 httpx.Client，避免每个 BaseClient 实例各自握手建连。
+异步客户端（httpx.AsyncClient）与创建它的事件循环绑定，按同样的方式复用。
+"""
+
+import asyncio
+import threading
+import importlib.util
+from typing import Dict, Tuple, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from loguru import logger
+from pydantic import BaseModel, Field
+
+
+class HttpPoolConfig(BaseModel):
+    """HTTP 连接池配置"""
+    max_connections: int = Field(100, gt=0, description="每个 base URL 的最大连接数")
+    max_keepalive_connections: int = Field(20, ge=0, description="每个 base URL 保持的空闲连接数")
+    keepalive_expiry: float = Field(60.0, ge=0, description="空闲连接保持时间（秒）")
+    connect_timeout: float = Field(10.0, gt=0, description="建立连接超时时间（秒）")
+    timeout: Optional[float] = Field(600.0, gt=0, description="默认请求超时时间（秒）")
+    http2: bool = Field(False, description="是否启用 HTTP/2（需要安装 h2）")
+
+
+class HttpClientPool:
+    """按 base URL 共享的 httpx.Client 池"""
+
+    def __init__(self, config: HttpPoolConfig | dict | None = None):
+        if isinstance(config, HttpPoolConfig):
+            self.config = config
+        else:
+            self.config = HttpPoolConfig(**(config or {}))
+        self.log = logger.bind(src='http_pool')
+        self._clients: Dict[Tuple[str, bool], httpx.Client] = {}
+        self._async_clients: Dict[Tuple[str, bool], Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop]] = {}
+        self._lock = threading.Lock()
+        self._http2 = self._check_http2()
+
+    def _check_http2(self) -> bool:
+        if not self.config.http2:
+            return False
+        if importlib.util.find_spec('h2') is None:
+            self.log.warning('HTTP/2 requested but h2 is not installed, falling back to HTTP/1.1')
+            return False
+        return True
+
+    @staticmethod
+    def _origin(url: str | None) -> str:
+        if not url:
+            return ''
+        parts = urlsplit(str(url))
+        if not parts.netloc:
+            return str(url)
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    def _client_kwargs(self, verify: bool) -> dict:
+        config = self.config
+        limits = httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        )
+        timeout = httpx.Timeout(config.timeout, connect=config.connect_timeout)
+        return {'verify': verify, 'limits': limits, 'timeout': timeout, 'http2': self._http2}
+
+    def _create_client(self, verify: bool) -> httpx.Client:
+        return httpx.Client(**self._client_kwargs(verify))
+
+    def get(self, url: str | None, verify: bool = True) -> httpx.Client:
+        """获取 url 对应的共享 httpx.Client"""
+        key = (self._origin(url), verify)
+        client = self._clients.get(key)
+        if client is not None and not client.is_closed:
+            return client
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None or client.is_closed:
+                client = self._create_client(verify)
+                self._clients[key] = client
+                self.log.info('Created pooled HTTP client', origin=key[0], verify=verify, http2=self._http2)
+        return client
+
+    def aget(self, url: str | None, verify: bool = True) -> httpx.AsyncClient:
+        """获取 url 对应的共享 httpx.AsyncClient，必须在事件循环中调用"""
+        loop = asyncio.get_running_loop()
+        key = (self._origin(url), verify)
+        with self._lock:
+            entry = self._async_clients.get(key)
+            if entry:
+                client, client_loop = entry
+                if client_loop is loop and not client.is_closed:
+                    return client
+            client = httpx.AsyncClient(**self._client_kwargs(verify))
+            self._async_clients[key] = (client, loop)
+            self.log.info('Created pooled async HTTP client', origin=key[0], verify=verify, http2=self._http2)
+        return client
+
+    def close(self):
+        """关闭所有同步连接，异步连接需要使用 aclose()"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                self.log.exception('Error closing HTTP client')
+
+    async def aclose(self):
+        """关闭当前事件循环上的异步连接以及所有同步连接"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entries = list(self._async_clients.values())
+            self._async_clients.clear()
+        for client, client_loop in entries:
+            if client_loop is not loop:
+                continue
+            try:
+                await client.aclose()
+            except Exception:
+                self.log.exception('Error closing async HTTP client')
+        self.close()
+
+    def __len__(self):
+        return len(self._clients)
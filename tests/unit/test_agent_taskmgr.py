@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for agent mode task execution
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.aipy.agent_taskmgr import AgentTaskManager, AgentTask
+
+
+def make_manager(slots: int) -> AgentTaskManager:
+    manager = AgentTaskManager.__new__(AgentTaskManager)
+    manager.agent_tasks = {}
+    manager.log = logger
+    manager.max_concurrent_tasks = slots
+    manager._slots = asyncio.Semaphore(slots)
+    return manager
+
+
+class TestAgentTaskManager:
+    """Agent 任务并发测试"""
+
+    @pytest.mark.unit
+    async def test_concurrency_is_bounded(self):
+        """同时执行的任务数不超过 max_concurrent_tasks"""
+        manager = make_manager(2)
+        running = []
+        peak = 0
+
+        async def run_task(agent_task):
+            nonlocal peak
+            running.append(agent_task.task_id)
+            peak = max(peak, len(running))
+            await asyncio.sleep(0.01)
+            running.remove(agent_task.task_id)
+
+        manager._run_task = run_task
+        for i in range(5):
+            manager.agent_tasks[str(i)] = AgentTask(str(i), 'go', None, None)
+
+        results = await asyncio.gather(*(manager.execute_task(str(i)) for i in range(5)))
+        assert [r['status'] for r in results] == ['completed'] * 5
+        assert peak == 2
+
+    @pytest.mark.unit
+    async def test_cancelled_while_waiting(self):
+        """等待名额时被取消的任务不再执行"""
+        manager = make_manager(1)
+        started = []
+
+        async def run_task(agent_task):
+            started.append(agent_task.task_id)
+            await asyncio.sleep(0.01)
+
+        manager._run_task = run_task
+        for task_id in ('a', 'b'):
+            manager.agent_tasks[task_id] = AgentTask(task_id, 'go', None, None)
+
+        first = asyncio.create_task(manager.execute_task('a'))
+        second = asyncio.create_task(manager.execute_task('b'))
+        await asyncio.sleep(0)
+        await manager.cancel_task('b')
+        await asyncio.gather(first, second)
+        assert started == ['a']
+        assert second.result()['status'] == 'cancelled'
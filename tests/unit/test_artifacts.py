@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for large tool output artifacts
+"""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.aipy.artifacts import ArtifactStore, ArtifactError
+from aipyapp.aipy.toolcalls import (
+    ToolCall, ToolName, ToolCallProcessor, ExecToolResult, MCPToolResult, ArtifactToolArgs,
+)
+from aipyapp.exec import PythonResult
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(tmp_path / 'artifacts', {'threshold': 1000, 'excerpt': 100})
+
+
+def make_output(lines=500):
+    return '\n'.join(f'row {i} value={i * i}' for i in range(lines))
+
+
+class TestArtifactStore:
+    """Artifact 存储测试"""
+
+    @pytest.mark.unit
+    def test_small_output_unchanged(self, store):
+        assert store.spill('short') == 'short'
+        assert store.spill(None) is None
+        assert not store.path.exists()
+
+    @pytest.mark.unit
+    def test_spill_keeps_head_tail_and_handle(self, store):
+        text = make_output()
+        excerpt = store.spill(text)
+        id = store.save(text)
+        assert len(excerpt) < 500
+        assert excerpt.startswith(text[:100]) and excerpt.endswith(text[-100:])
+        assert id in excerpt
+        assert (store.path / f'{id}.txt').read_text() == text
+
+    @pytest.mark.unit
+    def test_read_and_grep(self, store):
+        id = store.save(make_output())
+        lines, total = store.read(id, offset=10, limit=2)
+        assert total == 500
+        assert lines == [(11, 'row 10 value=100'), (12, 'row 11 value=121')]
+
+        matches, count = store.grep(id, r'^row 4\d\d ', offset=1, limit=2)
+        assert count == 100
+        assert matches == [(402, 'row 401 value=160801'), (403, 'row 402 value=161604')]
+
+    @pytest.mark.unit
+    def test_invalid_id(self, store):
+        with pytest.raises(ArtifactError):
+            store.read('../../etc/passwd')
+        with pytest.raises(ArtifactError):
+            store.read('0123456789ab')
+
+
+class TestArtifactTool:
+    """工具结果落盘和 Artifact 工具测试"""
+
+    @pytest.mark.unit
+    def test_exec_and_mcp_results_spilled(self, store):
+        processor = ToolCallProcessor()
+        text = make_output()
+        result = ExecToolResult(block_name='main', result=PythonResult(stdout=text, stderr='warning'))
+        processor._spill(store, result)
+        assert len(result.result.stdout) < 500
+        assert result.result.stderr == 'warning'
+
+        result = MCPToolResult(result={'content': [{'type': 'text', 'text': text}], 'isError': False})
+        processor._spill(store, result)
+        assert result.result['isError'] is False
+        assert len(result.result['content'][0]['text']) < 500
+
+    @pytest.mark.unit
+    def test_artifact_tool_call(self, store):
+        id = store.save(make_output())
+        tool_call = ToolCall.model_validate({
+            'id': 'call_1', 'name': 'Artifact', 'arguments': {'id': id, 'pattern': 'row 42 ', 'limit': 5}
+        })
+        assert isinstance(tool_call.arguments, ArtifactToolArgs)
+
+        task = SimpleNamespace(artifacts=store, emit=lambda *args, **kwargs: None)
+        result = ToolCallProcessor().call_tool(task, tool_call)
+        assert result.name == ToolName.ARTIFACT
+        assert result.result.total == 1
+        assert result.result.lines == ['43: row 42 value=1764']
+
+        tool_call.arguments.id = 'ffffffffffff'
+        result = ToolCallProcessor().call_tool(task, tool_call)
+        assert result.result.error is not None
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the image attachment store
+"""
+
+import sys
+import json
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.aipy.attachments import AttachmentStore, AttachmentError, create_attachment_store
+from aipyapp.aipy.multimodal import MMContent
+from aipyapp.aipy.chat import MessageStorage
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AttachmentStore({'path': str(tmp_path / 'attachments'), 'max_size': 64})
+
+
+@pytest.fixture
+def screenshot(tmp_path):
+    path = tmp_path / 'screen.png'
+    Image.new('RGB', (640, 320), (200, 30, 30)).save(path)
+    return path
+
+
+class TestAttachmentStore:
+    """图片附件存储测试"""
+
+    @pytest.mark.unit
+    def test_downscale_and_dedupe(self, store, screenshot):
+        ref = store.add_image(screenshot)
+        assert ref.startswith('attachment:') and ref.endswith('.png')
+        assert store.add_image(screenshot) == ref
+
+        data_url = store.resolve(ref)
+        assert data_url.startswith('data:image/png;base64,')
+        files = list(store.path.rglob('*.png'))
+        assert len(files) == 1
+        with Image.open(files[0]) as img:
+            assert img.size == (64, 32)
+
+        # 不同的尺寸限制单独保存
+        assert store.add_image(screenshot, max_size=0) != ref
+
+    @pytest.mark.unit
+    def test_resolve(self, store):
+        assert store.resolve('https://example.com/a.png') == 'https://example.com/a.png'
+        with pytest.raises(AttachmentError):
+            store.resolve('attachment:missing.png')
+        with pytest.raises(AttachmentError):
+            store.resolve('attachment:../secret.png')
+
+    @pytest.mark.unit
+    def test_disabled_by_default(self):
+        assert create_attachment_store(None) is None
+        assert create_attachment_store({'enable': True}) is not None
+
+    @pytest.mark.unit
+    def test_message_keeps_reference(self, store, screenshot):
+        message = MMContent(f'What is this? @{screenshot}', attachments=store).message
+        storage = MessageStorage()
+        storage.use_attachments(store)
+        chat_message = storage.store(message)
+
+        saved = storage.model_dump_json()
+        assert 'base64' not in saved and 'attachment:' in saved
+
+        wire = storage.to_wire(chat_message)
+        assert wire['content'][0] == {'type': 'text', 'text': 'What is this?'}
+        assert wire['content'][1]['image_url']['url'].startswith('data:image/png;base64,')
+        json.dumps(wire)
+
+    @pytest.mark.unit
+    def test_missing_attachment_in_request(self, store, screenshot):
+        message = MMContent(f'@{screenshot}', attachments=store).message
+        for file in store.path.rglob('*.png'):
+            file.unlink()
+        storage = MessageStorage()
+        storage.use_attachments(store)
+        wire = storage.to_wire(storage.store(message))
+        assert wire['content'][0]['type'] == 'text'
+
+    @pytest.mark.unit
+    def test_data_url_lru(self, tmp_path, screenshot):
+        store = AttachmentStore({'path': str(tmp_path / 'attachments'), 'cache_size': 1})
+        first = store.add_image(screenshot)
+        second = store.add_image(screenshot, max_size=0)
+        message = MMContent(f'@{screenshot}', attachments=store).message
+        storage = MessageStorage()
+        storage.use_attachments(store)
+        chat_message = storage.store(message)
+
+        # 消息的字典缓存中不保存 data URL
+        storage.to_wire(chat_message)
+        assert not storage._wire
+        store.resolve(second)
+        assert list(store._cache) == [second[len('attachment:'):]]
+        assert store.resolve(first) == storage.to_wire(chat_message)['content'][0]['image_url']['url']
+        assert len(store._cache) == 1
+
+    @pytest.mark.unit
+    def test_export_inlines_attachments(self, tmp_path, store, screenshot):
+        from aipyapp.aipy.task import TaskData
+        from aipyapp.aipy.journal import export_task_json
+
+        data = TaskData()
+        data.message_storage.store(MMContent(f'@{screenshot}', attachments=store).message)
+        (tmp_path / 'task').mkdir()
+        (tmp_path / 'task' / 'task.json').write_text(data.model_dump_json(), encoding='utf-8')
+
+        output = export_task_json(tmp_path / 'task' / 'task.json', tmp_path / 'export.json', store)
+        exported = output.read_text(encoding='utf-8')
+        assert 'attachment:' not in exported and 'data:image/png;base64,' in exported
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the persistent task catalog
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.aipy.catalog import TaskCatalog, create_task_catalog
+from aipyapp.cli.command.builtin.cmd_task import TaskCommand
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = TaskCatalog(tmp_path / 'tasks.db')
+    yield catalog
+    catalog.close()
+
+
+def start(catalog, task_id, instruction, path, parent_id=None, start_time=1.0):
+    catalog.task_started(task_id, path=path, file='task.json', instruction=instruction,
+                         client='deepseek', parent_id=parent_id, start_time=start_time)
+
+
+class TestTaskCatalog:
+    """任务目录测试"""
+
+    @pytest.mark.unit
+    def test_create(self, tmp_path):
+        assert create_task_catalog({'enable': False}) is None
+        assert create_task_catalog({'path': str(tmp_path / 't.db')}) is not None
+
+    @pytest.mark.unit
+    def test_task_lifecycle(self, catalog):
+        start(catalog, 't1', 'first task', '/work/t1')
+        summary = {'input_tokens': 10, 'output_tokens': 5, 'total_tokens': 15, 'elapsed_time': 3}
+        catalog.step_completed('t1', summary, 'reply one')
+        catalog.step_completed('t1', summary, 'reply two')
+
+        record = catalog.get('t1')
+        assert record['status'] == 'running'
+        assert (record['steps'], record['total_tokens'], record['elapsed']) == (2, 30, 6)
+        assert record['client'] == 'deepseek'
+
+        catalog.task_completed('t1', '/work/first-task')
+        record = catalog.get('t1')
+        assert record['status'] == 'completed' and record['path'] == '/work/first-task'
+        # 最后的回复进入全文索引，之前的回复被替换
+        assert [r['id'] for r in catalog.search('reply two')] == ['t1']
+        assert catalog.search('reply one') == []
+
+    @pytest.mark.unit
+    def test_rename_moves_subtasks(self, catalog):
+        start(catalog, 'root', 'root task', os.path.join('/work', 'root'))
+        start(catalog, 'sub', 'sub task', os.path.join('/work', 'root', 'sub'), parent_id='root')
+        start(catalog, 'other', 'other task', os.path.join('/work', 'root2'))
+        catalog.task_completed('sub', os.path.join('/work', 'root', 'sub'))
+        catalog.task_completed('root', os.path.join('/work', 'renamed'))
+
+        assert catalog.get('sub')['path'] == os.path.join('/work', 'renamed', 'sub')
+        assert catalog.get('other')['path'] == os.path.join('/work', 'root2')
+        # 默认只列出根任务
+        assert {r['id'] for r in catalog.list()} == {'root', 'other'}
+        assert [r['id'] for r in catalog.list(parent_id='root')] == ['sub']
+
+    @pytest.mark.unit
+    def test_search(self, catalog):
+        start(catalog, 'a', '分析销售数据并生成图表', '/work/a')
+        start(catalog, 'b', 'download the report', '/work/b')
+        catalog.step_completed('b', {}, 'Saved report as 100% complete_file.pdf')
+
+        assert [r['id'] for r in catalog.search('销售数据')] == ['a']
+        # 少于 3 个字符时使用 LIKE
+        assert [r['id'] for r in catalog.search('图表')] == ['a']
+        assert [r['id'] for r in catalog.search('"report')] == []
+        assert [r['id'] for r in catalog.search('100%')] == ['b']
+        assert [r['id'] for r in catalog.search('REPORT')] == ['b']
+
+    @pytest.mark.unit
+    def test_backfill_on_step(self, catalog):
+        # 启用任务目录之前开始的任务在 Step 结束时补建记录
+        catalog.step_completed('old', {'total_tokens': 7}, 'done', path='/work/old', file='task.bin',
+                               instruction='old task', client='openai')
+        record = catalog.get('old')
+        assert (record['instruction'], record['file'], record['steps'], record['total_tokens']) == ('old task', 'task.bin', 1, 7)
+        assert [r['path'] for r in catalog.find_path('/work/o')] == ['/work/old']
+
+    @pytest.mark.unit
+    def test_path_completion_relative(self, catalog, tmp_path, monkeypatch):
+        work = tmp_path / 'work'
+        start(catalog, 'a', 'task a', str(work / 'report-2024'))
+        start(catalog, 'b', 'task b', str(tmp_path / 'elsewhere'))
+        monkeypatch.chdir(tmp_path)
+
+        def paths(partial):
+            return [path for path, _ in TaskCommand()._catalog_paths(catalog, partial)]
+
+        expected = os.path.join('report-2024', 'task.json')
+        assert paths('work/') == ['work/' + expected]
+        assert paths('./work/rep') == ['./work/' + expected]
+        assert paths('work/x') == []
+        assert paths(str(work) + '/') == [str(work / expected)]
+        # 没有输入时当前目录下的任务使用相对路径
+        assert sorted(paths('')) == [os.path.join('elsewhere', 'task.json'), os.path.join('work', expected)]
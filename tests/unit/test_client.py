@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for streaming response processing
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.aipy.client import Client, LineReceiver, StreamProcessor
+from aipyapp.llm import AIMessage
+from aipyapp.llm.routing import Router
+
+
+class FakeTask:
+    """记录事件的任务"""
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, **kwargs):
+        self.events.append((event, kwargs))
+
+    def stream_lines(self):
+        return [line for event, kwargs in self.events if event == 'stream' for line in kwargs['lines']]
+
+
+class TestLineReceiver:
+    """行组装测试"""
+
+    @pytest.mark.unit
+    def test_feed_splits_lines_across_chunks(self):
+        """跨数据块的行被正确组装，空行被忽略"""
+        lr = LineReceiver()
+        assert lr.feed('hel') == []
+        assert lr.feed('lo\nwor') == ['hello']
+        assert lr.feed('ld\n\nfoo\nba') == ['world', 'foo']
+        assert lr.buffer == 'ba'
+        assert not lr.empty()
+        assert lr.done() == 'ba'
+        assert lr.content == 'hello\nworld\nfoo\nba'
+        assert lr.buffer == ''
+
+    @pytest.mark.unit
+    def test_long_single_line_is_linear(self):
+        """200KB 单行响应按小块输入时是线性时间"""
+        lr = LineReceiver()
+        chunk = 'x' * 20
+        start = time.perf_counter()
+        for _ in range(10000):
+            lr.feed(chunk)
+        lr.feed('\n')
+        assert time.perf_counter() - start < 1.0
+        assert len(lr[0]) == 200000
+
+
+class TestStreamProcessor:
+    """流式事件合并测试"""
+
+    @pytest.mark.unit
+    def test_events_are_coalesced(self):
+        """大量短行合并为少量 stream 事件，内容和顺序不变"""
+        task = FakeTask()
+        with StreamProcessor(task, 'test') as sp:
+            for i in range(1000):
+                sp.process_chunk(f'line {i}\n')
+        stream_events = [e for e, _ in task.events if e == 'stream']
+        assert len(stream_events) <= 1000 // StreamProcessor.COALESCE_LINES + 2
+        assert task.stream_lines() == [f'line {i}' for i in range(1000)]
+        assert task.events[-1][0] == 'stream_completed'
+
+    @pytest.mark.unit
+    def test_reason_is_flushed_before_content(self):
+        """思考内容在正文之前发送"""
+        task = FakeTask()
+        with StreamProcessor(task, 'test') as sp:
+            sp.process_chunk('thinking\nmore', reason=True)
+            sp.process_chunk('answer')
+        reasons = [kwargs['reason'] for event, kwargs in task.events if event == 'stream']
+        assert reasons == sorted(reasons, reverse=True)
+        assert task.stream_lines() == ['thinking', 'more', '\n\n----\n\n', 'answer']
+        assert sp.content == 'answer'
+        assert sp.reason == 'thinking\nmore'
+
+
+class FakeLLM:
+    """按给定延迟返回的 LLM 客户端"""
+
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+        self.finished = False
+
+    async def acall(self, messages, stream_processor=None, **kwargs):
+        try:
+            await asyncio.sleep(self.delay)
+            return AIMessage(content=self.name)
+        finally:
+            self.finished = True
+
+
+class TestHedgedCall:
+    """对冲请求测试"""
+
+    @pytest.mark.unit
+    async def test_loser_is_awaited(self):
+        """胜出后等待被取消的请求结束，不留下悬挂的任务"""
+        client = Client.__new__(Client)
+        client.task = FakeTask()
+        client.log = logger
+        client.manager = type('Manager', (), {'router': Router()})()
+        primary, secondary = FakeLLM('primary', 10), FakeLLM('secondary', 0.01)
+        winner, msg, _ = await client._ahedged_call(primary, secondary, [], {}, 0.01)
+        assert (winner, msg.content) == (secondary, 'secondary')
+        assert primary.finished
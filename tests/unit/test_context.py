@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for context management
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.llm import UserMessage, AIMessage, SystemMessage, ToolMessage
+from aipyapp.llm.base import TextItem, ImageItem, ImageUrl
+from aipyapp.aipy.chat import MessageStorage
+from aipyapp.aipy import context as context_module
+from aipyapp.aipy.context import (
+    DefaultTokenEstimator,
+    BPETokenEstimator,
+    CachedTokenEstimator,
+    ContextManager,
+    ContextData,
+    ContextConfig,
+    ContextStrategy,
+    ContextStrategyFactory,
+    KnapsackStrategy,
+    RetrievalStrategy,
+    IMAGE_TOKENS,
+    MESSAGE_OVERHEAD,
+)
+from aipyapp.aipy.summarizer import BackgroundSummarizer
+from aipyapp.aipy.step import Step, StepData
+from aipyapp.aipy.retrieval import BM25Index, RetrievalIndex, HistoryRetriever, tokenize
+from aipyapp.aipy.blocks import CodeBlocks, CodeBlock
+
+
+class CountingEstimator(DefaultTokenEstimator):
+    """记录调用次数的估算器"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def estimate(self, message):
+        self.calls += 1
+        return super().estimate(message)
+
+
+class TestTokenEstimator:
+    """Token 估算测试"""
+
+    @pytest.mark.unit
+    def test_cjk_counts_per_character(self):
+        """中文按字符计数，英文按 4 个字符一个 token"""
+        storage = MessageStorage()
+        estimator = DefaultTokenEstimator()
+        assert estimator.estimate(storage.store(UserMessage(content='你好世界'))) == 4 + MESSAGE_OVERHEAD
+        assert estimator.estimate(storage.store(UserMessage(content='a' * 40))) == 10 + MESSAGE_OVERHEAD
+
+    @pytest.mark.unit
+    def test_images_and_tool_calls(self):
+        """图片按固定值计数，工具调用参数计入 token"""
+        storage = MessageStorage()
+        estimator = DefaultTokenEstimator()
+        msg = UserMessage(content=[
+            TextItem(text='abcd'),
+            ImageItem(image_url=ImageUrl(url='data:image/png;base64,' + 'A' * 10000)),
+        ])
+        assert estimator.estimate(storage.store(msg)) == 1 + IMAGE_TOKENS + MESSAGE_OVERHEAD
+
+        tool_call = {'id': '1', 'type': 'function', 'function': {'name': 'run', 'arguments': 'x' * 400}}
+        ai = storage.store(AIMessage(content='', tool_calls=[tool_call]))
+        assert estimator.estimate(ai) > 100
+
+    @pytest.mark.unit
+    def test_bpe_falls_back_without_tiktoken(self, monkeypatch):
+        """tiktoken 不可用时回退到默认估算"""
+        monkeypatch.setitem(sys.modules, 'tiktoken', None)
+        monkeypatch.setattr(context_module, '_ENCODINGS', {})
+        storage = MessageStorage()
+        message = storage.store(UserMessage(content='hello world, 你好'))
+        assert BPETokenEstimator().estimate(message) == DefaultTokenEstimator().estimate(message)
+        # 加载失败也只尝试一次，其它估算器直接回退
+        assert context_module._ENCODINGS == {'cl100k_base': None}
+        monkeypatch.delitem(sys.modules, 'tiktoken')
+        assert BPETokenEstimator().estimate(message) == DefaultTokenEstimator().estimate(message)
+
+    @pytest.mark.unit
+    def test_estimates_are_memoized_by_id(self):
+        """删除和清理消息时不重复估算"""
+        storage = MessageStorage()
+        inner = CountingEstimator()
+        manager = ContextManager(storage, ContextData(), estimator=CachedTokenEstimator(inner))
+        messages = [storage.store(UserMessage(content=f'message {i}')) for i in range(6)]
+        for message in messages:
+            manager.add_message(message)
+        assert inner.calls == 6
+
+        manager.delete_messages_by_ids([messages[3].id])
+        manager.clear()
+        assert inner.calls == 6
+
+    @pytest.mark.unit
+    def test_cache_is_bounded(self):
+        """超过 max_size 时淘汰最久未用的估算结果"""
+        storage = MessageStorage()
+        inner = CountingEstimator()
+        estimator = CachedTokenEstimator(inner, max_size=2)
+        a, b, c = [storage.store(UserMessage(content=f'message {i}')) for i in range(3)]
+        estimator.estimate(a)
+        estimator.estimate(b)
+        estimator.estimate(a)
+        estimator.estimate(c)
+        assert list(estimator._cache) == [a.id, c.id]
+        estimator.estimate(a)
+        assert inner.calls == 3
+
+
+class TestTokenLedger:
+    """增量 token 账本测试"""
+
+    def _manager(self, count=8):
+        storage = MessageStorage()
+        inner = CountingEstimator()
+        manager = ContextManager(storage, ContextData(), estimator=inner)
+        messages = [storage.store(UserMessage(content=f'message {i} ' + 'x' * i * 10)) for i in range(count)]
+        for message in messages:
+            manager.add_message(message)
+        return manager, inner, messages
+
+    def _expected(self, manager):
+        return sum(DefaultTokenEstimator().estimate(msg) for msg in manager.messages)
+
+    @pytest.mark.unit
+    def test_delete_updates_running_sum(self):
+        """删除消息不重新估算，总数与剩余消息的估算之和一致"""
+        manager, inner, messages = self._manager()
+        calls = inner.calls
+
+        deleted, saved = manager.delete_messages_by_ids({messages[2].id, messages[5].id})
+        assert deleted == 2
+        assert saved == sum(DefaultTokenEstimator().estimate(messages[i]) for i in (2, 5))
+        assert manager.total_tokens == self._expected(manager)
+        assert inner.calls == calls
+
+    @pytest.mark.unit
+    def test_first_user_message_is_protected(self):
+        manager, _, messages = self._manager()
+        deleted, _ = manager.delete_messages_by_ids([messages[0].id])
+        assert deleted == 0
+        assert manager.messages[0] is messages[0]
+
+    @pytest.mark.unit
+    def test_duplicate_messages_are_counted_per_occurrence(self):
+        manager, _, messages = self._manager()
+        manager.add_message(messages[3])
+        assert manager.data.estimated_tokens == self._expected(manager)
+
+        deleted, _ = manager.delete_messages_by_ids([messages[3].id])
+        assert deleted == 2
+        assert manager.total_tokens == self._expected(manager)
+
+    @pytest.mark.unit
+    def test_clear_rebuild_and_reload(self):
+        manager, _, messages = self._manager()
+        manager.clear()
+        assert manager.messages == [messages[0], messages[-1]]
+        assert manager.total_tokens == self._expected(manager)
+
+        manager.rebuild(messages[:4])
+        assert manager.total_tokens == self._expected(manager)
+
+        # 从文件加载的 ContextData 没有账本，创建 ContextManager 时重建
+        data = ContextData.model_validate_json(manager.data.model_dump_json(),
+                                               context={'message_storage': manager.message_store})
+        reloaded = ContextManager(manager.message_store, data)
+        assert reloaded.data.estimated_tokens == self._expected(manager)
+
+
+class TestWireCache:
+    """消息发送格式缓存测试"""
+
+    @pytest.mark.unit
+    def test_wire_dict_is_memoized_by_id(self):
+        storage = MessageStorage()
+        tool_call = {'id': '1', 'type': 'function', 'function': {'name': 'run', 'arguments': '{}'}}
+        message = storage.store(AIMessage(content='hi', tool_calls=[tool_call]))
+
+        wire = storage.to_wire(message)
+        assert wire == message.dict()
+        assert storage.to_wire(storage.store(AIMessage(content='hi', tool_calls=[tool_call]))) is wire
+
+    @pytest.mark.unit
+    def test_wire_dict_invalidation(self):
+        storage = MessageStorage()
+        message = storage.store(UserMessage(content='hello'))
+        wire = storage.to_wire(message)
+
+        message.message.content = 'changed'
+        storage.invalidate(message.id)
+        assert storage.to_wire(message)['content'] == 'changed'
+
+        # 存储中的消息对象被替换时自动失效
+        storage.messages[message.id] = UserMessage(content='replaced')
+        assert storage.to_wire(storage.store(UserMessage(content='hello')))['content'] == 'replaced'
+        assert wire['content'] == 'hello'
+
+
+class TestKnapsackStrategy:
+    """背包压缩策略测试"""
+
+    def _context(self, rounds=20):
+        storage = MessageStorage()
+        manager = ContextManager(storage, ContextData(), ContextConfig(strategy='knapsack', max_tokens=100000))
+        manager.add_message(storage.store(SystemMessage(content='system prompt')))
+        manager.add_message(storage.store(UserMessage(content='task instruction')))
+        for i in range(rounds):
+            tool_call = {'id': f'call_{i}', 'type': 'function', 'function': {'name': 'run', 'arguments': '{}'}}
+            manager.add_message(storage.store(AIMessage(content=f'round {i}', tool_calls=[tool_call])))
+            manager.add_message(storage.store(ToolMessage(tool_call_id=f'call_{i}', content='output ' * (10 + i * 7 % 50))))
+        return manager
+
+    @pytest.mark.unit
+    def test_registered(self):
+        strategy = ContextStrategyFactory.create(ContextStrategy.KNAPSACK, MessageStorage(), ContextConfig(),
+                                                 DefaultTokenEstimator())
+        assert isinstance(strategy, KnapsackStrategy)
+
+    @pytest.mark.unit
+    def test_keeps_tool_pairs_within_budget(self):
+        manager = self._context()
+        manager.config.max_tokens = 500
+        manager.compress()
+
+        messages = manager.messages
+        assert manager.total_tokens <= 500
+        assert [m.content for m in messages[:2]] == ['system prompt', 'task instruction']
+        assert messages[-1].message.tool_call_id == 'call_19'
+
+        call_ids = [m.message.tool_calls[0]['id'] for m in messages if m.role == 'assistant']
+        result_ids = [m.message.tool_call_id for m in messages if m.role == 'tool']
+        assert call_ids == result_ids
+        assert len(call_ids) < 20
+        # 保持原始顺序
+        assert call_ids == sorted(call_ids, key=lambda x: int(x.split('_')[1]))
+
+    @pytest.mark.unit
+    def test_large_context(self):
+        """上万条消息时压缩仍然很快"""
+        import time
+        manager = self._context(rounds=5000)
+        manager.config.max_tokens = 20000
+        start = time.perf_counter()
+        manager.compress()
+        assert time.perf_counter() - start < 2
+        assert manager.total_tokens <= 20000
+
+
+class FakeSummaryClient:
+    """返回固定摘要的 LLM 客户端"""
+    name = 'fake'
+
+    def __init__(self):
+        self.requests = []
+
+    def usable(self):
+        return True
+
+    def __call__(self, messages, stream_processor=None):
+        self.requests.append(messages)
+        return AIMessage(content='summary of earlier work', usage={'input_tokens': 900, 'output_tokens': 40, 'total_tokens': 940})
+
+
+class FakeSummaryTask:
+    def __init__(self, storage):
+        self.task_id = 'test'
+        self.message_storage = storage
+        self.llm = FakeSummaryClient()
+        self.client = type('Client', (), {'current': self.llm})()
+        self.client_manager = type('ClientManager', (), {'get_client': lambda self, name: None})()
+        self.prompts = type('Prompts', (), {'get_prompt': lambda self, name: 'compact please'})()
+        self.steps = []
+        self.context_manager = None
+
+
+class TestBackgroundSummarizer:
+    """后台预摘要测试"""
+
+    def _context(self, rounds=10):
+        storage = MessageStorage()
+        manager = ContextManager(storage, ContextData(), ContextConfig(max_tokens=100000, summary_threshold=0.6))
+        manager.add_message(storage.store(SystemMessage(content='system prompt')))
+        for i in range(rounds):
+            manager.add_message(storage.store(UserMessage(content=f'question {i} ' * 20)))
+            manager.add_message(storage.store(AIMessage(content=f'answer {i} ' * 20)))
+        task = FakeSummaryTask(storage)
+        manager.summarizer = BackgroundSummarizer(task)
+        return manager, task
+
+    @pytest.mark.unit
+    def test_below_threshold(self):
+        manager, task = self._context()
+        assert not manager.summarizer.maybe_start(manager)
+        assert not task.llm.requests
+
+    @pytest.mark.unit
+    def test_disabled_by_default(self):
+        manager, task = self._context()
+        manager.config.summary_threshold = ContextConfig().summary_threshold
+        manager.config.max_tokens = manager.total_tokens + 100
+        assert not manager.summarizer.maybe_start(manager)
+
+    @pytest.mark.unit
+    def test_refresh_only_when_tail_grows(self):
+        """摘要之后新增的消息较少时继续使用已有的摘要"""
+        manager, task = self._context()
+        manager.config.max_tokens = manager.total_tokens * 8 // 5
+        assert manager.summarizer.maybe_start(manager)
+        manager.summarizer.wait(5)
+
+        storage = manager.message_store
+        manager.add_message(storage.store(UserMessage(content='next question')))
+        manager.add_message(storage.store(AIMessage(content='next answer')))
+        assert not manager.summarizer.maybe_start(manager)
+        assert len(task.llm.requests) == 1
+
+        for i in range(10):
+            manager.add_message(storage.store(UserMessage(content=f'more question {i} ' * 20)))
+        assert manager.summarizer.maybe_start(manager)
+        manager.summarizer.wait(5)
+        assert len(task.llm.requests) == 2
+
+    @pytest.mark.unit
+    def test_summary_replaces_prefix(self):
+        manager, task = self._context()
+        manager.config.max_tokens = manager.total_tokens + 100
+        assert manager.summarizer.maybe_start(manager)
+        assert manager.summarizer.wait(5)
+        assert task.llm.requests[0][-1]['content'] == 'compact please'
+
+        # 摘要生成后新增的消息保留在摘要之后
+        manager.add_message(manager.message_store.store(UserMessage(content='latest question ' * 40)))
+        messages = manager.get_messages()
+        assert manager.total_tokens <= manager.config.max_tokens
+        assert [m.role for m in messages] == ['system', 'user', 'assistant', 'user']
+        assert 'summary of earlier work' in messages[1].content
+        assert messages[-1].content.startswith('latest question')
+        assert not manager.summarizer.ready
+
+    @pytest.mark.unit
+    def test_summary_usage_added_to_step(self):
+        manager, task = self._context()
+        storage = manager.message_store
+        step = Step(task, StepData(initial_instruction=storage.store(UserMessage(content='go')), instruction='go'))
+        task.steps.append(step)
+        manager.config.max_tokens = manager.total_tokens + 100
+        manager.summarizer.maybe_start(manager)
+        manager.summarizer.wait(5)
+
+        manager.add_message(storage.store(UserMessage(content='latest question ' * 40)))
+        manager.get_messages()
+        step.data.end_time = step.data.start_time + 1
+        assert step.data.extra_usage['total_tokens'] == 940
+        assert step.get_summary()['input_tokens'] == 900
+        # 重新加载的 Step 仍然包含摘要的用量
+        assert Step(task, StepData.model_validate(step.data.model_dump())).get_summary()['output_tokens'] == 40
+
+    @pytest.mark.unit
+    def test_discard_when_context_changed(self):
+        manager, task = self._context()
+        manager.config.max_tokens = manager.total_tokens + 100
+        manager.summarizer.maybe_start(manager)
+        manager.summarizer.wait(5)
+
+        # 被摘要的消息不再位于开头
+        messages = manager.messages
+        inserted = manager.message_store.store(UserMessage(content='inserted'))
+        manager.rebuild(messages[:2] + [inserted] + messages[2:])
+        assert manager.summarizer.take(manager.messages, manager.message_store) is None
+
+
+class TestRetrievalStrategy:
+    """检索压缩策略测试"""
+
+    def _context(self, rounds=30):
+        storage = MessageStorage()
+        blocks = CodeBlocks()
+        index = RetrievalIndex()
+        manager = ContextManager(storage, ContextData(), ContextConfig(strategy='retrieval', max_tokens=100000))
+        manager.set_retriever(HistoryRetriever(index, storage, blocks))
+        manager.add_message(storage.store(SystemMessage(content='system prompt')))
+        manager.add_message(storage.store(UserMessage(content='analyze the sales data')))
+        for i in range(rounds):
+            fact = 'the database password is stored in vault_secret_path' if i == 3 else f'step {i} finished normally'
+            tool_call = {'id': f'call_{i}', 'type': 'function', 'function': {'name': 'run', 'arguments': '{}'}}
+            manager.add_message(storage.store(AIMessage(content=f'running step {i}', tool_calls=[tool_call])))
+            manager.add_message(storage.store(ToolMessage(tool_call_id=f'call_{i}', content=fact + ' filler' * 20)))
+        blocks.add_block(CodeBlock(name='load_csv', lang='python', code='import pandas\ndf = pandas.read_csv("sales_2024.csv")'))
+        return manager, index
+
+    @pytest.mark.unit
+    def test_tokenize(self):
+        assert tokenize('Read sales_2024.csv, 数据分析') == ['read', 'sales_2024', 'csv', '数据', '据分', '分析']
+
+    @pytest.mark.unit
+    def test_bm25_ranking(self):
+        index = BM25Index()
+        index.add('a', 'python pandas dataframe')
+        index.add('b', 'the weather is nice today')
+        index.add('c', 'pandas pandas groupby')
+        assert not index.add('a', 'duplicate')
+        assert [doc for doc, _ in index.search('pandas groupby', 3)] == ['c', 'a']
+        assert index.search('pandas', 3, exclude={'a', 'c'}) == []
+
+    @pytest.mark.unit
+    def test_update_scans_only_new_messages(self):
+        """第一次索引全部消息（包括延迟解码的消息），之后只检查新增的消息"""
+        storage = MessageStorage()
+        old = AIMessage(content='old deferred message')
+        storage.defer(['old'], lambda: {'old': old})
+        storage.store(UserMessage(content='first message'))
+        retriever = HistoryRetriever(RetrievalIndex(), storage, CodeBlocks())
+        assert retriever.update() == 2
+        assert 'msg:old' in retriever.index.bm25
+
+        # 不经过 store() 放入的消息不会再被扫描到
+        storage.messages['skipped'] = UserMessage(content='not scanned')
+        storage.store(UserMessage(content='second message'))
+        assert retriever.update() == 1
+        assert 'msg:skipped' not in retriever.index.bm25
+        assert retriever.update() == 0
+
+    @pytest.mark.unit
+    def test_retrieves_dropped_fact(self):
+        manager, index = self._context()
+        storage = manager.message_store
+        manager.add_message(storage.store(UserMessage(content='where is the database password stored?')))
+        manager.config.max_tokens = 800
+        assert isinstance(manager.compressor.strategy, RetrievalStrategy)
+        manager.compress()
+
+        messages = manager.messages
+        assert manager.total_tokens <= 800
+        assert [m.content for m in messages[:2]] == ['system prompt', 'analyze the sales data']
+        assert messages[2].content.startswith('<retrieved_context>')
+        assert 'vault_secret_path' in messages[2].content
+        assert messages[-1].content == 'where is the database password stored?'
+        # 工具调用和结果成对保留
+        call_ids = [m.message.tool_calls[0]['id'] for m in messages if m.role == 'assistant']
+        result_ids = [m.message.tool_call_id for m in messages if m.role == 'tool']
+        assert call_ids == result_ids
+
+        # 代码块版本也可以被检索，且旧的检索结果被替换
+        manager.add_message(storage.store(UserMessage(content='which csv file did load_csv read?')))
+        manager.config.max_tokens = 450
+        manager.compress()
+        retrieved = [m for m in manager.messages if m.content.startswith('<retrieved_context>')]
+        assert len(retrieved) == 1
+        assert 'sales_2024.csv' in retrieved[0].content
+
+    @pytest.mark.unit
+    def test_index_is_incremental_and_persisted(self):
+        manager, index = self._context(rounds=5)
+        retriever = manager.compressor.retriever
+        assert retriever.update() > 0
+        assert retriever.update() == 0
+
+        manager.add_message(manager.message_store.store(UserMessage(content='new message')))
+        assert retriever.update() == 1
+
+        restored = RetrievalIndex.model_validate_json(index.model_dump_json())
+        assert len(restored.bm25) == len(index.bm25)
+        assert restored.blocks_indexed == 1
+
+
+class TestContextBudget:
+    """按模型上下文长度计算预算"""
+
+    @pytest.mark.unit
+    def test_budget_from_context_length(self):
+        manager = ContextManager(MessageStorage(), ContextData(), {'max_tokens': 100000})
+        manager.set_budget(32000, reserved_tokens=8192 + 808)
+        assert manager.config.max_tokens == 23000
+
+        # 预留过多时至少保留一半
+        manager.set_budget(8192, reserved_tokens=8192)
+        assert manager.config.max_tokens == 4096
+
+        # 模型未知时使用配置的值
+        manager.set_budget(None, reserved_tokens=8192)
+        assert manager.config.max_tokens == 100000
+
+    @pytest.mark.unit
+    def test_budget_triggers_compression(self):
+        storage = MessageStorage()
+        manager = ContextManager(storage, ContextData(), {'strategy': 'sliding_window', 'max_tokens': 100000})
+        manager.add_message(storage.store(SystemMessage(content='system')))
+        for i in range(50):
+            manager.add_message(storage.store(UserMessage(content=f'message {i} ' + 'word ' * 40)))
+        tokens = manager.total_tokens
+
+        manager.set_budget(tokens, reserved_tokens=tokens // 4)
+        manager.get_messages()
+        assert manager.total_tokens <= manager.config.max_tokens < tokens
+
+    @pytest.mark.unit
+    def test_manual_max_tokens_disables_auto_budget(self):
+        manager = ContextManager(MessageStorage(), ContextData(), {'max_tokens': 100000})
+        manager.set_budget(200000, reserved_tokens=8192)
+        assert manager.config.max_tokens == 191808
+
+        config = manager.config
+        config.max_tokens = 5000
+        config.auto_budget = False
+        manager.update_config(config)
+        manager.set_budget(128000, reserved_tokens=8192)
+        assert manager.config.max_tokens == 5000
+
+    @pytest.mark.unit
+    def test_count_tokens(self):
+        manager = ContextManager(MessageStorage(), ContextData())
+        text = '{"type": "function", "function": {"name": "search"}}'
+        assert manager.count_tokens(text, 'tools:1') > 0
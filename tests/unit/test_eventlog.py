@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the segmented event log
+"""
+
+import sys
+import gzip
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.aipy.task import TaskData
+from aipyapp.aipy.events import StepDeletedEvent, StepStartedEvent
+from aipyapp.aipy.eventlog import EventLog, INDEX_FILE
+from aipyapp.aipy.journal import TaskJournal, read_journal, JOURNAL_FILE
+
+
+def make_events(count: int):
+    return [StepDeletedEvent(step_index=i, step_info='x', cleaned_messages=0, tokens_saved=0, timestamp=float(i))
+            for i in range(count)]
+
+
+class TestEventLog:
+    """事件日志测试"""
+
+    @pytest.mark.unit
+    def test_append_only_new_events(self, tmp_path):
+        events = make_events(25)
+        log = EventLog(tmp_path, {'segment_events': 10})
+        assert log.append(events[:3]) == 3
+        assert log.append(events[:3]) == 0
+        assert log.append(events) == 22
+
+        assert sorted(p.name for p in tmp_path.glob('*.gz')) == ['00000.ndjson.gz', '00001.ndjson.gz', '00002.ndjson.gz']
+        assert [(e['seg'], e['off']) for e in log.entries[9:11]] == [(0, 9), (1, 0)]
+        assert [e.step_index for e in EventLog(tmp_path).load()] == list(range(25))
+
+    @pytest.mark.unit
+    def test_append_tail(self, tmp_path):
+        events = make_events(8)
+        log = EventLog(tmp_path)
+        log.append(events[:5])
+        assert log.append(events[5:], offset=5) == 3
+        assert log.append(events[5:], offset=5) == 0
+        assert [e.step_index for e in EventLog(tmp_path).load()] == list(range(8))
+        with pytest.raises(ValueError):
+            log.append(events[:1], offset=9)
+
+    @pytest.mark.unit
+    def test_pending_events_merged_on_load(self):
+        """事件还没有读入内存时新事件单独保存，读入时追加到末尾"""
+        loads = []
+
+        def load():
+            loads.append(1)
+            return make_events(2)
+
+        data = TaskData()
+        data.defer('events', load)
+        event = StepStartedEvent(instruction='go', step=1)
+        data.append_deferred('events', event)
+        assert data.pending('events') == [event] and loads == []
+
+        assert [e.name for e in data.events] == ['step_deleted', 'step_deleted', 'step_started']
+        assert data.events[-1] is event and loads == [1]
+        assert data.pending('events') is None
+
+    @pytest.mark.unit
+    def test_stream_from_index(self, tmp_path):
+        events = make_events(25)
+        events.insert(12, StepStartedEvent(instruction='go', step=2, timestamp=11.5))
+        log = EventLog(tmp_path, {'segment_events': 10})
+        log.append(events[:5])
+        log.append(events)
+
+        assert [e.step_index for e in log.iter_events(names=['step_deleted'], since=7)] == list(range(7, 25))
+        assert [e.step_index for e in log.iter_events(names=['step_deleted'], since=21)] == [21, 22, 23, 24]
+        assert [e.name for e in log.iter_events(since=11.5)][:2] == ['step_started', 'step_deleted']
+        assert [e.name for e in log.iter_events(names=['step_started'])] == ['step_started']
+
+    @pytest.mark.unit
+    def test_recover_incomplete_write(self, tmp_path):
+        events = make_events(8)
+        log = EventLog(tmp_path)
+        log.append(events[:5])
+        # 事件写入后、索引写完之前中断
+        with open(tmp_path / '00000.ndjson.gz', 'ab') as f:
+            f.write(gzip.compress(b'{"name": "task_status"}\n'))
+        with open(tmp_path / INDEX_FILE, 'a', encoding='utf-8') as f:
+            f.write('{"seg": 0, "of')
+
+        log = EventLog(tmp_path)
+        assert len(log) == 5
+        log.append(events)
+        assert [e.step_index for e in EventLog(tmp_path).load()] == list(range(8))
+
+    @pytest.mark.unit
+    def test_journal_skips_external_events(self, tmp_path):
+        data = TaskData()
+        data.events_external = True
+        journal = TaskJournal(tmp_path, data)
+        data.events.extend(make_events(2))
+        journal.append()
+
+        types = [record['type'] for record in read_journal(tmp_path / JOURNAL_FILE)]
+        assert 'events' not in types
+        journal.snapshot()
+        assert TaskData.model_validate_json((tmp_path / 'task.json').read_text()).events == []
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the append-only task journal
+"""
+
+import sys
+import json
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.llm import UserMessage, AIMessage
+from aipyapp.aipy.task import TaskData
+from aipyapp.aipy.step import StepData, Round
+from aipyapp.aipy.response import Response
+from aipyapp.aipy.blocks import CodeBlock
+from aipyapp.aipy.events import StepDeletedEvent
+from aipyapp.aipy.journal import TaskJournal, load_task_dict, read_journal, TASK_FILE, JOURNAL_FILE
+from aipyapp.aipy.msgstore import MessageStore
+from aipyapp.aipy.context import DefaultTokenEstimator
+
+ESTIMATOR = DefaultTokenEstimator()
+
+
+def add_step(data: TaskData, instruction: str, rounds: int = 1):
+    storage = data.message_storage
+    message = storage.store(UserMessage(content=instruction))
+    step = StepData(initial_instruction=message, instruction=instruction)
+    data.add_step(step)
+    data.context.append(message, ESTIMATOR)
+    for i in range(rounds):
+        add_round(data, f'{instruction} reply {i}')
+    return step
+
+
+def add_round(data: TaskData, content: str):
+    reply = data.message_storage.store(AIMessage(content=content))
+    data.steps[-1].rounds.append(Round(llm_response=Response(message=reply)))
+    data.context.append(reply, ESTIMATOR)
+
+
+def load(path: Path) -> TaskData:
+    return TaskData.model_validate(load_task_dict(path / TASK_FILE))
+
+
+def dump(data: TaskData) -> dict:
+    """与写入 task.json 再读取的结果比较"""
+    data = TaskData.model_validate_json(data.model_dump_json(exclude_none=True))
+    return json.loads(data.model_dump_json(exclude_none=True, exclude={'journal_seq'}))
+
+
+class TestTaskJournal:
+    """任务日志测试"""
+
+    @pytest.mark.unit
+    def test_append_only_writes_delta(self, tmp_path):
+        data = TaskData()
+        journal = TaskJournal(tmp_path, data)
+        add_step(data, 'first', rounds=2)
+        data.blocks.add_block(CodeBlock(name='main', lang='text', code='hello'), validate=False)
+
+        assert journal.append() > 0
+        assert journal.append() == 0
+        assert not (tmp_path / TASK_FILE).exists()
+
+        add_round(data, 'third reply')
+        data.steps[0].mark_context_deleted(0)
+        data.context.remove({data.steps[0].rounds[0].llm_response.message.id})
+        data.context.total_tokens = data.context.estimated_tokens
+        journal.append()
+        records = read_journal(tmp_path / JOURNAL_FILE)
+        assert [record['type'] for record in records][-4:] == ['messages', 'round', 'deleted', 'context_delta']
+        # 上下文只记录增删的消息
+        assert records[-1]['data']['ops'] == [['+', [data.context.messages[-1].id]], ['-', [1]]]
+        assert dump(load(tmp_path)) == dump(data)
+
+        # 直接修改上下文的消息列表时记录完整的上下文
+        data.context.messages.pop()
+        journal.append()
+        assert read_journal(tmp_path / JOURNAL_FILE)[-1]['type'] == 'context'
+        assert dump(load(tmp_path)) == dump(data)
+
+    @pytest.mark.unit
+    def test_shared_messages_journal_ids(self, tmp_path):
+        """已写入共享消息存储的消息在日志中只记录 ID"""
+        store = MessageStore(tmp_path / 'messages.db')
+        data = TaskData()
+        data.message_storage.attach(store)
+        journal = TaskJournal(tmp_path, data)
+        step = add_step(data, 'first')
+        data.message_storage.persist()
+        journal.append()
+
+        records = {record['type']: record['data'] for record in read_journal(tmp_path / JOURNAL_FILE)}
+        assert records['shared'] == [step.initial_instruction.id]
+        assert step.initial_instruction.id not in records['messages']
+
+        loaded = TaskData.model_validate(load_task_dict(tmp_path / TASK_FILE), context={'message_store': store})
+        journal = TaskJournal(tmp_path / 'loaded', loaded)
+        journal.snapshot()
+        # 从共享存储读取的消息不再写入日志
+        assert loaded.message_storage.get(step.initial_instruction.id).content == 'first'
+        add_round(loaded, 'second reply')
+        loaded.message_storage.persist()
+        journal.append()
+        records = {record['type']: record['data'] for record in read_journal(tmp_path / 'loaded' / JOURNAL_FILE)}
+        assert list(records['messages']) == [loaded.context.messages[-1].id]
+        assert 'shared' not in records
+        store.close()
+
+    @pytest.mark.unit
+    def test_incomplete_record_is_ignored(self, tmp_path):
+        data = TaskData()
+        journal = TaskJournal(tmp_path, data)
+        add_step(data, 'first')
+        journal.append()
+        with open(tmp_path / JOURNAL_FILE, 'a', encoding='utf-8') as f:
+            f.write('{"seq": 99, "type": "rou')
+
+        assert dump(load(tmp_path)) == dump(data)
+
+    @pytest.mark.unit
+    def test_snapshot_skips_replayed_records(self, tmp_path):
+        data = TaskData()
+        journal = TaskJournal(tmp_path, data)
+        add_step(data, 'first')
+        data.events.append(StepDeletedEvent(step_index=1, step_info='x', cleaned_messages=0, tokens_saved=0))
+        journal.append()
+        stale = (tmp_path / JOURNAL_FILE).read_text()
+
+        journal.snapshot()
+        assert not (tmp_path / JOURNAL_FILE).exists()
+        # 写快照后、清空日志前中断：日志中的记录已经包含在快照中
+        (tmp_path / JOURNAL_FILE).write_text(stale)
+        loaded = load(tmp_path)
+        assert len(loaded.events) == 1
+        assert dump(loaded) == dump(data)
+
+    @pytest.mark.unit
+    def test_structural_change_writes_snapshot(self, tmp_path):
+        data = TaskData()
+        journal = TaskJournal(tmp_path, data, {'snapshot_records': 1000})
+        add_step(data, 'first')
+        add_step(data, 'second')
+        journal.append()
+
+        data.steps.pop(1)
+        journal.append()
+        assert (tmp_path / TASK_FILE).exists()
+        assert not (tmp_path / JOURNAL_FILE).exists()
+        assert dump(load(tmp_path)) == dump(data)
+
+    @pytest.mark.unit
+    def test_loaded_task_without_snapshot(self, tmp_path):
+        data = TaskData()
+        add_step(data, 'first')
+        # 加载的任务保存到新目录时先写快照，日志只记录之后的增量
+        journal = TaskJournal(tmp_path, data)
+        add_round(data, 'more')
+        journal.append()
+        assert (tmp_path / TASK_FILE).exists()
+        assert dump(load(tmp_path)) == dump(data)
@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for LLM client infrastructure
+"""
+
+import asyncio
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from collections import Counter
+from pathlib import Path
+
+import httpx
+import openai
+import pytest
+from openai.types import CompletionUsage
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.llm import ClientManager, AIMessage, ErrorMessage
+from aipyapp.aipy.client import StreamProcessor
+from aipyapp.llm.base import BaseClient
+from aipyapp.llm.client_claude import ClaudeClient
+from aipyapp.llm.config import ClientConfig
+from aipyapp.llm.breaker import CircuitBreaker, CircuitState
+from aipyapp.llm.ratelimit import RateLimiter, parse_retry_after
+from aipyapp.llm.replay import ReplayCache
+from aipyapp.llm.routing import Router, RequestRace
+from aipyapp.llm.transport import HttpClientPool, HttpPoolConfig
+
+
+def api_error(cls, status: int) -> Exception:
+    response = httpx.Response(status, request=httpx.Request('POST', 'https://api.example.com/v1'))
+    return cls(f'HTTP {status}', response=response, body=None)
+
+
+class FakeClient(BaseClient):
+    """按脚本返回结果的测试客户端"""
+    MODEL = 'fake'
+
+    def __init__(self, outcomes, **kwargs):
+        super().__init__(ClientConfig(name='fake', stream=False, **kwargs))
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get_completion(self, messages, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    async def aget_completion(self, messages, **kwargs):
+        return self.get_completion(messages, **kwargs)
+
+    def _parse_usage(self, response):
+        return Counter()
+
+    def _parse_stream_response(self, response, stream_processor):
+        raise NotImplementedError
+
+    def _parse_response(self, response):
+        return AIMessage(content=response)
+
+
+class TestHttpClientPool:
+    """共享 HTTP 连接池测试"""
+
+    @pytest.mark.unit
+    def test_same_origin_shares_client(self):
+        """同一 origin 复用同一个 httpx.Client"""
+        pool = HttpClientPool()
+        c1 = pool.get('https://api.example.com/v1')
+        c2 = pool.get('https://API.example.com/v2/')
+        c3 = pool.get('https://other.example.com/v1')
+        assert c1 is c2
+        assert c1 is not c3
+        assert len(pool) == 2
+        pool.close()
+        assert c1.is_closed
+
+    @pytest.mark.unit
+    def test_tls_verify_is_part_of_key(self):
+        """TLS 校验选项不同时不共享连接"""
+        pool = HttpClientPool()
+        assert pool.get('https://api.example.com', verify=True) is not pool.get('https://api.example.com', verify=False)
+        pool.close()
+
+    @pytest.mark.unit
+    def test_config_from_dict(self):
+        """支持 dict 配置"""
+        pool = HttpClientPool({'max_connections': 8, 'keepalive_expiry': 5})
+        assert isinstance(pool.config, HttpPoolConfig)
+        assert pool.config.max_connections == 8
+        pool.close()
+
+    @pytest.mark.unit
+    def test_client_manager_binds_pool(self):
+        """ClientManager 创建的客户端共享连接池"""
+        settings = {
+            'a': {'type': 'openai', 'api_key': 'key-a', 'base_url': 'https://api.example.com/v1'},
+            'b': {'type': 'openai', 'api_key': 'key-b', 'base_url': 'https://api.example.com/v1'},
+        }
+        manager = ClientManager(settings)
+        a, b = manager.get_client('a'), manager.get_client('b')
+        assert a._get_http_client() is b._get_http_client()
+        manager.close()
+
+
+class TestAsyncCall:
+    """异步调用测试"""
+
+    @pytest.mark.unit
+    async def test_acall_retries_without_blocking(self, monkeypatch):
+        """可重试错误后成功返回"""
+        sleeps = []
+
+        async def fake_sleep(delay):
+            sleeps.append(delay)
+
+        monkeypatch.setattr('aipyapp.llm.base.asyncio.sleep', fake_sleep)
+        client = FakeClient([httpx.ConnectError('down'), 'ok'])
+        msg = await client.acall([{'role': 'user', 'content': 'hi'}])
+        assert isinstance(msg, AIMessage)
+        assert msg.content == 'ok'
+        assert msg.usage['retries'] == 1
+        assert len(sleeps) == 1
+
+    @pytest.mark.unit
+    async def test_stream_closed_when_cancelled(self):
+        """流式读取被取消时关闭响应，释放连接"""
+        class Stream:
+            closed = False
+
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                raise asyncio.CancelledError()
+
+            async def close(self):
+                self.closed = True
+
+        class Processor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                return False
+
+        stream = Stream()
+        client = ClaudeClient(ClientConfig(name='claude', type='claude', api_key='key'))
+        with pytest.raises(asyncio.CancelledError):
+            await client._aparse_stream_response(stream, Processor())
+        assert stream.closed
+
+    @pytest.mark.unit
+    async def test_acall_gives_up_after_max_attempts(self, monkeypatch):
+        """超过最大重试次数返回错误消息，最后一次不再等待"""
+        sleeps = []
+
+        async def fake_sleep(delay):
+            sleeps.append(delay)
+
+        monkeypatch.setattr('aipyapp.llm.base.asyncio.sleep', fake_sleep)
+        client = FakeClient([httpx.ConnectError('down')] * 3)
+        msg = await client.acall([{'role': 'user', 'content': 'hi'}])
+        assert isinstance(msg, ErrorMessage)
+        assert client.calls == 3
+        assert len(sleeps) == 2
+
+
+class TestReplayCache:
+    """LLM 响应录制/重放测试"""
+
+    MESSAGES = [{'role': 'user', 'content': 'hi'}]
+
+    @pytest.mark.unit
+    def test_record_then_replay(self, tmp_path):
+        """录制后重放不再调用 LLM，任务 ID 头不影响命中"""
+        recorder = FakeClient(['ok'])
+        recorder.bind_replay_cache(ReplayCache({'mode': 'record', 'path': str(tmp_path)}))
+        assert recorder(self.MESSAGES, extra_headers={'Aipy-Task-ID': 'a'}).content == 'ok'
+
+        player = FakeClient([])
+        player.bind_replay_cache(ReplayCache({'mode': 'replay', 'path': str(tmp_path)}))
+        msg = player(self.MESSAGES, extra_headers={'Aipy-Task-ID': 'b'})
+        assert isinstance(msg, AIMessage)
+        assert msg.content == 'ok'
+        assert player.calls == 0
+
+    @pytest.mark.unit
+    def test_replay_miss_does_not_call_llm(self, tmp_path):
+        """重放模式未命中时返回错误"""
+        player = FakeClient([])
+        player.bind_replay_cache(ReplayCache({'mode': 'replay', 'path': str(tmp_path)}))
+        msg = player([{'role': 'user', 'content': 'other'}])
+        assert isinstance(msg, ErrorMessage)
+        assert player.calls == 0
+
+
+class TestRouter:
+    """请求路由测试"""
+
+    @pytest.mark.unit
+    def test_plan_uses_role_fallback(self):
+        """角色备用列表优先于全局备用列表，不可用的名称被忽略"""
+        router = Router({'fallback': ['b'], 'roles': {'coder': ['c', 'missing', 'b']}})
+        assert router.plan('a', ['a', 'b', 'c']) == ['a', 'b']
+        assert router.plan('a', ['a', 'b', 'c'], role='coder') == ['a', 'c', 'b']
+
+    @pytest.mark.unit
+    def test_unhealthy_clients_are_demoted(self):
+        """错误率高的客户端排在健康客户端之后，备用客户端按延迟排序"""
+        router = Router({'fallback': ['b', 'c'], 'min_samples': 2})
+        router.record('b', 5.0)
+        router.record('c', 1.0)
+        assert router.plan('a', ['a', 'b', 'c']) == ['a', 'c', 'b']
+
+        for _ in range(3):
+            router.record('a', 1.0, error=True)
+        assert not router.healthy('a')
+        assert router.plan('a', ['a', 'b', 'c']) == ['c', 'b', 'a']
+
+    @pytest.mark.unit
+    def test_race_has_single_winner(self):
+        """对冲请求只有一个胜出者"""
+        race = RequestRace()
+        assert race.claim('a')
+        assert not race.claim('b')
+        assert race.claim('a')
+        assert race.winner == 'a'
+
+    @pytest.mark.unit
+    def test_race_cancels_losers(self):
+        """胜出时取消其它请求，输掉之后注册的立即取消"""
+        race = RequestRace()
+        cancelled = []
+        race.on_cancel('a', lambda: cancelled.append('a'))
+        race.on_cancel('b', lambda: cancelled.append('b'))
+        assert race.claim('a')
+        assert cancelled == ['b']
+        race.on_cancel('c', lambda: cancelled.append('c'))
+        race.on_cancel('a', lambda: cancelled.append('a'))
+        assert cancelled == ['b', 'c']
+        assert race.lost('b') and not race.lost('a')
+
+    @pytest.mark.unit
+    def test_sync_loser_stops_retrying(self):
+        """同步对冲请求输掉竞争后不再重试，也不等完重试间隔"""
+        race = RequestRace()
+        sp = StreamProcessor(SimpleNamespace(emit=lambda *args, **kwargs: None), 'fake', race=race)
+        client = FakeClient([httpx.ConnectError('down'), 'late'])
+        client._retry.backoff_base = 10
+        timer = threading.Timer(0.05, race.claim, args=('other',))
+        timer.start()
+        start = time.monotonic()
+        msg = client([{'role': 'user', 'content': 'hi'}], stream_processor=sp)
+        timer.join()
+        assert isinstance(msg, ErrorMessage) and 'lost the race' in msg.content
+        assert client.calls == 1
+        assert time.monotonic() - start < 5
+
+
+class TestRateLimiter:
+    """限速器测试"""
+
+    @pytest.mark.unit
+    def test_rpm_reservations_queue_up(self):
+        """额度用完后按补充速率排队"""
+        limiter = RateLimiter(rpm=60)
+        delays = [limiter.reserve() for _ in range(62)]
+        assert delays[:60] == [0.0] * 60
+        assert delays[60] == pytest.approx(1.0, abs=0.05)
+        assert delays[61] == pytest.approx(2.0, abs=0.05)
+        assert limiter.stats()['waits'] == 2
+
+    @pytest.mark.unit
+    def test_tpm_settles_actual_usage(self):
+        """按实际用量修正 token 额度"""
+        limiter = RateLimiter(tpm=600)
+        assert limiter.reserve(100) == 0.0
+        limiter.settle(100, 700)
+        assert limiter.reserve(10) > 0
+
+    @pytest.mark.unit
+    def test_retry_after_header(self):
+        """解析 Retry-After 响应头"""
+        request = httpx.Request('POST', 'https://api.example.com/v1/chat/completions')
+        response = httpx.Response(429, headers={'Retry-After': '7'}, request=request)
+        error = httpx.HTTPStatusError('429', request=request, response=response)
+        assert parse_retry_after(error) == 7.0
+        assert parse_retry_after(ValueError('x')) is None
+
+    @pytest.mark.unit
+    def test_to_records_include_rate_limit(self):
+        """/llm 列表包含限速统计"""
+        settings = {'a': {'type': 'openai', 'api_key': 'key', 'rpm': 10}}
+        manager = ClientManager(settings)
+        record = manager.to_records()[0]
+        assert record.Max_Tokens == 8192
+        assert record.Rate_Limit == '10 rpm / - tpm'
+        assert record.Waits == 0
+
+
+class TestPromptCache:
+    """提示词缓存测试"""
+
+    MESSAGES = [
+        {'role': 'system', 'content': 'system prompt'},
+        {'role': 'user', 'content': 'hi'},
+        {'role': 'assistant', 'content': 'hello'},
+        {'role': 'user', 'content': 'next'},
+    ]
+
+    @pytest.mark.unit
+    def test_claude_cache_breakpoints(self):
+        """系统提示词和最后一条消息设置 cache_control，不修改原消息"""
+        client = ClaudeClient(ClientConfig(name='claude', type='claude', api_key='key'))
+        messages, system = client._prepare_messages(self.MESSAGES)
+        assert client.get_api_params(system=system)['system'] == system
+        assert system[0]['cache_control'] == {'type': 'ephemeral'}
+        assert messages[-1]['content'][0] == {'type': 'text', 'text': 'next', 'cache_control': {'type': 'ephemeral'}}
+        assert messages[0]['content'] == 'hi'
+        assert self.MESSAGES[-1]['content'] == 'next'
+
+    @pytest.mark.unit
+    def test_prompt_cache_can_be_disabled(self):
+        """prompt_cache = false 时不设置缓存断点"""
+        client = ClaudeClient(ClientConfig(name='claude', type='claude', api_key='key', prompt_cache=False))
+        messages, system = client._prepare_messages(self.MESSAGES)
+        assert client.get_api_params(system=system)['system'] == 'system prompt'
+        assert messages[-1]['content'] == 'next'
+
+    @pytest.mark.unit
+    async def test_concurrent_requests_keep_own_system_prompt(self):
+        """并发请求共享客户端实例，系统提示词按请求传递"""
+        client = ClaudeClient(ClientConfig(name='claude', type='claude', api_key='key', stream=False, prompt_cache=False))
+
+        async def aget_completion(messages, **kwargs):
+            await asyncio.sleep(0)
+            return client.get_api_params(**kwargs)['system']
+
+        client.aget_completion = aget_completion
+        client._parse_response = lambda response: AIMessage(content=response)
+        results = await asyncio.gather(*[
+            client.acall([{'role': 'system', 'content': f'system {i}'}, {'role': 'user', 'content': 'hi'}])
+            for i in range(3)
+        ])
+        assert [msg.content for msg in results] == ['system 0', 'system 1', 'system 2']
+
+    @pytest.mark.unit
+    def test_openai_prompt_cache_key_and_usage(self):
+        """只有 OpenAI 发送 prompt_cache_key，缓存命中数计入 usage"""
+        manager = ClientManager({
+            'openai': {'type': 'openai', 'api_key': 'key'},
+            'deepseek': {'type': 'deepseek', 'api_key': 'key'},
+        })
+        openai_client, deepseek = manager.get_client('openai'), manager.get_client('deepseek')
+        key = openai_client.get_api_params(messages=self.MESSAGES)['prompt_cache_key']
+        assert key == openai_client.get_api_params(messages=self.MESSAGES[:2])['prompt_cache_key']
+        assert 'prompt_cache_key' not in deepseek.get_api_params(messages=self.MESSAGES)
+
+        usage = CompletionUsage(prompt_tokens=1000, completion_tokens=10, total_tokens=1010,
+                                prompt_tokens_details={'cached_tokens': 800})
+        assert openai_client._parse_usage(usage)['cached_tokens'] == 800
+
+
+class TestCircuitBreaker:
+    """熔断器测试"""
+
+    CONFIG = {'window': 4, 'min_requests': 4, 'error_threshold': 0.5, 'cooldown': 60}
+
+    @pytest.mark.unit
+    def test_opens_on_error_rate_and_fails_fast(self):
+        """错误率达到阈值后熔断，客户端直接返回错误"""
+        breaker = CircuitBreaker(self.CONFIG)
+        for success in (True, False, True, False):
+            assert breaker.allow()
+            breaker.record(success)
+        assert breaker.state == CircuitState.OPEN
+        assert not breaker.allow()
+
+        client = FakeClient(['ok'])
+        client.bind_circuit_breaker(breaker)
+        assert isinstance(client([{'role': 'user', 'content': 'hi'}]), ErrorMessage)
+        assert client.calls == 0
+        assert breaker.stats()['rejected'] == 2
+
+    @pytest.mark.unit
+    def test_half_open_trial_request(self):
+        """没有探测函数时，cooldown 后放行一个试探请求"""
+        breaker = CircuitBreaker(self.CONFIG)
+        for _ in range(4):
+            breaker.record(False)
+        breaker._opened_at -= 60
+        assert breaker.allow()
+        assert breaker.state == CircuitState.HALF_OPEN
+        assert not breaker.allow()
+        breaker.record(True)
+        assert breaker.state == CircuitState.CLOSED
+
+    @pytest.mark.unit
+    async def test_cancelled_trial_is_released(self):
+        """试探请求被取消时归还名额，非重试的 5xx 错误计为失败"""
+        breaker = CircuitBreaker(self.CONFIG)
+        for _ in range(4):
+            breaker.record(False)
+        breaker._opened_at -= 60
+
+        client = FakeClient([asyncio.CancelledError(), api_error(openai.InternalServerError, 500)])
+        client.bind_circuit_breaker(breaker)
+        with pytest.raises(asyncio.CancelledError):
+            await client.acall([{'role': 'user', 'content': 'hi'}])
+        assert breaker.state == CircuitState.HALF_OPEN
+        assert isinstance(await client.acall([{'role': 'user', 'content': 'hi'}]), ErrorMessage)
+        assert client.calls == 2
+        assert breaker.state == CircuitState.OPEN
+
+    @pytest.mark.unit
+    def test_client_errors_are_neutral(self, monkeypatch):
+        """4xx 和 429 不计入错误率，半开状态下归还试探名额"""
+        monkeypatch.setattr('aipyapp.llm.base.time.sleep', lambda delay: None)
+        breaker = CircuitBreaker(self.CONFIG)
+        client = FakeClient([api_error(openai.BadRequestError, 400)] * 4 +
+                            [api_error(openai.RateLimitError, 429), 'ok'])
+        client.bind_circuit_breaker(breaker)
+        for _ in range(4):
+            assert isinstance(client([{'role': 'user', 'content': 'hi'}]), ErrorMessage)
+        assert breaker.state == CircuitState.CLOSED
+        assert isinstance(client([{'role': 'user', 'content': 'hi'}]), AIMessage)
+        assert breaker.stats()['failures'] == 0
+
+        for _ in range(4):
+            breaker.record(False)
+        breaker._opened_at -= 60
+        client.outcomes = [api_error(openai.BadRequestError, 400)]
+        assert isinstance(client([{'role': 'user', 'content': 'hi'}]), ErrorMessage)
+        assert breaker.state == CircuitState.HALF_OPEN
+        assert breaker.allow()
+
+    @pytest.mark.unit
+    def test_background_probe(self):
+        """后台探测成功后关闭熔断，失败则加倍 cooldown"""
+        results = [False, True]
+        breaker = CircuitBreaker(self.CONFIG, probe=lambda: results.pop(0))
+        for _ in range(4):
+            breaker.record(False)
+        breaker.close()
+        breaker._run_probe()
+        breaker.close()
+        assert breaker.state == CircuitState.OPEN
+        assert breaker._cooldown == 120
+        breaker._run_probe()
+        assert breaker.state == CircuitState.CLOSED
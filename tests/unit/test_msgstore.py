@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the shared message store
+"""
+
+import sys
+import json
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.llm import UserMessage, AIMessage, SystemMessage, ToolMessage
+from aipyapp.aipy.chat import ChatMessage, MessageStorage
+from aipyapp.aipy.msgstore import MessageStore, create_message_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MessageStore(tmp_path / 'messages.db')
+    yield store
+    store.close()
+
+
+class TestMessageStore:
+    """共享消息存储测试"""
+
+    @pytest.mark.unit
+    def test_disabled_by_default(self, tmp_path):
+        assert create_message_store(None) is None
+        assert create_message_store({'enable': True, 'path': str(tmp_path / 'm.db')}) is not None
+
+    @pytest.mark.unit
+    def test_put_and_get(self, store):
+        messages = {'a': ToolMessage(content='output', tool_call_id='call_1'), 'b': UserMessage(content='hi')}
+        assert store.put_many(messages) == 2
+        assert store.put_many(messages) == 0
+        assert store.get('a') == messages['a']
+        assert store.get('missing') is None
+        assert store.get_many(['a', 'b', 'missing']) == messages
+        assert len(store) == 2
+
+    @pytest.mark.unit
+    def test_task_file_keeps_only_ids(self, store):
+        storage = MessageStorage()
+        storage.attach(store)
+        system = storage.store(SystemMessage(content='system prompt ' * 100))
+        user = storage.store(UserMessage(content='question'))
+        ai = storage.store(AIMessage(content='answer', usage={'total_tokens': 10}))
+
+        # 序列化没有副作用，persist() 之前消息内容仍然保存在任务文件中
+        data = json.loads(storage.model_dump_json())
+        assert len(store) == 0 and data['shared'] == []
+        assert list(data['messages']) == [system.id, user.id, ai.id]
+
+        assert storage.persist() == 2
+        assert storage.persist() == 0
+        data = json.loads(storage.model_dump_json())
+        assert data['shared'] == [system.id, user.id]
+        assert list(data['messages']) == [ai.id]
+
+        loaded = MessageStorage.model_validate(data, context={'message_store': store})
+        assert len(loaded) == 3 and system.id in loaded
+        # 第一次访问时批量读取消息内容
+        assert loaded.messages.keys() == {ai.id}
+        message = ChatMessage.model_validate({'id': system.id}, context={'message_storage': loaded})
+        assert message.content == system.content
+        assert loaded.messages.keys() == {ai.id, system.id, user.id}
+        # 从共享存储读取的消息不会再次写入
+        assert loaded.persist() == 0
+
+        # 未读取的消息 ID 在再次保存时保留
+        unread = MessageStorage.model_validate(data, context={'message_store': store})
+        assert json.loads(unread.model_dump_json())['shared'] == [system.id, user.id]
+
+    @pytest.mark.unit
+    def test_shared_across_storages(self, store):
+        first, second = MessageStorage(), MessageStorage()
+        first.attach(store)
+        second.attach(store)
+        first.store(SystemMessage(content='same prompt'))
+        second.store(SystemMessage(content='same prompt'))
+        first.persist()
+        second.persist()
+        assert len(store) == 1
+
+    @pytest.mark.unit
+    def test_without_store_format_unchanged(self):
+        storage = MessageStorage()
+        storage.store(UserMessage(content='hi'))
+        assert 'shared' not in json.loads(storage.model_dump_json())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for step compaction policies
+"""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.llm import UserMessage, AIMessage, SystemMessage
+from aipyapp.aipy.chat import MessageStorage
+from aipyapp.aipy.context import ContextManager, ContextData, ContextConfig
+from aipyapp.aipy.response import Response
+from aipyapp.aipy.types import Errors
+from aipyapp.aipy.step import StepCleaner, StepData, Round, CompactPolicy
+
+
+@pytest.fixture
+def step_context():
+    """一个 Step：第 0、2 轮解析失败，第 1 轮正常，第 3 轮是最终回复"""
+    storage = MessageStorage()
+    manager = ContextManager(storage, ContextData(), ContextConfig(max_tokens=100000))
+    manager.add_message(storage.store(SystemMessage(content='system prompt')))
+    instruction = storage.store(UserMessage(content='fix the script'))
+    manager.add_message(instruction)
+
+    rounds = []
+    for i in range(4):
+        reply = storage.store(AIMessage(content=f'reply {i} ' + 'detail ' * 50))
+        manager.add_message(reply)
+        errors = Errors()
+        if i in (0, 2):
+            errors.add('parse error')
+        round = Round(llm_response=Response(message=reply, errors=errors or None))
+        if i < 3:
+            round.system_feedback = storage.store(UserMessage(content=f'feedback {i} ' + 'output ' * 50))
+            manager.add_message(round.system_feedback)
+        rounds.append(round)
+
+    step = SimpleNamespace(data=StepData(initial_instruction=instruction, instruction='fix the script', rounds=rounds))
+    return StepCleaner(manager), step, manager
+
+
+class TestStepCleaner:
+    """Step 压缩策略测试"""
+
+    @pytest.mark.unit
+    def test_dry_run_does_not_change_context(self, step_context):
+        cleaner, step, manager = step_context
+        before = (len(manager.messages), manager.total_tokens)
+
+        plans = {plan.policy: plan for plan in cleaner.preview(step)}
+        assert plans[CompactPolicy.NONE].tokens_saved == 0
+        assert plans[CompactPolicy.FAILED_ROUNDS].rounds == [0, 2]
+        assert plans[CompactPolicy.ALL_BUT_LAST].rounds == [0, 1, 2]
+        assert plans[CompactPolicy.ALL_BUT_LAST].messages == 6
+        summary = plans[CompactPolicy.SUMMARY_REPLACE]
+        assert 0 < summary.tokens_saved < plans[CompactPolicy.ALL_BUT_LAST].tokens_saved
+
+        assert (len(manager.messages), manager.total_tokens) == before
+        assert not any(round.context_deleted for round in step.data.rounds)
+
+    @pytest.mark.unit
+    def test_apply_matches_projection(self, step_context):
+        cleaner, step, manager = step_context
+        plan = cleaner.plan(step, 'failed-rounds')
+        tokens = manager.total_tokens
+
+        cleaned, remaining, saved, _ = cleaner.apply(step, plan)
+        assert cleaned == plan.messages == 4
+        assert saved == plan.tokens_saved == tokens - manager.total_tokens
+        assert [r.context_deleted for r in step.data.rounds] == [True, False, True, False]
+
+        # 已删除的 Round 不再计入
+        assert cleaner.plan(step, CompactPolicy.FAILED_ROUNDS).messages == 0
+
+    @pytest.mark.unit
+    def test_summary_replace(self, step_context):
+        cleaner, step, manager = step_context
+        plan = cleaner.plan(step, CompactPolicy.SUMMARY_REPLACE)
+        tokens = manager.total_tokens
+
+        cleaner.apply(step, plan)
+        contents = [msg.content for msg in manager.messages]
+        assert contents[:2] == ['system prompt', 'fix the script']
+        assert contents[2].startswith('<compacted_rounds>')
+        assert 'Round 1 [TEXT_ONLY]: reply 1' in contents[2]
+        assert contents[3].startswith('reply 3')
+        assert tokens - manager.total_tokens == plan.tokens_saved
+
+    @pytest.mark.unit
+    def test_min_tokens_saved(self, step_context):
+        cleaner, step, manager = step_context
+        projected = cleaner.plan(step, CompactPolicy.FAILED_ROUNDS).tokens_saved
+
+        cleaned, *_ = cleaner.compact_step(step, CompactPolicy.FAILED_ROUNDS, projected + 1)
+        assert cleaned == 0
+        cleaned, *_ = cleaner.compact_step(step, CompactPolicy.FAILED_ROUNDS, projected)
+        assert cleaned == 4
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the stub LLM server and phase timing
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import openai
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.llm.stub import StubServer, StubConfig, StubResponse, StubToolCall, split_tokens
+from aipyapp.aipy.timing import PhaseTimer
+from aipyapp.aipy.response import Response
+from aipyapp.aipy.chat import MessageStorage
+from aipyapp.llm import AIMessage
+
+
+@pytest.fixture
+def stub_server():
+    script = [
+        StubResponse(content='hello from the stub', reason='thinking',
+                     tool_calls=[StubToolCall(name='search', arguments={'q': 'aipy'})]),
+        StubResponse(content='done'),
+    ]
+    with StubServer(StubConfig(script=script)) as server:
+        yield server
+
+
+class TestStubServer:
+    """假 LLM 服务测试"""
+
+    @pytest.mark.unit
+    def test_streaming_with_usage_and_tool_calls(self, stub_server):
+        client = openai.Client(api_key='stub', base_url=stub_server.base_url)
+        chunks = list(client.chat.completions.create(
+            model='stub',
+            messages=[{'role': 'user', 'content': 'hi'}],
+            stream=True,
+            stream_options={'include_usage': True},
+        ))
+
+        content = ''.join(c.choices[0].delta.content or '' for c in chunks if c.choices)
+        arguments = ''.join(
+            tc.function.arguments or ''
+            for c in chunks if c.choices and c.choices[0].delta.tool_calls
+            for tc in c.choices[0].delta.tool_calls
+        )
+        assert content == 'hello from the stub'
+        assert arguments == '{"q": "aipy"}'
+        assert chunks[-1].usage.completion_tokens > 0
+        assert chunks[-2].choices[0].finish_reason == 'tool_calls'
+
+    @pytest.mark.unit
+    def test_script_advances_with_assistant_messages(self, stub_server):
+        client = openai.Client(api_key='stub', base_url=stub_server.base_url)
+        messages = [{'role': 'user', 'content': 'hi'}, {'role': 'assistant', 'content': 'x'}]
+        response = client.chat.completions.create(model='stub', messages=messages)
+        assert response.choices[0].message.content == 'done'
+
+        messages += [{'role': 'assistant', 'content': 'y'}]
+        response = client.chat.completions.create(model='stub', messages=messages)
+        assert response.choices[0].message.content == 'done'
+        assert stub_server.requests == 2
+
+    @pytest.mark.unit
+    def test_default_script_is_parsed(self):
+        """默认脚本包含可被 Response 解析的代码块和工具调用"""
+        storage = MessageStorage()
+        first, last = StubConfig().script
+        response = Response.from_message(storage.store(AIMessage(content=first.content)))
+        assert response.code_blocks[0].name == 'main'
+        assert response.tool_calls[0].name == 'Exec'
+        assert not response.errors
+
+        response = Response.from_message(storage.store(AIMessage(content=last.content)))
+        assert response.task_status.completed
+        assert not response.tool_calls
+
+    @pytest.mark.unit
+    def test_split_tokens(self):
+        assert ''.join(split_tokens('a  b\nc ')) == 'a  b\nc '
+        assert split_tokens('') == []
+
+
+class TestPhaseTimer:
+    """阶段耗时统计测试"""
+
+    @pytest.mark.unit
+    def test_nested_phases_are_exclusive(self):
+        timer = PhaseTimer()
+        mark = timer.snapshot()
+        with timer.measure('llm'):
+            time.sleep(0.02)
+            with timer.measure('events'):
+                time.sleep(0.03)
+
+        elapsed = timer.since(mark)
+        assert 0.015 < elapsed['llm'] < 0.03
+        assert elapsed['events'] >= 0.03
+        assert timer.counts['events'] == 1
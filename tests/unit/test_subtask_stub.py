@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for lazily loaded subtasks
+"""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from rich.tree import Tree
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.llm import UserMessage, AIMessage
+from aipyapp.aipy.task import Task, TaskData, SubTaskStub
+from aipyapp.aipy.step import StepData, Round
+from aipyapp.aipy.response import Response
+from aipyapp.cli.command.builtin.cmd_subtask import SubTaskCommand
+from aipyapp.aipy.journal import read_task_summary, TASK_FILE
+from aipyapp.aipy.taskfile import write_task_file, TASK_BIN_FILE
+
+
+class FakeTask:
+    pass
+
+
+def make_task(title: str, instruction: str) -> TaskData:
+    data = TaskData()
+    message = data.message_storage.store(UserMessage(content=instruction))
+    step = StepData(initial_instruction=message, instruction=instruction, title=title, start_time=10.0, end_time=13.0)
+    reply = data.message_storage.store(AIMessage(content='done\nmore details', usage={'input_tokens': 7, 'output_tokens': 3, 'total_tokens': 10}))
+    step.add_round(Round(llm_response=Response(message=reply)))
+    data.add_step(step)
+    return data
+
+
+class TestSubTaskStub:
+    """子任务占位测试"""
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize('name', [TASK_FILE, TASK_BIN_FILE])
+    def test_read_task_summary(self, tmp_path, name):
+        data = make_task('Child', 'do something')
+        path = tmp_path / name
+        if name == TASK_BIN_FILE:
+            write_task_file(path, data)
+        else:
+            path.write_text(data.model_dump_json(exclude_none=True), encoding='utf-8')
+
+        summary = read_task_summary(path)
+        assert summary['id'] == data.id
+        assert (summary['title'], summary['instruction'], summary['start_time'], summary['steps']) == \
+            ('Child', 'do something', 10.0, 1)
+        assert (summary['rounds'], summary['input_tokens'], summary['output_tokens'], summary['total_tokens']) == (1, 7, 3, 10)
+        assert summary['elapsed_time'] == 3
+        assert summary['response'] == 'done\nmore details'
+
+    @pytest.mark.unit
+    def test_load_on_access(self, tmp_path, monkeypatch):
+        loads = []
+
+        def from_file(path, manager, parent=None):
+            loads.append(path)
+            return SimpleNamespace(task_id='child', steps=['step'], parent=parent)
+
+        monkeypatch.setattr(Task, 'from_file', from_file)
+        parent = FakeTask()
+        summary = {'id': 'child', 'title': 'Child', 'instruction': 'do something', 'start_time': 10.0, 'steps': 1}
+        stub = SubTaskStub(tmp_path / TASK_FILE, None, parent, summary)
+
+        assert (stub.task_id, stub.instruction, stub.step_count) == ('child', 'do something', 1)
+        assert not stub.loaded and loads == []
+
+        assert stub.steps == ['step']
+        assert stub.parent is parent and stub.loaded
+        stub.steps
+        assert loads == [tmp_path / TASK_FILE]
+
+    @pytest.mark.unit
+    def test_list_does_not_load(self, tmp_path, monkeypatch):
+        def from_file(path, manager, parent=None):
+            raise AssertionError('subtask loaded')
+
+        monkeypatch.setattr(Task, 'from_file', from_file)
+        data = make_task('Child', 'do something')
+        path = tmp_path / TASK_BIN_FILE
+        write_task_file(path, data)
+        stub = SubTaskStub(path, None, FakeTask(), read_task_summary(path))
+
+        command = SubTaskCommand.__new__(SubTaskCommand)
+        instruction, response, stats = command._extract_subtask_data(stub)
+        assert (instruction, response) == ('do something', 'done...')
+        assert (stats['rounds'], stats['total_tokens'], stats['elapsed_time']) == (1, 10, 3)
+
+        tree = Tree('root')
+        command._add_subtask_to_tree(tree, stub)
+        assert not stub.loaded
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the binary task file format
+"""
+
+import sys
+import json
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from aipyapp.llm import UserMessage, AIMessage
+from aipyapp.aipy.task import TaskData
+from aipyapp.aipy.step import StepData, Round
+from aipyapp.aipy.response import Response
+from aipyapp.aipy.events import StepDeletedEvent
+from aipyapp.aipy.journal import TaskJournal, export_task_json, load_task_dict, TASK_FILE
+from aipyapp.aipy.taskfile import TaskFileReader, TaskFileError, open_task_file, write_task_file, TASK_BIN_FILE, MAGIC
+
+
+def make_task() -> TaskData:
+    """两个 Step，上下文中只保留最后一个 Step 的消息"""
+    data = TaskData()
+    storage = data.message_storage
+    for instruction in ('first', 'second'):
+        message = storage.store(UserMessage(content=instruction))
+        reply = storage.store(AIMessage(content=f'{instruction} reply'))
+        step = StepData(initial_instruction=message, instruction=instruction, start_time=len(data.steps) + 1.0)
+        step.rounds.append(Round(llm_response=Response(message=reply)))
+        data.add_step(step)
+        data.context.messages = [message, reply]
+    data.events.append(StepDeletedEvent(step_index=1, step_info='x', cleaned_messages=0, tokens_saved=0))
+    return data
+
+
+def dump(data: TaskData) -> dict:
+    return json.loads(data.model_dump_json(exclude_none=True))
+
+
+class TestTaskFile:
+    """二进制任务文件测试"""
+
+    @pytest.mark.unit
+    def test_lazy_sections(self, tmp_path):
+        data = make_task()
+        path = tmp_path / TASK_BIN_FILE
+        write_task_file(path, data)
+
+        loaded = open_task_file(path)
+        assert loaded.is_deferred('steps') and loaded.is_deferred('events')
+        assert loaded.summary == {'title': None, 'instruction': 'first', 'start_time': 1.0, 'steps': 2, 'rounds': 2,
+                                  'input_tokens': 0, 'output_tokens': 0, 'total_tokens': 0, 'elapsed_time': 0,
+                                  'response': 'second reply'}
+        # 上下文中的消息已经解码，其余消息在访问时解码
+        assert [msg.content for msg in loaded.context.messages] == ['second', 'second reply']
+        assert len(loaded.message_storage.messages) == 2
+        assert len(loaded.message_storage) == 4
+
+        assert loaded.steps[0].rounds[0].llm_response.message.content == 'first reply'
+        assert not loaded.is_deferred('steps')
+        assert len(loaded.message_storage.messages) == 4
+        assert dump(loaded) == dump(data)
+
+    @pytest.mark.unit
+    def test_sections_survive_rewrite(self, tmp_path):
+        """打开后文件被替换，延迟解码的段仍然来自打开时的内容"""
+        data = make_task()
+        path = tmp_path / TASK_BIN_FILE
+        write_task_file(path, data)
+        loaded = open_task_file(path)
+        write_task_file(path, TaskData())
+        assert dump(loaded) == dump(data)
+
+    @pytest.mark.unit
+    def test_invalid_file(self, tmp_path):
+        path = tmp_path / TASK_BIN_FILE
+        path.write_bytes(b'{"id": "x"}')
+        with pytest.raises(TaskFileError):
+            TaskFileReader(path)
+        path.write_bytes(MAGIC)
+        with pytest.raises(TaskFileError):
+            TaskFileReader(path)
+
+    @pytest.mark.unit
+    def test_binary_snapshot_with_journal(self, tmp_path):
+        data = make_task()
+        journal = TaskJournal(tmp_path, data, format='binary')
+        journal.append()
+        assert (tmp_path / TASK_BIN_FILE).exists()
+
+        # 快照之后的增量追加到日志，加载时应用到二进制快照上
+        reply = data.message_storage.store(AIMessage(content='more'))
+        data.steps[-1].rounds.append(Round(llm_response=Response(message=reply)))
+        journal.append()
+        loaded = TaskData.model_validate(load_task_dict(tmp_path / TASK_BIN_FILE))
+        assert dump(loaded) == dump(data)
+
+    @pytest.mark.unit
+    def test_export_json(self, tmp_path):
+        data = make_task()
+        write_task_file(tmp_path / TASK_BIN_FILE, data)
+
+        output = export_task_json(tmp_path / TASK_BIN_FILE, tmp_path / TASK_FILE)
+        exported = TaskData.model_validate_json(output.read_text(encoding='utf-8'))
+        assert dump(exported) == dump(data)